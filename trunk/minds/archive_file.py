@@ -0,0 +1,641 @@
+"""Usage: archive_file.py option [archive_dir]
+
+options:
+    -c  convert NNNNNN.zip archives to NNNNNN.dat and NNNNNN.idx
+    -v  verify the converted archives against the zip archives
+    -b n  benchmark disk footprint and read time of the first n archived
+          documents in zip, deflate and dict mode
+
+An alternative to the NNNNNN.zip archive container of docarchive. Each
+archive of up to 1000 documents is a pair of files.
+
+    NNNNNN.dat  append-only document data, each optionally deflated
+    NNNNNN.idx  fixed-width entries. Entry N describes document NNNNNNnnn
+
+    .idx entry (24 bytes little endian)
+        offset  Q   offset of the data in the .dat file
+        length  L   length of the (compressed) data
+        size    L   length of the document
+        crc     L   CRC-32 of the document
+        method  B   0 - no document, 1 - stored, 2 - deflated,
+                    3 - deflated with the preset dictionary
+        pad     3x
+
+Both files begin with an 8 bytes magic header. A gap in the .idx file
+reads as zeros, i.e. no document. Reading a document is a lookup of a
+fixed offset in the .idx plus one slice of the .dat. Both are read via
+mmap. Documents are only appended so an existing entry never changes.
+A reader remaps when it finds an entry beyond what it has mapped.
+
+Archived documents are small and repetitive: the same header fields,
+the same tags and the same site boilerplate. Deflating each one on its
+own finds little to match. In 'dict' compression mode an archive has a
+preset dictionary in NNNNNN.dic, trained from sample documents. A
+document is compressed as if it followed the dictionary text, so it can
+refer back to the common strings.
+
+The converter leaves the zip files in place. docarchive reads the .dat
+archive when there is one and falls back to the zip otherwise.
+"""
+
+import logging
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import zipfile
+import zlib
+
+from minds.config import cfg
+from minds.util import fileutil
+
+log = logging.getLogger('arcfile')
+
+
+IDX_MAGIC = 'MRAI\x01\x00\x00\x00'
+DAT_MAGIC = 'MRAD\x01\x00\x00\x00'
+DIC_MAGIC = 'MRAC\x01\x00\x00\x00'
+HEADER_SIZE = 8
+
+_structEntry = '<QLLLB3x'
+ENTRY_SIZE = struct.calcsize(_structEntry)
+
+MAX_ENTRY = 1000
+
+METHOD_NONE = 0
+METHOD_STORED = 1
+METHOD_DEFLATED = 2
+METHOD_DICT = 3
+
+# compress mode of ArchiveWriter
+COMPRESS_NONE = 'none'
+COMPRESS_DEFLATE = 'deflate'
+COMPRESS_DICT = 'dict'
+
+# the same level in every mode, zlib's default as in zipfile ZIP_DEFLATED
+COMPRESS_LEVEL = 6
+
+
+class BadArchive(Exception):
+    pass
+
+
+def idxPath(arc_path):
+    """ Return the .idx path of an archive path like NNNNNN.zip """
+    return os.path.splitext(arc_path)[0] + '.idx'
+
+
+def datPath(idx_path):
+    return os.path.splitext(idx_path)[0] + '.dat'
+
+
+def dicPath(idx_path):
+    return os.path.splitext(idx_path)[0] + '.dic'
+
+
+def compressMode(value):
+    """ Parse the archive.compress config: none|deflate|dict (or 0|1) """
+    value = str(value).strip().lower()
+    if value in ['0', 'none', 'false', 'no', 'off']:
+        return COMPRESS_NONE
+    if value == COMPRESS_DICT:
+        return COMPRESS_DICT
+    return COMPRESS_DEFLATE
+
+
+def _slot(name):
+    """ Return the entry number of filename, e.g. '789' -> 789 """
+    if not name.isdigit() or len(name) != 3:
+        raise KeyError(name)
+    return int(name)
+
+
+def _mmap(fp):
+    size = os.fstat(fp.fileno()).st_size
+    if size <= 0:
+        return ''
+    return mmap.mmap(fp.fileno(), size, access=mmap.ACCESS_READ)
+
+
+
+# ----------------------------------------------------------------------
+# Preset dictionary
+
+# zlib can refer back at most 32k - 262 bytes
+DICT_SIZE = 32768 - 262
+SAMPLE_SIZE = 200
+
+# used when there is no sample document
+DEFAULT_DICT = '\r\n'.join([
+    'uri: http://www.',
+    'date: 2006-01-01T00:00:00Z',
+    'content-type: text/html; charset=iso-8859-1',
+    'content-type: text/html; charset=utf-8',
+    'encoding: utf-8 [http]',
+    'referer: http://www.',
+    'etag: W/',
+    'last-modified: ',
+    'description: ',
+    'keywords: ',
+    'title: ',
+    '<h1></h1><h2></h2><h3></h3><ul><li></li></ul><ol><li></li></ol><dl><dt></dt><dd></dd></dl>',
+    '<br><hr><p>',
+    '', '',
+    ])
+
+
+def trainDictionary(samples, size=DICT_SIZE):
+    """ Build a preset dictionary from sample documents. Lines that
+        appear in more than one sample are scored by count * length. The
+        best ones go to the end, closest to the data, where zlib matches
+        them with the shortest distance.
+    """
+    counts = {}
+    for data in samples:
+        seen = {}
+        for line in data.split('\n'):
+            line = line.strip()
+            if len(line) < 4 or line in seen:
+                continue
+            seen[line] = 1
+            counts[line] = counts.get(line, 0) + 1
+
+    scored = [(n * len(line), line) for line, n in counts.items() if n > 1]
+    scored.sort()
+    result = [DEFAULT_DICT]
+    total = len(DEFAULT_DICT)
+    # take the best ones that fit and then reverse them to put the best at the end
+    best = []
+    for score, line in reversed(scored):
+        if total + len(line) + 1 > size:
+            continue
+        best.append(line)
+        total += len(line) + 1
+    best.reverse()
+    result.extend(best)
+    return '\n'.join(result)[-size:]
+
+
+class PresetDictionary(object):
+    """ Compress and decompress raw deflate data as if it follows the
+        dictionary text. This is the zlib preset dictionary emulated with
+        compressobj/decompressobj primed with the dictionary, since the
+        zlib module has no zdict parameter here. The priming is done once
+        and copied for each document when copy() is available.
+    """
+
+    def __init__(self, dictionary):
+        self.dictionary = dictionary
+        c = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+        # the sync flush ends the dictionary on a byte boundary
+        self.prefix = c.compress(dictionary) + c.flush(zlib.Z_SYNC_FLUSH)
+        d = zlib.decompressobj(-15)
+        d.decompress(self.prefix)
+        if hasattr(c, 'copy') and hasattr(d, 'copy'):
+            self.compressor, self.decompressor = c, d
+        else:
+            self.compressor = self.decompressor = None
+
+
+    def compress(self, data):
+        if self.compressor:
+            c = self.compressor.copy()
+        else:
+            c = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+            c.compress(self.dictionary)
+            c.flush(zlib.Z_SYNC_FLUSH)
+        return c.compress(data) + c.flush()
+
+
+    def decompress(self, data):
+        if self.decompressor:
+            d = self.decompressor.copy()
+            return d.decompress(data) + d.flush()
+        d = zlib.decompressobj(-15)
+        return (d.decompress(self.prefix + data) + d.flush())[len(self.dictionary):]
+
+
+def readDictionary(path):
+    """ Return the PresetDictionary in the .dic file path """
+    fp = file(path, 'rb')
+    try:
+        if fp.read(HEADER_SIZE) != DIC_MAGIC:
+            raise BadArchive('Not a dictionary file: %s' % path)
+        return PresetDictionary(fp.read())
+    finally:
+        fp.close()
+
+
+def writeDictionary(path, dictionary):
+    tmp_path = path + '.tmp'
+    fp = file(tmp_path, 'wb')
+    try:
+        fp.write(DIC_MAGIC)
+        fp.write(dictionary)
+    finally:
+        fp.close()
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def _previousSamples(path, n=SAMPLE_SIZE):
+    """ Return up to n of the last documents of the archive before path """
+    base = os.path.splitext(path)
+    dirname, arc = os.path.split(base[0])
+    if not arc.isdigit() or int(arc) <= 0:
+        return []
+    prev = os.path.join(dirname, '%06d%s' % (int(arc)-1, base[1]))
+    if not os.path.exists(prev):
+        return []
+    reader = ArchiveReader(prev)
+    try:
+        return [reader.read(name) for name in reader.namelist()[-n:]]
+    finally:
+        reader.close()
+
+
+
+class ArchiveReader(object):
+    """ Read documents of NNNNNN.dat/.idx. Thread safe. It has the same
+        interface as zipcache.ZipHandle so it can be kept in a ZipCache.
+    """
+
+    def __init__(self, path):
+        """ path - the .idx file """
+        self.path = path
+        self.lock = threading.Lock()
+        self.users = 0              # maintained by ZipCache
+        self.dropped = False
+        self.idxmap = self.datmap = ''
+        self.dictionary = None      # loaded on first METHOD_DICT document
+        self.idxfp = file(path, 'rb')
+        try:
+            self.datfp = file(datPath(path), 'rb')
+        except:
+            self.idxfp.close()
+            raise
+        try:
+            if self.idxfp.read(HEADER_SIZE) != IDX_MAGIC or \
+               self.datfp.read(HEADER_SIZE) != DAT_MAGIC:
+                raise BadArchive('Not an archive file: %s' % path)
+            self._remap()
+        except:
+            self._close()
+            raise
+
+
+    def _remap(self):
+        self._unmap()
+        self.idxmap = _mmap(self.idxfp)
+        self.datmap = _mmap(self.datfp)
+
+
+    def _unmap(self):
+        for m in (self.idxmap, self.datmap):
+            if m: m.close()
+        self.idxmap = self.datmap = ''
+
+
+    def _entry(self, slot):
+        """ Return (offset, length, size, crc, method) or None if no document
+            or it is beyond the mapped files.
+        """
+        pos = HEADER_SIZE + slot * ENTRY_SIZE
+        if pos + ENTRY_SIZE > len(self.idxmap):
+            return None
+        entry = struct.unpack(_structEntry, self.idxmap[pos:pos+ENTRY_SIZE])
+        if entry[4] == METHOD_NONE:
+            return None
+        if entry[0] + entry[1] > len(self.datmap):
+            return None
+        return entry
+
+
+    def isCurrent(self):
+        # entries are only appended and _entry() remaps for new ones
+        return os.path.exists(self.path)
+
+
+    def namelist(self):
+        self.lock.acquire()
+        try:
+            self._remap()
+            n = min(MAX_ENTRY, (len(self.idxmap) - HEADER_SIZE) / ENTRY_SIZE)
+            return ['%03d' % i for i in xrange(n) if self._entry(i)]
+        finally:
+            self.lock.release()
+
+
+    def read(self, name):
+        """ Return the document name. KeyError if not found.
+            ValueError if the reader is closed.
+        """
+        slot = _slot(name)
+        self.lock.acquire()
+        try:
+            if not self.idxfp:
+                raise ValueError('ArchiveReader closed: %s' % self.path)
+            entry = self._entry(slot)
+            if not entry:
+                # maybe it is added after it is mapped
+                self._remap()
+                entry = self._entry(slot)
+                if not entry:
+                    raise KeyError(name)
+            offset, length, size, crc, method = entry
+            data = self.datmap[offset:offset+length]
+        finally:
+            self.lock.release()
+
+        if method == METHOD_DEFLATED:
+            data = zlib.decompress(data)
+        elif method == METHOD_DICT:
+            if not self.dictionary:
+                self.dictionary = readDictionary(dicPath(self.path))
+            data = self.dictionary.decompress(data)
+        elif method != METHOD_STORED:
+            raise BadArchive('Unknown method %s for %s in %s' % (method, name, self.path))
+        if len(data) != size or (zlib.crc32(data) & 0xffffffffL) != crc:
+            raise BadArchive('Bad CRC-32 for %s in %s' % (name, self.path))
+        return data
+
+
+    def _close(self):
+        self._unmap()
+        for fp in (self.idxfp, getattr(self, 'datfp', None)):
+            if fp: fp.close()
+        self.idxfp = self.datfp = None
+
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            if self.idxfp:
+                self._close()
+        finally:
+            self.lock.release()
+
+
+
+class ArchiveWriter(object):
+    """ Append documents to NNNNNN.dat/.idx. Create them if not exist.
+        getinfo() and writestr() follow zipfile.ZipFile so that
+        docarchive.ArchiveHandler can write to either container.
+    """
+
+    def __init__(self, path, compress=COMPRESS_DEFLATE, samples=None):
+        """ path - the .idx file
+            compress - one of COMPRESS_NONE, COMPRESS_DEFLATE or COMPRESS_DICT
+            samples - documents to train the dictionary of a new archive
+                in COMPRESS_DICT mode. Default to the last documents of
+                the previous archive.
+        """
+        self.path = path
+        self.compress = compress
+        self.dictionary = None
+        dpath = datPath(path)
+        for p, magic in [(dpath, DAT_MAGIC), (path, IDX_MAGIC)]:
+            if not os.path.exists(p):
+                fp = file(p, 'wb')
+                fp.write(magic)
+                fp.close()
+        self.datfp = file(dpath, 'r+b')
+        self.idxfp = file(path, 'r+b')
+        if self.idxfp.read(HEADER_SIZE) != IDX_MAGIC or \
+           self.datfp.read(HEADER_SIZE) != DAT_MAGIC:
+            self.close()
+            raise BadArchive('Not an archive file: %s' % path)
+
+        if compress == COMPRESS_DICT:
+            # an existing archive keeps its dictionary
+            dpath = dicPath(path)
+            if not os.path.exists(dpath):
+                if samples is None:
+                    samples = _previousSamples(path)
+                writeDictionary(dpath, trainDictionary(samples))
+            self.dictionary = readDictionary(dpath)
+
+
+    def getinfo(self, name):
+        """ Return (offset, length, size, crc, method). KeyError if not found. """
+        slot = _slot(name)
+        self.idxfp.seek(HEADER_SIZE + slot * ENTRY_SIZE)
+        data = self.idxfp.read(ENTRY_SIZE)
+        if len(data) < ENTRY_SIZE:
+            raise KeyError(name)
+        entry = struct.unpack(_structEntry, data)
+        if entry[4] == METHOD_NONE:
+            raise KeyError(name)
+        return entry
+
+
+    def writestr(self, name, data):
+        slot = _slot(name)
+        method = METHOD_STORED
+        cdata = data
+        if self.compress == COMPRESS_DICT:
+            compressed = self.dictionary.compress(data)
+            if len(compressed) < len(data):
+                method, cdata = METHOD_DICT, compressed
+        elif self.compress == COMPRESS_DEFLATE:
+            compressed = zlib.compress(data, COMPRESS_LEVEL)
+            if len(compressed) < len(data):
+                method, cdata = METHOD_DEFLATED, compressed
+
+        # write the data before the entry that refers to it
+        self.datfp.seek(0, 2)
+        offset = self.datfp.tell()
+        self.datfp.write(cdata)
+        self.datfp.flush()
+        entry = struct.pack(_structEntry, offset, len(cdata), len(data),
+            zlib.crc32(data) & 0xffffffffL, method)
+        self.idxfp.seek(HEADER_SIZE + slot * ENTRY_SIZE)
+        self.idxfp.write(entry)
+        self.idxfp.flush()
+
+
+    def close(self):
+        for fp in (self.datfp, self.idxfp):
+            if fp: fp.close()
+        self.datfp = self.idxfp = None
+
+
+
+# ----------------------------------------------------------------------
+# Converter
+
+def convertZip(zip_path, compress=COMPRESS_DEFLATE):
+    """ Convert NNNNNN.zip into NNNNNN.dat/.idx. Return the number of
+        documents converted or -1 if it has been converted. In
+        COMPRESS_DICT mode the dictionary is trained from the zip.
+    """
+    path = idxPath(zip_path)
+    if os.path.exists(path):
+        return -1
+
+    # write to temporary files and rename at the end
+    base = os.path.splitext(zip_path)[0]
+    tmp_path = base + '.tmp.idx'
+    for p in (tmp_path, datPath(tmp_path), dicPath(tmp_path)):
+        if os.path.exists(p):
+            os.remove(p)
+
+    zfile = zipfile.ZipFile(zip_path, 'r')
+    try:
+        names = []
+        for name in sorted(zfile.namelist()):
+            try:
+                _slot(name)
+            except KeyError:
+                log.warn('Skip invalid filename %s in %s', name, zip_path)
+                continue
+            names.append(name)
+
+        samples = None
+        if compress == COMPRESS_DICT:
+            samples = [zfile.read(name) for name in random.sample(names, min(len(names), SAMPLE_SIZE))]
+
+        writer = ArchiveWriter(tmp_path, compress, samples)
+        try:
+            for name in names:
+                writer.writestr(name, zfile.read(name))
+        finally:
+            writer.close()
+    finally:
+        zfile.close()
+
+    if os.path.exists(dicPath(tmp_path)):
+        os.rename(dicPath(tmp_path), base + '.dic')
+    os.rename(datPath(tmp_path), base + '.dat')
+    os.rename(tmp_path, path)
+    return len(names)
+
+
+def verifyZip(zip_path):
+    """ Return list of filenames that differ between the zip and the converted archive """
+    zfile = zipfile.ZipFile(zip_path, 'r')
+    reader = ArchiveReader(idxPath(zip_path))
+    try:
+        diff = []
+        for name in zfile.namelist():
+            try:
+                if reader.read(name) != zfile.read(name):
+                    diff.append(name)
+            except KeyError:
+                diff.append(name)
+        return diff
+    finally:
+        reader.close()
+        zfile.close()
+
+
+def _diskSize(dirname):
+    return sum([os.path.getsize(os.path.join(dirname, f)) for f in os.listdir(dirname)])
+
+
+def benchmark(n, repeat=3):
+    """ Compare the disk footprint and read time of the first n archived
+        documents in per-entry ZIP_DEFLATED zip, deflate and dict mode. All
+        modes compress at the same level.
+    """
+    from minds import docarchive
+    from minds.util import zipcache
+
+    idc = docarchive.idCounter
+    idc._findIdRange()
+    docs = []
+    for i in xrange(idc._beginId, idc._endId):
+        if len(docs) >= n:
+            break
+        try:
+            docs.append(docarchive.get_document('%09d' % i).read())
+        except KeyError:
+            continue        # skip holes
+    print '%s documents %s bytes' % (len(docs), sum(map(len, docs)))
+
+    bpath = cfg.getpath('data')/'archive_benchmark'
+    names = [('%06d' % (i / MAX_ENTRY), '%03d' % (i % MAX_ENTRY)) for i in range(len(docs))]
+    order = range(len(docs))
+    random.Random(0).shuffle(order)
+
+    for mode in ['zip', COMPRESS_DEFLATE, COMPRESS_DICT]:
+        if bpath.exists():
+            bpath.rmtree()
+        bpath.makedirs()
+
+        t0 = time.time()
+        if mode == 'zip':
+            for arc in sorted(dict(names).keys()):
+                zfile = zipfile.ZipFile(bpath/arc+'.zip', 'w', zipfile.ZIP_DEFLATED)
+                for (a, name), data in zip(names, docs):
+                    if a == arc:
+                        zfile.writestr(name, data)
+                zfile.close()
+            cache = zipcache.ZipCache()
+            ext = '.zip'
+        else:
+            writers = {}
+            for (arc, name), data in zip(names, docs):
+                if arc not in writers:
+                    writers[arc] = ArchiveWriter(bpath/arc+'.idx', mode)
+                writers[arc].writestr(name, data)
+            for writer in writers.values():
+                writer.close()
+            cache = zipcache.ZipCache(handleClass=ArchiveReader)
+            ext = '.idx'
+        write_time = time.time() - t0
+
+        best = None
+        for r in range(repeat):
+            t0 = time.time()
+            for i in order:
+                arc, name = names[i]
+                if cache.read(bpath/arc+ext, name) != docs[i]:
+                    print 'Error reading %s/%s' % (arc, name)
+            elapsed = time.time() - t0
+            if best is None or elapsed < best:
+                best = elapsed
+        cache.closeAll()
+
+        print '%-8s %10s bytes  write %.3fs  read %.3fms/doc' % (
+            mode, _diskSize(bpath), write_time, best * 1000 / max(len(docs),1))
+
+    bpath.rmtree()
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in ['-c', '-v', '-b']:
+        print __doc__
+        sys.exit(-1)
+
+    option = argv[1]
+    if option == '-b':
+        benchmark(int(argv[2]))
+        return
+
+    if len(argv) > 2:
+        apath = argv[2]
+    else:
+        apath = cfg.getpath('archive')
+
+    compress = compressMode(cfg.get('archive.compress', COMPRESS_DEFLATE))
+    for filename in sorted(fileutil.listdir(apath, re.compile('\d{6}\.zip$'))):
+        zip_path = os.path.join(apath, filename)
+        if option == '-c':
+            count = convertZip(zip_path, compress)
+            if count < 0:
+                print '%s already converted' % filename
+            else:
+                print '%s %s documents' % (filename, count)
+        else:
+            diff = verifyZip(zip_path)
+            print '%s %s' % (filename, diff and 'differs: %s' % diff or 'ok')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,538 @@
+"""Event driven proxy core
+
+An alternative to PooledHTTPServer + ProxyHandler. Instead of holding a
+worker thread for the whole life of a browser connection, all client
+and server socket pairs are multiplexed in a single asyncore loop. The
+number of concurrent connections is then limited by sockets rather than
+by http.proxy_threads. Enable it by setting http.proxy_mode=reactor.
+
+Messages are wiretapped the same way as ProxyHandler does, i.e. into a
+CacheFile with three MbWriter blocks (request, response header and
+response body) and then handed to messagelog.mlog.dispose().
+
+Each browser connection carries one request. The request body is relayed
+up to its Content-Length and anything the client sends after it, e.g. a
+pipelined request, is dropped. The client connection is closed at the end
+of the response, so the browser resends the rest on a new connection.
+
+Limitations compared to ProxyHandler:
+
+  - no client keep-alive (http.client_keep_alive_timeout is ignored)
+  - no upstream connection pool (http.upstream_pool_size is ignored)
+  - a response to be discarded is still recorded, i.e. no early discard
+  - host name lookup in connect() is blocking and stalls the whole loop
+"""
+
+import asyncore
+import BaseHTTPServer
+import cStringIO
+import datetime
+import logging
+import mimetools
+import socket
+import sys
+import urlparse
+
+from minds.config import cfg
+from minds import cachefile
+from minds import httpserver
+from minds import messagelog
+from minds import proxyhandler
+from minds.util import fileutil
+from minds.util import multiblockfile
+from minds.weblib import mhtml
+
+log = logging.getLogger('proxy')
+
+
+# Stop reading from one side when the other side has this much data not
+# yet sent. This keeps a fast server from filling up memory when the
+# browser is slow.
+MAX_OUTPUT_BUFFER = 256*1024
+
+RECV_SIZE = 8192
+
+# guard against a client that never ends its request header
+MAX_REQUEST_HEADER = 64*1024
+
+
+class Channel(asyncore.dispatcher):
+    """ A socket with an output buffer. Data read is passed to the session. """
+
+    def __init__(self, session, sock=None, map=None):
+        asyncore.dispatcher.__init__(self, sock, map)
+        self.session = session
+        self.outbuf = []
+        self.outsize = 0
+        self.closing = False        # close once the output buffer is flushed
+        self.peer = None            # the Channel that consume our data
+        self.closed = False
+
+
+    def push(self, data):
+        if data:
+            self.outbuf.append(data)
+            self.outsize += len(data)
+
+
+    def close_when_done(self):
+        self.closing = True
+        if not self.outsize:
+            self.close()
+
+
+    def readable(self):
+        if self.closing:
+            return False
+        if not self.session.wantRead(self):
+            return False
+        # throttle when the peer can't keep up
+        if self.peer and self.peer.outsize > MAX_OUTPUT_BUFFER:
+            return False
+        return True
+
+
+    def writable(self):
+        return bool(self.outsize) or not self.connected
+
+
+    def handle_write(self):
+        data = ''.join(self.outbuf)
+        sent = self.send(data)
+        data = data[sent:]
+        if data:
+            self.outbuf = [data]
+        else:
+            self.outbuf = []
+        self.outsize = len(data)
+        if self.closing and not self.outsize:
+            self.close()
+
+
+    def handle_read(self):
+        data = self.recv(RECV_SIZE)
+        if data:
+            self.session.on_data(self, data)
+
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.session.on_close(self)
+        finally:
+            asyncore.dispatcher.close(self)
+
+
+    def handle_close(self):
+        self.close()
+
+
+    def handle_connect(self):
+        pass
+
+
+    def handle_error(self):
+        self.session.on_error(self)
+
+
+    def log_info(self, message, type='info'):
+        log.debug('%s: %s', type, message)
+
+
+
+class ProxySession(object):
+    """ The state of one browser connection and its upstream connection.
+
+        browser  <-- client -->  proxy  <-- server -->  destination
+    """
+
+    # states
+    REQUEST = 1         # reading request header
+    RESPONSE = 2        # relaying to and from the server
+    TUNNEL = 3          # CONNECT, just relay
+    DONE = 4
+
+    def __init__(self, server, sock, client_address):
+        self.server = server
+        self.client_address = client_address
+        self.client = Channel(self, sock, server.socket_map)
+        self.upstream = None
+        self.state = self.REQUEST
+
+        # the attributes below are used in status report
+        self.starttime = datetime.datetime.now()
+        self.path = None
+
+        self.command = None
+        self.minfo = None
+        self.logfp = None
+        self.reqLogFp = None
+        self.rspLogFp = None
+
+        self.reqbuf = []            # request header until \r\n\r\n
+        self.reqBodyRemain = 0      # request body yet to relay, -1 if not delimited
+        self.rspBuf = cStringIO.StringIO()
+        self.rspSize = 0
+        self.bodyPos = 0            # 0 means header end not yet found
+
+
+    # ------------------------------------------------------------------
+    # events
+
+    def on_data(self, channel, data):
+        if channel is self.client:
+            if self.state == self.REQUEST:
+                self._read_request(data)
+            elif self.state == self.RESPONSE:
+                self._forward_request_body(data)
+            elif self.upstream:
+                self.upstream.push(data)
+        else:
+            self.client.push(data)
+            if self.state == self.RESPONSE:
+                self._log_response(data)
+
+
+    def wantRead(self, channel):
+        """ Stop reading from the client once the request is relayed """
+        if channel is self.client and self.state == self.RESPONSE:
+            return self.reqBodyRemain != 0
+        return True
+
+
+    def on_close(self, channel):
+        if channel is self.client:
+            # browser is gone
+            if self.upstream:
+                self.upstream.close()
+            self._finish()
+            self.server.remove_session(self)
+        else:
+            # dispose before the browser see the end of response
+            self._finish()
+            self.client.close_when_done()
+
+
+    def on_error(self, channel):
+        t, v = sys.exc_info()[:2]
+        if issubclass(t, socket.error):
+            # socket.error is common enough that we don't want to print the stack trace
+            log.warn('socket.error: %s' % str(v))
+        else:
+            log.exception('Problem in handling request')
+
+        if channel is self.upstream and self.state == self.RESPONSE and not self.rspSize:
+            # failed to connect?
+            self._send_error(404, str(v))
+            channel.close()
+        else:
+            self.client.close()
+
+
+    # ------------------------------------------------------------------
+    # request
+
+    def _read_request(self, data):
+        self.reqbuf.append(data)
+        buf = ''.join(self.reqbuf)
+        i = buf.find('\r\n\r\n')
+        if i < 0:
+            # some clients end header with bare \n\n
+            i = buf.find('\n\n')
+            if i < 0:
+                if len(buf) > MAX_REQUEST_HEADER:
+                    self._send_error(400, 'Request header too long')
+                    self.client.close_when_done()
+                    self.state = self.DONE
+                else:
+                    self.reqbuf = [buf]
+                return
+            header, body = buf[:i+2], buf[i+2:]
+        else:
+            header, body = buf[:i+4], buf[i+4:]
+        self.reqbuf = None
+
+        messagelog.mlog.lastRequest = datetime.datetime.now()
+
+        fp = cStringIO.StringIO(header)
+        words = fp.readline().split()
+        if len(words) != 3:
+            self._send_error(400, 'Bad request syntax')
+            self.client.close_when_done()
+            self.state = self.DONE
+            return
+        self.command, self.path, self.request_version = words
+        headers = mimetools.Message(fp, 0)
+
+        if self.command == 'CONNECT':
+            self._start_tunnel(body)
+            return
+
+        resp = mhtml.LoadedWebArchive.fetch_uri(self.path)
+        if resp:
+            self._serve_HTTPResponse(resp)
+            return
+
+        # wiretap the request
+        self.minfo = messagelog.MessageInfo()
+        max_messagelog = cfg.getint('messagelog.max_messagelog', 2048)
+        self.logfp = cachefile.CacheFile(max_messagelog*1024)
+        self.reqLogFp = multiblockfile.MbWriter(self.logfp)
+        self.reqLogFp.write(header)
+
+        # record request properties
+        self.minfo.setReq(self.command, self.path, headers)
+
+        (scm, netloc, path, params, query, fragment) = urlparse.urlparse(self.path, 'http')
+        if self.server.next_proxy_netloc:
+            uri = self.path
+            netloc = self.server.next_proxy_netloc
+        else:
+            uri = urlparse.urlunparse(('', '', path, params, query, ''))
+
+        self.reqBodyRemain = _getRequestBodySize(headers)
+        self.state = self.RESPONSE
+        self.upstream = self._connect_to(netloc)
+        if not self.upstream:
+            return
+        self.upstream.push(proxyhandler.format_request(self.command, uri, self.request_version, headers))
+        self._forward_request_body(body)
+
+
+    def _forward_request_body(self, data):
+        """ Relay the request body to the server and record it. Data after
+            the end of body is dropped.
+        """
+        if self.reqBodyRemain >= 0:
+            if len(data) > self.reqBodyRemain:
+                log.debug('Drop %s bytes after the request - %s', len(data) - self.reqBodyRemain, self.path)
+                data = data[:self.reqBodyRemain]
+            self.reqBodyRemain -= len(data)
+        elif self.bodyPos:
+            # not delimited (e.g. chunked), the response has already started
+            log.debug('Drop %s bytes after the response started - %s', len(data), self.path)
+            return
+        if not data or not self.upstream:
+            return
+        self.upstream.push(data)
+        if not self.bodyPos:
+            # request body (e.g. POST) goes to the request block
+            self.reqLogFp.write(data)
+
+
+    def _connect_to(self, netloc):
+        i = netloc.find(':')
+        if i >= 0:
+            host_port = netloc[:i], int(netloc[i+1:])
+        else:
+            host_port = netloc, 80
+        channel = Channel(self, None, self.server.socket_map)
+        channel.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            channel.connect(host_port)
+        except socket.error, arg:
+            try: msg = arg[1]
+            except: msg = arg
+            self._send_error(404, msg)
+            self.client.close_when_done()
+            return None
+        channel.peer = self.client
+        self.client.peer = channel
+        return channel
+
+
+    def _start_tunnel(self, body):
+        log.debug('Connect - %s', self.path)
+        self.state = self.TUNNEL
+        self.upstream = self._connect_to(self.path)
+        if not self.upstream:
+            return
+        self.client.push(self.request_version + " 200 Connection established\r\n")
+        self.client.push("Proxy-agent: %s\r\n" % self.server.version_string())
+        self.client.push("\r\n")
+        if body:
+            self.upstream.push(body)
+
+
+    def _serve_HTTPResponse(self, resp):
+        self.client.push(self.request_version + " 200 OK\r\n")
+        headers = ['%s: %s\r\n' % (n,v) for n,v in resp.getheaders()]
+        self.client.push(''.join(headers))
+        self.client.push('via: MindRetrieve Cache\r\n')
+        self.client.push('\r\n')
+        self.client.push(resp.read())
+        self.client.push('\r\n')
+        self.client.close_when_done()
+
+
+    def _send_error(self, code, message):
+        try:
+            short, long = BaseHTTPServer.BaseHTTPRequestHandler.responses[code]
+        except KeyError:
+            short, long = '???', '???'
+        content = BaseHTTPServer.DEFAULT_ERROR_MESSAGE % \
+            {'code': code, 'message': message, 'explain': long}
+        self.client.push('HTTP/1.0 %d %s\r\n' % (code, short))
+        self.client.push('Content-Type: text/html\r\n')
+        self.client.push('Connection: close\r\n\r\n')
+        if self.command != 'HEAD' and code >= 200 and code not in (204, 304):
+            self.client.push(content)
+
+
+    # ------------------------------------------------------------------
+    # response
+
+    def _log_response(self, data):
+        """ Wiretap response data. See ProxyHandler._transfer_data() """
+        self.rspSize += len(data)
+        if self.bodyPos:
+            self.rspLogFp.write(data)
+            return
+
+        self.rspBuf.write(data)
+        buf = self.rspBuf.getvalue()
+        i = buf.find('\r\n\r\n')
+        if i < 0:
+            return
+        self.bodyPos = i + 4
+
+        # complete the request block
+        self.reqLogFp.complete()
+
+        # write response header in a new block
+        fp = multiblockfile.MbWriter(self.logfp)
+        fp.write(buf[:self.bodyPos])
+        fp.complete()
+
+        # write reposne body in a new block
+        maxresponse = cfg.getint('messagelog.maxresponse', 1024)    # max maxresponse size in kb
+        self.rspLogFp = multiblockfile.MbWriter(self.logfp)
+        self.rspLogFp = fileutil.BoundedFile(self.rspLogFp, maxresponse*1024)
+        self.rspLogFp.write(buf[self.bodyPos:])
+
+
+    def _finish(self):
+        """ Dispose the message once. """
+        if self.state == self.DONE:
+            return
+        state, self.state = self.state, self.DONE
+        if state != self.RESPONSE:
+            if self.logfp:
+                self.logfp.discard()
+            return
+
+        try:
+            if not self.bodyPos:
+                # socket closed but header end still not found?
+                self.bodyPos = self.rspSize
+                self.reqLogFp.complete()
+                fp = multiblockfile.MbWriter(self.logfp)
+                fp.write(self.rspBuf.getvalue())
+                fp.complete()
+                self.rspLogFp = multiblockfile.MbWriter(self.logfp)
+            self.rspLogFp.complete()
+
+            if self.bodyPos <= 0:
+                log.warn("No response from %s", self.path)
+            else:
+                # interpret response
+                self.rspBuf.seek(0)
+                self.minfo.parseRsp(self.rspBuf, self.rspSize - self.bodyPos)
+                if self.logfp.isOverflow():
+                    self.minfo.discard = True
+                    log.warn('logOverflow bytes received: %s', self.rspSize - self.bodyPos)
+        except:
+            log.exception("Problem in handling request")
+
+        messagelog.mlog.dispose(self.minfo, self.logfp, self.starttime)
+
+
+
+def _getRequestBodySize(headers):
+    """ Return the size of request body or -1 if it is not delimited by
+        Content-Length. See ProxyHandler._getRequestBodySize().
+    """
+    if headers.get('transfer-encoding') or headers.get('expect'):
+        return -1
+    try:
+        size = int(headers.get('content-length', 0))
+    except ValueError:
+        return -1
+    return max(size, -1)
+
+
+
+class ProxyServer(asyncore.dispatcher):
+    """ Accept browser connections and run all sessions in one loop.
+        Provides the same report_config(), worker_status and
+        next_proxy_netloc as PooledHTTPServer.
+    """
+
+    LOOP_TIMEOUT = 3
+
+    def __init__(self, server_address):
+        self.socket_map = {}
+        asyncore.dispatcher.__init__(self, map=self.socket_map)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(server_address)
+        self.listen(32)
+        self.server_address = self.socket.getsockname()
+        self.sessions = []
+        self.next_proxy_netloc = httpserver.read_http_proxy()
+
+
+    def _get_worker_status(self):
+        return list(self.sessions)
+
+    worker_status = property(_get_worker_status)
+
+
+    def report_config(self):
+        return 'address=%s http_proxy="%s" mode=reactor' % \
+            (self.server_address, self.next_proxy_netloc)
+
+
+    def version_string(self):
+        handler = BaseHTTPServer.BaseHTTPRequestHandler
+        return handler.server_version + ' ' + handler.sys_version
+
+
+    def handle_accept(self):
+        pair = self.accept()
+        if not pair:
+            return
+        sock, client_address = pair
+        if not self.verify_request(sock, client_address):
+            sock.close()
+            return
+        self.sessions.append(ProxySession(self, sock, client_address))
+
+
+    def verify_request(self, request, client_address):
+        return httpserver.verify_local_request(request, client_address)
+
+
+    def remove_session(self, session):
+        try:
+            self.sessions.remove(session)
+        except ValueError:
+            pass
+
+
+    def handle_error(self):
+        log.exception('Exception happened during accept')
+
+
+    def serve_forever(self):
+        from minds import proxy
+        while not proxy.isShutdown():
+            asyncore.loop(self.LOOP_TIMEOUT, False, self.socket_map, 1)
+        self.close_all()
+
+
+    def close_all(self):
+        for channel in self.socket_map.values():
+            channel.close()
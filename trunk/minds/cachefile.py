@@ -2,8 +2,14 @@
 """
 
 from cStringIO import StringIO
+import logging
+import os
+import re
+import shutil
+import tempfile
 
 from minds.config import cfg
+from minds import queueindex
 from minds.util import fileutil
 
 
@@ -22,6 +28,16 @@ from minds.util import fileutil
 # May introduce a maxcachesize (<= maxsize). If buffer size reach
 # maxcachesize it show start writing to file to limit memory use. This
 # will affect flush_*() and discard().
+#
+# 2006 Implemented. Once spilled the content is written to a temp file
+# in the logs directory. The first write_xxx() becomes a rename and a
+# second one a file copy. discard() has to be called to remove the temp
+# file if it is not saved.
+
+log = logging.getLogger('cachefile')
+
+# temp files written by CacheFile: spilled content or a log being saved
+TMP_PATTERN = re.compile(r'(cache.*|.*\.[mq]log)\.tmp$')
 
 
 class CacheFile(fileutil.BoundedFile):
@@ -31,12 +47,43 @@ class CacheFile(fileutil.BoundedFile):
         fileutil.BoundedFile)
     """
 
-    def __init__(self, maxsize):
+    fsync = False                   # fsync saved file before rename
+
+    def __init__(self, maxsize, maxcachesize=None):
+        """ maxcachesize - spill to a temp file when the content grow
+                beyond this size. Default to messagelog.maxcachesize KB.
+        """
         self.buf = StringIO()
         super(CacheFile, self).__init__(self.buf, maxsize)
         self.maxsize = maxsize
         self.cursize = 0
         self.overflow = False
+        if maxcachesize is None:
+            maxcachesize = cfg.getint('messagelog.maxcachesize', 256) * 1024
+        self.maxcachesize = maxcachesize
+        self.spillpath = None       # the temp file after spilled
+        self.savedpath = None       # the file spillpath has been renamed to
+
+    def write(self, str):
+        if not self.spillpath and self.buf and not self.overflow and \
+            self.cursize+len(str) > self.maxcachesize and \
+            self.cursize+len(str) <= self.maxsize:
+            self._spill()
+        super(CacheFile, self).write(str)
+
+    def isSpilled(self):
+        return bool(self.spillpath)
+
+    def _spill(self):
+        """ move the buffered content to a temp file and continue writing there """
+        logdir = cfg.getpath('logs')
+        fd, name = tempfile.mkstemp('.tmp', 'cache', logdir)
+        fp = os.fdopen(fd, 'wb')                # MbWriter only support mode "wb"
+        fp.write(self.buf.getvalue())
+        fp.seek(self.buf.tell())                # MbWriter may have seek back
+        self.fp = fp
+        self.buf = None
+        self.spillpath = logdir/os.path.basename(name)
 
     def write_mlog(self, id):
         """ save a message log '.mlog' """
@@ -47,13 +94,66 @@ class CacheFile(fileutil.BoundedFile):
         self._save(id+'.qlog')
 
     def _save(self, filename):
-        filepath = cfg.getpath('logs') / filename
+        logpath = cfg.getpath('logs')
+        filepath = logpath / filename
+        if self.spillpath:
+            self._saveSpilled(filepath)
+        else:
+            self._saveBuf(filepath)
+        queueindex.getIndex(logpath).add(filename)
+
+    def _saveBuf(self, filepath):
         tmppath = filepath +'.tmp'
         fp = tmppath.open('wb')
         fp.write(self.buf.getvalue())
+        if self.fsync:
+            fp.flush()
+            os.fsync(fp.fileno())
         fp.close()
         # write to a tmp file first and then rename to make it more atomic.
         tmppath.rename(filepath)
 
+    def _saveSpilled(self, filepath):
+        if not self.fp.closed:
+            if self.fsync:
+                self.fp.flush()
+                os.fsync(self.fp.fileno())
+            self.fp.close()
+        if not self.savedpath:
+            # content is already on disk
+            self.spillpath.rename(filepath)
+            self.savedpath = filepath
+        else:
+            tmppath = filepath +'.tmp'
+            shutil.copyfile(self.savedpath, tmppath)
+            tmppath.rename(filepath)
+
     def discard(self):
+        """ release the memory buffer or remove the temp file if it is not saved """
         self.buf = None
+        if self.spillpath and not self.savedpath:
+            self.fp.close()
+            try:
+                self.spillpath.remove()
+            except OSError:
+                log.exception('Unable to remove %s', self.spillpath)
+        self.spillpath = None
+
+
+def removeTempFiles(logdir=None):
+    """ Remove temp files left behind by a process that has died. They are
+        never picked up again. Call at startup before any CacheFile is
+        used. Return the number of files removed.
+    """
+    if logdir is None:
+        logdir = cfg.getpath('logs')
+    count = 0
+    for filename in fileutil.listdir(logdir, TMP_PATTERN):
+        try:
+            (logdir/filename).remove()
+            count += 1
+        except OSError:
+            log.exception('Unable to remove %s', filename)
+    if count:
+        log.info('Removed %s temp files from %s', count, logdir)
+    return count
@@ -49,9 +49,26 @@ Cache-control: no-cache\r
             duration = now - obj.starttime
             msg.append('%02d %s - %s' % (i, duration, obj.path))
         print >>wfile, '\n'.join(msg)
+        if getattr(proxy.proxy_httpd, 'connpool', None):
+            print >>wfile, '\nupstream connection pool: %s' % proxy.proxy_httpd.connpool
     else:
         print >>wfile, 'proxy.proxy_httpd not defined'
 
+    from minds import messagelog
+    if messagelog.mlog.writer:
+        print >>wfile, 'log writer: %s' % messagelog.mlog.writer
+    if messagelog.mlog.transformer:
+        print >>wfile, 'stream transformer: %s' % messagelog.mlog.transformer
+    from minds import qmsg_processor
+    if qmsg_processor.indexer:
+        print >>wfile, 'indexer process: %s' % qmsg_processor.indexer
+    from minds import docarchive
+    print >>wfile, 'archive zip cache: %s' % docarchive.zipCache
+    lucene_logic = sys.modules.get('minds.lucene_logic')  # don't load PyLucene just for this
+    if lucene_logic:
+        for pathname, manager in lucene_logic._managers.items():
+            print >>wfile, 'searcher %s: %s' % (pathname, manager)
+
     # show config
     print >>wfile, '\n------------------------------------------------------------------------'
     print >>wfile, 'Config'
@@ -4,12 +4,9 @@
 import cgi
 import ConfigParser
 import codecs
-import datetime
 import logging
 import sys
-import threading
 import mimetypes, posixpath
-import zipfile
 
 from minds.config import cfg
 from minds import distillparse
@@ -19,69 +16,9 @@ import docreaderTmpl
 
 CONFIG_INI = 'docreader.ini'
 
-lock = threading.RLock()
-g_openedfile = None
 g_config_item = None
 
 
-class OpenedFile(object):
-    """ Object to encapsulate a opened zip file.
-        Also maintain a logic to close it after some timeout.
-    """
-
-    TIMEOUT = 60.0
-
-    def __init__(self, path):
-        self.path = path
-        self.fp = file(path,'rb')
-        self.zf = zipfile.ZipFile(self.fp, 'r')
-        self.timer = None
-        self.lastUse = datetime.datetime.now()
-
-
-    def setCloseTimer(self):
-        if not self.timer:
-            self.timer = threading.Timer(self.TIMEOUT, self.close)
-            self.timer.start()
-
-
-    def close(self):
-        lock.acquire()
-        try:
-            timeout2 = self.TIMEOUT - 3   # reduce by an arbitrary 3 to account for timer limitation
-            if datetime.datetime.now() - self.lastUse < datetime.timedelta(seconds=timeout2):
-                # do not close now, set another timer instead
-                self.timer = None
-                self.setCloseTimer()
-                return
-
-            if self.zf: self.zf.close()
-            if self.fp: self.fp.close()
-            self.path = ''
-            self.zf = None
-            self.fp = None
-
-            global g_openedfile
-            g_openedfile = None
-
-        finally:
-            lock.release()
-
-
-    def acquire(path):
-        global g_openedfile
-        if g_openedfile and g_openedfile.path == path:
-            g_openedfile.lastUse = datetime.datetime.now()  # we have no good way to stop the timer.
-                                                            # Updating lastUse so that close() would give it more time.
-            return g_openedfile
-
-        g_openedfile = OpenedFile(path)
-        return g_openedfile
-
-    acquire = staticmethod(acquire)
-
-
-
 class Documentation(object):
 
     def __init__(self, name):
@@ -153,26 +90,22 @@ def doGetResource(rfile, wfile, env, path_info):
 
 
 
-    lock.acquire()
-    try:
-        openedfile = OpenedFile.acquire(documentation.path)
-        ctype = guess_type(path)
-        if ctype.startswith('text/'):
-            ctype += '; charset=UTF-8'
-            sw = codecs.getwriter('utf-8')
-            wfile = sw(wfile,'replace')
+    # the zip file is kept open in the shared cache
+    data = docarchive.zipCache.read(documentation.path, path)
+    ctype = guess_type(path)
+    if ctype.startswith('text/'):
+        ctype += '; charset=UTF-8'
+        sw = codecs.getwriter('utf-8')
+        wfile = sw(wfile,'replace')
 
-        ### todo: 404  todo: charset
+    ### todo: 404  todo: charset
 
-        wfile.write(
+    wfile.write(
 """Content-type: %s\r
 \r
 """ % ctype)
 
-        wfile.write( openedfile.zf.read(path))
-
-    finally:
-        lock.release()
+    wfile.write(data)
 
 
 
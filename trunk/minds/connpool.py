@@ -0,0 +1,167 @@
+"""Persistent upstream connection pool for the proxy
+
+ProxyHandler used to open a new connection (including DNS lookup) to the
+destination for every request. The pool keeps sockets of completed
+keep-alive responses by netloc so that following requests to the same
+host, or to the next hop proxy, can reuse them.
+"""
+
+import datetime
+import logging
+import select
+import socket
+import threading
+import time
+
+from minds.config import cfg
+
+log = logging.getLogger('connpool')
+
+
+class ConnectionPool(object):
+    """ Idle connections keyed by netloc. Thread safe. """
+
+    def __init__(self, max_per_host=4, idle_timeout=15):
+        """ max_per_host - maximum number of idle connections kept per netloc
+            idle_timeout - idle connections older than this (in seconds) are closed
+        """
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.idle = {}                  # netloc -> list of (socket, time released)
+        self.lastPurge = time.time()
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.connect_time = 0.0         # total time spent in connect for misses
+        self.starttime = datetime.datetime.now()
+
+
+    def get(self, netloc):
+        """ Return an idle connection to netloc or None. """
+        now = time.time()
+        self.lock.acquire()
+        try:
+            conns = self.idle.get(netloc, [])
+            while conns:
+                soc, released = conns.pop()
+                if now - released < self.idle_timeout and _isAlive(soc):
+                    self.hits += 1
+                    return soc
+                _close(soc)
+            self.misses += 1
+            return None
+        finally:
+            self.lock.release()
+
+
+    def put(self, netloc, soc):
+        """ Return a connection to the pool for reuse. """
+        now = time.time()
+        self.lock.acquire()
+        try:
+            conns = self.idle.setdefault(netloc, [])
+            if len(conns) < self.max_per_host:
+                conns.append((soc, now))
+                soc = None
+        finally:
+            self.lock.release()
+        if soc:
+            _close(soc)
+
+        # occasionally close connections to hosts not visited again
+        if now - self.lastPurge > self.idle_timeout:
+            self.lastPurge = now
+            self.purge()
+
+
+    def addConnectTime(self, seconds):
+        """ Record the time spent to connect for a miss """
+        self.lock.acquire()
+        try:
+            self.connect_time += seconds
+        finally:
+            self.lock.release()
+
+
+    def purge(self):
+        """ Close connections that have been idle for too long """
+        now = time.time()
+        expired = []
+        self.lock.acquire()
+        try:
+            for netloc, conns in self.idle.items():
+                alive = [c for c in conns if now - c[1] < self.idle_timeout]
+                expired.extend([c for c in conns if now - c[1] >= self.idle_timeout])
+                if alive:
+                    self.idle[netloc] = alive
+                else:
+                    del self.idle[netloc]
+        finally:
+            self.lock.release()
+        for soc, released in expired:
+            _close(soc)
+
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            idle, self.idle = self.idle, {}
+        finally:
+            self.lock.release()
+        for conns in idle.values():
+            for soc, released in conns:
+                _close(soc)
+
+
+    def numIdle(self):
+        self.lock.acquire()
+        try:
+            return sum([len(conns) for conns in self.idle.values()])
+        finally:
+            self.lock.release()
+
+
+    def __str__(self):
+        if self.misses:
+            avg_connect = self.connect_time / self.misses
+        else:
+            avg_connect = 0.0
+        return 'hits=%s misses=%s idle=%s avg_connect=%.1fms saved~%.1fs since %s' % (
+            self.hits,
+            self.misses,
+            self.numIdle(),
+            avg_connect * 1000,
+            avg_connect * self.hits,
+            str(self.starttime)[:19],
+            )
+
+
+
+def _isAlive(soc):
+    """ An idle connection should have nothing to read. If it is readable
+        the server has either closed it or sent something unexpected.
+    """
+    try:
+        ins, _, exs = select.select([soc], [], [soc], 0)
+    except (select.error, socket.error, ValueError):
+        return False
+    return not ins and not exs
+
+
+def _close(soc):
+    try:
+        soc.close()
+    except:
+        log.exception('Unable to close pooled socket')
+
+
+
+def makePool():
+    """ Create a pool from config. None if pooling is disabled. """
+    max_per_host = cfg.getint('http.upstream_pool_size', 4)
+    idle_timeout = cfg.getint('http.upstream_idle_timeout', 15)
+    if max_per_host <= 0:
+        return None
+    return ConnectionPool(max_per_host, idle_timeout)
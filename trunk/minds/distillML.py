@@ -34,6 +34,8 @@ from minds import domain_filter
 from minds import encode_tools
 from minds import messagelog
 from minds.util import html_pull_parser
+from minds.util import fileutil
+from minds.util import html_tokenizer
 from minds.util import magic
 from toollib import sgmllib         # custom version of sgmllib
 
@@ -194,7 +196,17 @@ endtag_dict = {
 }
 
 
-def process(fp, out, meta):
+def getTokenizer():
+    """ Return the tokenizer module selected by indexing.html_tokenizer,
+        'sgml' (html_pull_parser) or 'regex' (html_tokenizer)
+    """
+    if cfg.get('indexing.html_tokenizer', 'sgml') == 'regex':
+        return html_tokenizer
+    return html_pull_parser
+
+
+
+def process(fp, out, meta, tokenizer=html_pull_parser):
     """ Return has_html, has_frameset """
 
     has_html        = False
@@ -203,7 +215,7 @@ def process(fp, out, meta):
 
     first_td    = False     # state for iterating td inside tr
 
-    iterator = html_pull_parser.generate_tokens(fp)
+    iterator = tokenizer.generate_tokens(fp)
 
     # General HTML format
     # <html>
@@ -578,8 +590,9 @@ def distill(rstream, wstream, meta):
         @returns - 0 means accepted. Otherwise a tuple of reason code and an explanation string.
     """
 
+    # sniff the first block and then put it back. rstream need not support seek().
     first_block = rstream.read(32768)
-    rstream.seek(0)                                           # network stream would not support seek!?
+    rstream = fileutil.PrefixedFile(rstream, first_block)
 
     result = preparse_filter(first_block, meta)
     if result:
@@ -594,7 +607,7 @@ def distill(rstream, wstream, meta):
 
     formatter = Formatter(writer)
     try:
-        has_html, has_frameset, has_common_tag = process(reader, formatter, meta)
+        has_html, has_frameset, has_common_tag = process(reader, formatter, meta, getTokenizer())
     except sgmllib.SGMLParseError, e:
         return (PARSE_ERROR, 'SGMLParseError: %s' % str(e)) # SGMLParseError
     except Exception, e:
@@ -646,7 +659,7 @@ def distillTxt(rstream, wstream, meta):
     """
 
     first_block = rstream.read(8192)
-    rstream.seek(0)
+    rstream = fileutil.PrefixedFile(rstream, first_block)
 
     result = preparse_filter(first_block, meta)
     if result:
@@ -3,12 +3,16 @@
 options:
     -r  render in HTML
     -s  strip tags
+    -b  benchmark strip tags on the first n archived documents
 """
 
+import codecs
 import os.path
+import re
 import shutil
 import StringIO
 import sys
+import time
 
 from minds.config import cfg
 from minds import distillML
@@ -38,18 +42,59 @@ def writeHeader(writer, meta):
     writer.write(u'\n')
 
 
+# Any of distillML.OUTPUT_TAG. None of them is a prefix of another so
+# the order of the alternatives does not matter.
+_output_tag = re.compile('|'.join(map(re.escape, distillML.OUTPUT_TAG)))
+
+
 def parseDistillML(rstream, writeHeader=None, bufsize=32768):
     """ Parse distillML (as stored in the archive).
         Build meta data dictionary and strip tags in content.
         @returns meta, content
     """
 
-    import codecs
     reader = codecs.getreader('utf8')(rstream,'replace')
 
     meta = parseHeader(reader)
 
     # optionally put meta data at the beginning of content
+    buf = StringIO.StringIO()
+    if writeHeader:
+        writeHeader(buf, meta)
+
+    # parse content
+    data = ''
+    while True:
+        block = reader.read(bufsize)
+        if not block:
+            break
+        data += block
+
+        # a '<' near the end may begin a tag that continues in next block
+        lt = data.rfind('<', -distillML.MAX_OUTPUT_TAG_LEN+1)
+        if lt < 0:
+            buf.write(_output_tag.sub('', data))
+            data = ''
+        else:
+            buf.write(_output_tag.sub('', data[:lt]))
+            data = data[lt:]
+
+    if data:
+        buf.write(_output_tag.sub('', data))
+
+    return meta, buf.getvalue()
+
+
+
+def _parseDistillMLLoop(rstream, writeHeader=None, bufsize=32768):
+    """ The character loop parseDistillML() used to run. Kept as a
+        reference for benchmark.
+    """
+
+    reader = codecs.getreader('utf8')(rstream,'replace')
+
+    meta = parseHeader(reader)
+
     buf = StringIO.StringIO()
     if writeHeader:
         writeHeader(buf, meta)
@@ -162,6 +207,47 @@ def stripTags(rfile, wfile):
     print >>wfile, content.encode('unicode_escape')
 
 
+def benchmark(n, repeat=3):
+    """ Compare parseDistillML() with the old character loop on the first
+        n archived documents.
+    """
+    idc = docarchive.idCounter
+    idc._findIdRange()
+    ah = docarchive.ArchiveHandler('r')
+    docs = []
+    try:
+        for i in xrange(idc._beginId, idc._endId):
+            if len(docs) >= n:
+                break
+            zfile, filename = ah._open('%09d' % i)
+            try:
+                docs.append(zfile.read(filename))
+            except KeyError:
+                continue        # skip holes
+    finally:
+        ah.close()
+
+    print '%s documents %s bytes' % (len(docs), sum(map(len, docs)))
+    for name, parse in [('loop',  _parseDistillMLLoop),
+                        ('regex', parseDistillML),
+                       ]:
+        best = None
+        for r in range(repeat):
+            t0 = time.time()
+            for data in docs:
+                parse(StringIO.StringIO(data), writeHeader)
+            elapsed = time.time() - t0
+            if best is None or elapsed < best:
+                best = elapsed
+        print '%-6s %.3fs' % (name, best)
+
+    # verify the output is identical
+    for data in docs:
+        if _parseDistillMLLoop(StringIO.StringIO(data), writeHeader) != \
+           parseDistillML(StringIO.StringIO(data), writeHeader):
+            print 'Output differs: %s' % parseHeader(StringIO.StringIO(data)).get('uri')
+
+
 def main(argv):
 
     if len(argv) < 3:
@@ -171,6 +257,10 @@ def main(argv):
     option = argv[1]
     path_or_id = argv[2]
 
+    if option == '-b':
+        benchmark(int(path_or_id))
+        return
+
     fp = None
     try:
         if os.path.exists(path_or_id):
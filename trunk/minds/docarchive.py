@@ -11,6 +11,7 @@
 
 
 import logging
+import os
 import re
 import StringIO
 import sys
@@ -18,12 +19,19 @@ import threading
 import zipfile
 
 from minds.config import cfg
+from minds import archive_file
 from minds.util import fileutil
-from toollib import zipfile_single
+from minds.util.zipcache import ZipCache
 
 log = logging.getLogger('docarc')
 
 
+# Opened archive files shared by search, archive_view and docreader
+zipCache = ZipCache(cfg.getint('archive.max_open_files', 16))
+# Opened NNNNNN.dat/.idx archives (see archive_file)
+datCache = ZipCache(cfg.getint('archive.max_open_files', 16), archive_file.ArchiveReader)
+
+
 
 def parseId(id):
     """ Return arc_path, filename represents by id.
@@ -46,14 +54,117 @@ def get_document(id):
 
     arc_path, filename = parseId(id)
 
+    idx_path = archive_file.idxPath(arc_path)
+    if os.path.exists(idx_path):
+        try:
+            return StringIO.StringIO(datCache.read(idx_path, filename))
+        except KeyError:
+            # it may be added to the zip after it has been converted
+            if not arc_path.exists():
+                raise
+
     if not arc_path.exists():
         raise KeyError, 'archive file does not exist %s' % arc_path
 
-    zfile = zipfile_single.ZipFile(arc_path.open('rb'), 'r')
-    try:
-        return StringIO.StringIO(zfile.read(filename))
-    finally:
-        zfile.close()
+    return StringIO.StringIO(zipCache.read(arc_path, filename))
+
+
+
+def _stamp(apath, arc):
+    """ Return the sizes of arc's zip and idx file as 'zipsize/idxsize', -1 if not exist """
+    sizes = []
+    for ext in ['.zip', '.idx']:
+        try:
+            sizes.append(str(os.path.getsize(apath/arc+ext)))
+        except OSError:
+            sizes.append('-1')
+    return '/'.join(sizes)
+
+
+
+class Manifest(object):
+    """ The $archive/manifest.txt sidecar. It records the begin and end
+        id, and per archive the number of documents and the file sizes
+        when it is last written. IdCounter trusts it only when the first
+        and last archive and the size of the last archive still match.
+        Otherwise it scans the archive files.
+
+        begin=0
+        end=1503
+        000000=1000 82345/-1
+        000001=503 40121/-1
+    """
+
+    FILENAME = 'manifest.txt'
+
+    def __init__(self, beginId=0, endId=0):
+        self.beginId = beginId
+        self.endId = endId
+        self.archives = {}          # arc -> [count, stamp]; count -1 if unknown
+
+
+    def load(apath):
+        """ Return the Manifest in apath or None if it does not exist or is invalid """
+        try:
+            fp = file(apath/Manifest.FILENAME, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                manifest = Manifest()
+                for line in fp:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    key, value = line.split('=',1)
+                    if key == 'begin':
+                        manifest.beginId = int(value)
+                    elif key == 'end':
+                        manifest.endId = int(value)
+                    else:
+                        count, stamp = value.split()
+                        manifest.archives[key] = [int(count), stamp]
+                return manifest
+            except ValueError, e:
+                log.warn('Invalid manifest %s: %s', apath, e)
+                return None
+        finally:
+            fp.close()
+
+    load = staticmethod(load)
+
+
+    def save(self, apath):
+        tmp_path = apath/Manifest.FILENAME+'.tmp'
+        fp = file(tmp_path, 'wb')
+        try:
+            fp.write('# docarchive manifest\n')
+            fp.write('begin=%s\n' % self.beginId)
+            fp.write('end=%s\n' % self.endId)
+            arcs = self.archives.keys()
+            arcs.sort()
+            for arc in arcs:
+                fp.write('%s=%s %s\n' % (arc, self.archives[arc][0], self.archives[arc][1]))
+        finally:
+            fp.close()
+        path = apath/Manifest.FILENAME
+        if path.exists():
+            path.remove()
+        tmp_path.rename(path)
+
+
+    def isValid(self, apath, first_arc, last_arc):
+        """ first_arc, last_arc - the first and last archive found in apath """
+        if self.endId <= self.beginId:
+            return False
+        # the first archive may have been purged
+        if ('%09d' % self.beginId)[:6] != first_arc:
+            return False
+        if ('%09d' % (self.endId-1))[:6] != last_arc:
+            return False
+        # documents may have been added without updating the manifest
+        entry = self.archives.get(last_arc)
+        return entry is not None and entry[1] == _stamp(apath, last_arc)
 
 
 
@@ -70,11 +181,13 @@ class IdCounter(object):
         self._endId = None
 
 
-    arc_pattern = re.compile('\d{6}.zip$')
+    arc_pattern = re.compile('\d{6}.(zip|idx)$')
     filename_pattern = re.compile('\d{3}$')
 
     def _findIdRange(self):
-        """ Scan the $archive directory for zip files for the begin and end id. """
+        """ Find the begin and end id from the manifest. Scan the $archive
+            directory for zip (or idx) files if it is not up to date.
+        """
 
         apath = cfg.getpath('archive')
         files = fileutil.listdir(apath, self.arc_pattern)
@@ -83,35 +196,77 @@ class IdCounter(object):
             self._endId = 0
             return
 
-        first_arc = min(files)
-        last_arc  = max(files)
+        first_arc = min(files)[:6]
+        last_arc  = max(files)[:6]
 
-        first = self._findId(apath/first_arc, min)
-        last  = self._findId(apath/last_arc, max)
+        manifest = Manifest.load(apath)
+        if manifest and manifest.isValid(apath, first_arc, last_arc):
+            self._beginId = manifest.beginId
+            self._endId   = manifest.endId
+            return
 
-        self._beginId = int(first_arc[:6] + first)   # would be a 9 digit id
-        self._endId   = int(last_arc[:6]  + last )+1 # would be a 9 digit id
+        first_names = self._namelist(apath, first_arc)
+        last_names  = self._namelist(apath, last_arc)
+        first = self._findId(first_names, min)
+        last  = self._findId(last_names, max)
+
+        self._beginId = int(first_arc + first)   # would be a 9 digit id
+        self._endId   = int(last_arc  + last )+1 # would be a 9 digit id
+
+        # rebuild the manifest. Keep the counts of the archives in between.
+        if not manifest:
+            manifest = Manifest()
+        manifest.beginId, manifest.endId = self._beginId, self._endId
+        for arc in manifest.archives.keys():
+            if arc < first_arc or arc > last_arc:
+                del manifest.archives[arc]
+        for arc, names in [(first_arc, first_names), (last_arc, last_names)]:
+            manifest.archives[arc] = [len(names), _stamp(apath, arc)]
+        try:
+            manifest.save(apath)
+        except (IOError, OSError), e:
+            log.warn('Unable to save manifest: %s', e)
 
 
-    def _findId(self, arcpath, min_or_max):
-        """ return the min_or_max filename in path (as a 3 dight string) """
+    def _namelistOf(self, arcpath):
+        if arcpath.endswith('.idx'):
+            reader = archive_file.ArchiveReader(arcpath)
+            try:
+                return reader.namelist()
+            finally:
+                reader.close()
 
         zfile = zipfile.ZipFile(arcpath, 'r')                   # would throw BadZipfile if not a zip file
         try:
-            files = zfile.namelist()
-            files = filter(self.filename_pattern.match, files)  # filter invalid filename
-            if not files:
-                # This is an odd case when there is a zip but nothing inside
-                # (possibly some exception happened when adding to archive).
-                # The min and max id is arguably not correct.
-                return '000'
-
-            return min_or_max(files)
-
+            return zfile.namelist()
         finally:
             zfile.close()
 
 
+    def _namelist(self, apath, arc):
+        """ Return the valid filenames in the archive arc, either the
+            zip or the converted idx or both
+        """
+        files = {}
+        for ext in ['.zip', '.idx']:
+            arcpath = apath/arc+ext
+            if arcpath.exists():
+                for name in self._namelistOf(arcpath):
+                    files[name] = 1
+        return filter(self.filename_pattern.match, files.keys())    # filter invalid filename
+
+
+    def _findId(self, files, min_or_max):
+        """ return the min_or_max of the filenames in an archive (as a 3 dight string) """
+        if not files:
+            # This is an odd case when there is a zip but nothing inside
+            # (possibly some exception happened when adding to archive).
+            # The min and max id is arguably not correct.
+            return '000'
+
+        return min_or_max(files)
+
+
     def getNewId(self):
         """ Return an unused new id. Id is in the format of 9 digit string. """
 
@@ -147,6 +302,9 @@ class ArchiveHandler(object):
         Parameter:
             mode - 'r' for read and 'w' for write
                    Internally use 'a' instead or 'w' if zip file exist (see zipfile.ZipFile)
+
+        With archive.format=dat new documents are written to NNNNNN.dat/.idx
+        (see archive_file) instead of NNNNNN.zip.
     """
 
     def __init__(self, mode):
@@ -155,6 +313,9 @@ class ArchiveHandler(object):
         self.arc_path = None
         self.zfile = None
         self.mode = mode
+        self.format = cfg.get('archive.format', 'zip')
+        self.numAdded = 0               # documents added to arc_path
+        self.lastId = None
 
 
     def _open(self, id):
@@ -168,9 +329,16 @@ class ArchiveHandler(object):
             else:                               # different arc_path,
                 self.close()                    #   must close previously opened zfile
 
+        idx_path = archive_file.idxPath(arc_path)
+        if self.mode == 'w' and self.format == 'dat':
+            compress = archive_file.compressMode(cfg.get('archive.compress', 'deflate'))
+            self.zfile = archive_file.ArchiveWriter(idx_path, compress)
+        elif self.mode == 'r' and os.path.exists(idx_path):
+            self.zfile = archive_file.ArchiveReader(idx_path)
+
         # It would be easier if ZipFile can use 'a' to create new archive.
         # Instead do some checking first.
-        if self.mode == 'w' and arc_path.exists():
+        elif self.mode == 'w' and arc_path.exists():
             self.zfile = zipfile.ZipFile(arc_path, 'a', zipfile.ZIP_DEFLATED)
         else:
             self.zfile = zipfile.ZipFile(arc_path, self.mode, zipfile.ZIP_DEFLATED)
@@ -182,8 +350,34 @@ class ArchiveHandler(object):
     def close(self):
         if self.zfile:
             self.zfile.close()
+            if self.mode == 'w':
+                zipCache.invalidate(self.arc_path)
+                if self.numAdded:
+                    self._updateManifest()
         self.zfile = None
         self.arc_path = None
+        self.numAdded = 0
+        self.lastId = None
+
+
+    def _updateManifest(self):
+        """ Record the documents added to arc_path. Without a manifest
+            leave it to IdCounter to build one by scanning.
+        """
+        apath = self.arc_path.parent
+        manifest = Manifest.load(apath)
+        if not manifest:
+            return
+        arc = self.arc_path.namebase
+        entry = manifest.archives.setdefault(arc, [0, ''])
+        if entry[0] >= 0:
+            entry[0] += self.numAdded
+        entry[1] = _stamp(apath, arc)
+        manifest.endId = max(manifest.endId, int(self.lastId)+1)
+        try:
+            manifest.save(apath)
+        except (IOError, OSError), e:
+            log.warn('Unable to save manifest: %s', e)
 
 
     def add_document(self, id, fp):
@@ -196,6 +390,9 @@ class ArchiveHandler(object):
             raise KeyError, 'Duplicated entry %s in %s' % (filename, self.arc_path)
 
         self.zfile.writestr(filename, fp.read())
+        self.numAdded += 1
+        if self.lastId is None or id > self.lastId:
+            self.lastId = id
 
 
 
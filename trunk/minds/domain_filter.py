@@ -1,14 +1,100 @@
-"""Usage: domain_filter.py
+"""Usage: domain_filter.py [uri]
+
+Excluded domains come from filter.domain.0 - filter.domain.4 and from
+the blocklist file filter.domain_file, one domain per line. A domain
+starting with '.' matches any host under it. Otherwise it matches the
+host exactly.
 """
 
+import logging
 import string
 import sys
 
 from minds.config import cfg
 from minds.util import httputil
+from minds.util.lrucache import LRUCache
+
+log = logging.getLogger('domainfilter')
+
+
+g_exdm = None           # list of excluded domains
+g_filter = None         # DomainFilter compiled from g_exdm
+
+CACHE_SIZE = 1024       # number of recent host verdicts to remember
+
+
+class DomainFilter(object):
+    """ The excluded domains compiled into a trie of reversed labels,
+        e.g. 'www.xyz.com' -> com, xyz, www
+    """
+
+    EXACT  = 0              # keys of a trie node for a match at the node
+    SUFFIX = 1
+
+    def __init__(self, exdms):
+        self.exdms = exdms
+        self.trie = {}
+        for order, ex in enumerate(exdms):
+            if ex[:1] == '.':
+                kind, labels = self.SUFFIX, ex[1:].split('.')
+            else:
+                kind, labels = self.EXACT, ex.split('.')
+            node = self.trie
+            labels.reverse()
+            for label in labels:
+                node = node.setdefault(label, {})
+            node.setdefault(kind, (order, ex))    # the first one in exdms wins
+        self.cache = LRUCache(CACHE_SIZE)
+
+
+    def _match(self, host):
+        labels = host.split('.')
+        labels.reverse()
+        n = len(labels)
+        best = None
+        node = self.trie
+        for i, label in enumerate(labels):
+            node = node.get(label)
+            if node is None:
+                break
+            if i+1 < n:
+                m = node.get(self.SUFFIX)
+            else:
+                m = node.get(self.EXACT)
+            if m and (best is None or m < best):
+                best = m
+        if best:
+            return best[1]
+        return None
+
 
+    def match(self, host):
+        """ Return the excluded domain that match host. None if not excluded. """
+        result = self.cache.get(host, False)
+        if result is False:
+            result = self._match(host)
+            self.cache.put(host, result)
+        return result
 
-g_exdm = None
+
+
+def _parseList(exdm_str):
+    lst = exdm_str.split(',')                           # parse ',' separated str
+    return filter(None, map(string.strip, lst))         # strip spaces, drop ''
+
+
+def loadFile(pathname):
+    """ Read a blocklist file. One domain per line. Text after '#' is ignored. """
+    exdms = []
+    fp = file(pathname, 'rb')
+    try:
+        for line in fp:
+            line = line.split('#',1)[0].strip()
+            if line:
+                exdms.append(line)
+    finally:
+        fp.close()
+    return exdms
 
 
 def load():
@@ -16,32 +102,42 @@ def load():
     exdms = []
     for i in range(5):
         exdm_str = cfg.get('filter.domain.%s' % i, '')   # get domain.0 - domain.4
-        lst = exdm_str.split(',')                           # parse ',' separated str
-        exdms += filter(None, map(string.strip, lst))       # strip spaces, drop ''
+        exdms += _parseList(exdm_str)
+
+    pathname = cfg.get('filter.domain_file', '')
+    if pathname:
+        try:
+            exdms += loadFile(pathname)
+        except IOError, e:
+            log.warn('Unable to read domain blocklist %s: %s', pathname, e)
 
     global g_exdm
     g_exdm = exdms  # atomic switch over
 
 
-def match(uri):
-    """ Return the filter domain that match the uri. None means not filtered. """
-
+def _getFilter():
+    """ Return the DomainFilter of g_exdm, compile it if g_exdm is changed """
+    global g_filter
     if g_exdm == None:
         load()
+    exdms = g_exdm
+    exdm_filter = g_filter
+    if exdm_filter is None or exdm_filter.exdms is not exdms:
+        exdm_filter = g_filter = DomainFilter(exdms)
+    return exdm_filter
 
+
+def match(uri):
+    """ Return the filter domain that match the uri. None means not filtered. """
     scheme, userinfo, host, path, query, frag = httputil.urlsplit(uri)
-    for ex in g_exdm:
-        if ex[0] == '.':
-            if host.endswith(ex):
-                return ex
-        else:
-            if host == ex:
-                return ex
-    return None
+    return _getFilter().match(host)
 
 
 def main(argv):
-    pass
+    if len(argv) < 2:
+        print __doc__
+        sys.exit(-1)
+    print match(argv[1])
 
 if __name__ == '__main__':
-    main(sys.argv)
\ No newline at end of file
+    main(sys.argv)
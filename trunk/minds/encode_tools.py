@@ -11,11 +11,10 @@ Precedence rules
 
 import codecs
 import logging
+import re
 import sys
-import StringIO
 
 from toollib import sgmllib         # custom version of sgmllib
-from minds.util import html_pull_parser
 from minds.util import rspreader
 
 
@@ -53,17 +52,34 @@ def _getvalue(attrs, name):
     return ''
 
 
+# <meta> tags, skipping over comments
+_meta_scan = re.compile(r'<!--.*?--\s*>|<meta(\s[^<>]*)?>', re.I | re.S)
+
+def _parseattrs(text):
+    """ Parse the attributes of a tag like sgmllib """
+    attrs = []
+    for attrname, rest, attrvalue in sgmllib.attrfind.findall(text):
+        if not rest:
+            attrvalue = attrname
+        elif attrvalue[:1] == '\'' == attrvalue[-1:] or \
+             attrvalue[:1] == '"' == attrvalue[-1:]:
+            attrvalue = attrvalue[1:-1]
+        attrs.append((attrname.lower(), attrvalue))
+    return attrs
+
+
 def findMetaHttpEquiv(first_block):
-    fp = StringIO.StringIO(first_block)
-    try:
-        for token in html_pull_parser.generate_tokens(fp):
-            if token[:2] == (html_pull_parser.TAG, 'meta'):
-                http_equiv = _getvalue(token[2],'http-equiv').lower()
-                if http_equiv == 'content-type':
-                    attrs = token[2]
-                    return findCharSet(_getvalue(attrs,'content'))
-    except sgmllib.SGMLParseError, e:
-        log.warn('Error looking for <meta> encoding "%s"', str(e))   # ParseError not uncommon, just log
+    """ Find the charset of <meta http-equiv="Content-Type"> in
+        first_block. Only the bytes are scanned. It does not go through the
+        HTML parser, whichever indexing.html_tokenizer selects, because the
+        document would be parsed once more anyway.
+    """
+    for m in _meta_scan.finditer(first_block):
+        if m.group(1) is None:
+            continue                # comment or <meta>
+        attrs = _parseattrs(m.group(1))
+        if _getvalue(attrs,'http-equiv').lower() == 'content-type':
+            return findCharSet(_getvalue(attrs,'content'))
     return ''
 
 
@@ -9,11 +9,29 @@ import threading
 import urlparse
 
 from minds.config import cfg
+from minds import connpool
 from minds.util import threadutil
 
 log = logging.getLogger('httpserver')
 
 
+def verify_local_request(request, client_address):
+    """ Restrict to local access only """
+
+    src = client_address[0]
+    if src != "127.0.0.1":
+        log.error('Deny connection from %s' % src)
+        return False
+
+    dest = request.getsockname()[0]
+    if dest != "127.0.0.1":
+        log.error('Deny connection to nonlocal destination %s' % dest)
+        return False
+
+    return True
+
+
+
 class HTTPServer(BaseHTTPServer.HTTPServer):
     """ """
 
@@ -26,19 +44,7 @@ class HTTPServer(BaseHTTPServer.HTTPServer):
 
 
     def verify_request(self, request, client_address):
-        """ Restrict to local access only """
-
-        src = client_address[0]
-        if src != "127.0.0.1":
-            log.error('Deny connection from %s' % src)
-            return False
-
-        dest = request.getsockname()[0]
-        if dest != "127.0.0.1":
-            log.error('Deny connection to nonlocal destination %s' % dest)
-            return False
-
-        return True
+        return verify_local_request(request, client_address)
 
 
     def get_request(self):
@@ -62,6 +68,23 @@ class HTTPServer(BaseHTTPServer.HTTPServer):
 
 
 
+def read_http_proxy():
+    """ Return the netloc of the next hop proxy configured in
+        http.http_proxy. '' if it is not set or is invalid.
+    """
+    # setting in CERN httpd format (http://www.w3.org/Daemon/User/Proxies/ManyProxies.html)
+    http_proxy = cfg.get('http.http_proxy', '')
+    if not http_proxy:
+        return ''
+
+    (scm, netloc, path, params, query, fragment) = urlparse.urlparse( http_proxy, 'http')
+    if scm != 'http' or not netloc:
+        log.error('Invalid http_proxy="%s"', http_proxy)
+        return ''
+    return netloc
+
+
+
 # todo: this is not quite generic PooledHTTPServer but with next hop proxy support for Minds proxy
 
 class PooledHTTPServer(HTTPServer):
@@ -72,28 +95,20 @@ class PooledHTTPServer(HTTPServer):
         self.pool = threadutil.PooledExecutor(numThreads, True)
         self.worker_status = [None] * numThreads
         self.next_proxy_netloc = ''
+        self.connpool = connpool.makePool()
         self.read_config()
 
 
     def read_config(self):
 
         # reset only http_proxy here?!
-
-        # setting in CERN httpd format (http://www.w3.org/Daemon/User/Proxies/ManyProxies.html)
-        http_proxy = cfg.get('http.http_proxy', '')
-        if not http_proxy:
-            return
-
-        (scm, netloc, path, params, query, fragment) = urlparse.urlparse( http_proxy, 'http')
-        if scm != 'http' or not netloc:
-            log.error('Invalid http_proxy="%s"', http_proxy)
-            return
-        self.next_proxy_netloc = netloc
+        self.next_proxy_netloc = read_http_proxy()
 
 
     def report_config(self):
-        return 'address=%s http_proxy="%s" #threads=%s' % \
-            (self.server_address, self.next_proxy_netloc, len(self.pool.threads))
+        return 'address=%s http_proxy="%s" #threads=%s upstream_pool=%s' % \
+            (self.server_address, self.next_proxy_netloc, len(self.pool.threads),
+             self.connpool and self.connpool.max_per_host or 0)
 
 
     def process_request(self, request, client_address):
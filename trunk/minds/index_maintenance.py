@@ -0,0 +1,263 @@
+"""Usage: index_maintenance.py option [index_dir]
+
+options:
+    -s  show the number of segments
+    -o  optimize now
+
+Index batches only append segments. IndexProcess opens its writer with
+indexing.merge_factor so that Lucene merges segments less often while
+the documents are added. Merging the segments is left to this task, which
+is scheduled separately in the index thread. It optimizes the index only
+when
+
+    the number of segments reaches indexing.optimize_segments,
+    the local time is within indexing.optimize_window, e.g. '2-6' for 2am
+        to 6am, or blank for any time, and
+    the proxy has been idle for indexing.interval minutes.
+
+Lucene holds the GIL while it optimizes. Unless the application is
+frozen (py2exe) optimize runs in a child process, so that searches keep
+working against the existing segments in the meantime.
+
+The indexer and optimize may run in different processes. They take turns
+with IndexLock, a lock file next to the index. Optimize is skipped while
+IndexProcess holds it and vice versa.
+"""
+
+import datetime
+import errno
+import logging
+import os
+import struct
+import subprocess
+import sys
+import time
+
+from minds.config import cfg
+from minds import messagelog
+
+log = logging.getLogger('idxmaint')
+
+# exit code of the optimize process if the index is locked
+EXIT_LOCKED = 3
+
+# a lock older than this is left by a process that has died
+STALE_LOCK_SECONDS = 6 * 3600
+
+
+class IndexLock(object):
+    """ An advisory lock on the index held by IndexProcess while it writes
+        and by optimize. It is the file <indexpath>.lock so that it works
+        across the proxy, the indexer process and the optimize process.
+    """
+
+    def __init__(self, indexpath):
+        self.path = str(indexpath) + '.lock'
+        self.held = False
+
+
+    def acquire(self):
+        """ Return False if the lock is held by someone else """
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+            if not self.isStale():
+                return False
+            log.warn('Remove stale lock %s', self.path)
+            self.clear()
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+                return False
+        try:
+            os.write(fd, str(os.getpid()))
+        finally:
+            os.close(fd)
+        self.held = True
+        return True
+
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.clear()
+
+
+    def isLocked(self):
+        return os.path.exists(self.path) and not self.isStale()
+
+
+    def isStale(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return True
+        return time.time() - mtime > STALE_LOCK_SECONDS
+
+
+    def clear(self):
+        """ Remove the lock regardless of its owner, e.g. on startup """
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+
+def countSegments(indexpath):
+    """ Return the number of segments listed in the Lucene 'segments'
+        file of indexpath. 0 if there is no index.
+    """
+    try:
+        fp = file(os.path.join(indexpath, 'segments'), 'rb')
+    except IOError:
+        return 0
+    try:
+        data = fp.read(20)
+    finally:
+        fp.close()
+    if len(data) < 8:
+        return 0
+    format = struct.unpack('>i', data[:4])[0]
+    if format < 0:
+        # format, version(long), counter, segment count
+        if len(data) < 20:
+            return 0
+        return struct.unpack('>i', data[16:20])[0]
+    else:
+        # pre 1.4 format: counter, segment count
+        return struct.unpack('>i', data[4:8])[0]
+
+
+def parseWindow(window):
+    """ Parse 'start-end' in hours. Return (start, end) or None for any time. """
+    window = window.strip()
+    if not window:
+        return None
+    try:
+        start, end = window.split('-',1)
+        start, end = int(start), int(end)
+    except ValueError:
+        log.warn('Invalid optimize_window: %s', window)
+        return None
+    return start % 24, end % 24
+
+
+def inWindow(now, window):
+    """ Return whether the hour of now is within window. The window may
+        wrap around midnight, e.g. (22, 4).
+    """
+    if window is None:
+        return True
+    start, end = window
+    if start <= end:
+        return start <= now.hour < end
+    else:
+        return now.hour >= start or now.hour < end
+
+
+def shouldOptimize(now, indexpath):
+    """ Return the number of segments if the index should be optimized, otherwise 0 """
+    threshold = cfg.getint('indexing.optimize_segments', 20)
+    if threshold <= 0:
+        return 0
+    if not inWindow(now, parseWindow(cfg.get('indexing.optimize_window', ''))):
+        return 0
+    interval = datetime.timedelta(minutes=cfg.getint('indexing.interval',3))
+    if now - messagelog.mlog.lastRequest < interval:
+        return 0
+    segments = countSegments(indexpath)
+    if segments < threshold:
+        return 0
+    return segments
+
+
+def optimize(indexpath):
+    """ Optimize the index in this process. Return False if the index is
+        locked by the indexer.
+    """
+    lock = IndexLock(indexpath)
+    if not lock.acquire():
+        return False
+    try:
+        from minds import lucene_logic
+        import PyLucene
+        # no indexer is writing, a Lucene write lock left is stale
+        directory = lucene_logic.openDirectory(indexpath)
+        if PyLucene.IndexReader.isLocked(directory):
+            log.warn('Unlock stale index write lock %s', indexpath)
+            PyLucene.IndexReader.unlock(directory)
+        writer = lucene_logic.Writer(indexpath)
+        try:
+            writer.writer.optimize()
+        finally:
+            writer.close()
+    finally:
+        lock.release()
+    return True
+
+
+def _optimizeProcess(indexpath):
+    """ Optimize in a child process. Return its exit code. """
+    args = [sys.executable, '-m', 'minds.index_maintenance', '-o', indexpath]
+    return subprocess.call(args)
+
+
+def maintenanceTask(now=None):
+    """ Optimize the index if it is due. Return True if it is optimized. """
+    if now is None:
+        now = datetime.datetime.now()
+    indexpath = cfg.getpath('archiveindex')
+    segments = shouldOptimize(now, indexpath)
+    if not segments:
+        return False
+
+    if IndexLock(indexpath).isLocked():
+        log.info('Index is locked. Optimize later.')
+        return False
+
+    log.info('Optimize index %s segments=%s', indexpath, segments)
+    t0 = time.time()
+    if getattr(sys, 'frozen', False):
+        rc = optimize(indexpath) and 0 or EXIT_LOCKED
+    else:
+        rc = _optimizeProcess(indexpath)
+    if rc == EXIT_LOCKED:
+        log.info('Index is locked. Optimize later.')
+        return False
+    elif rc != 0:
+        log.error('Optimize process exit code %s', rc)
+        return False
+    log.info('Optimized index in %.1fs segments=%s', time.time() - t0, countSegments(indexpath))
+    return True
+
+
+
+def main(argv):
+    if len(argv) < 2:
+        print __doc__
+        sys.exit(-1)
+
+    option = argv[1]
+    if len(argv) > 2:
+        indexpath = argv[2]
+    else:
+        indexpath = cfg.getpath('archiveindex')
+
+    if option == '-s':
+        print 'segments:', countSegments(indexpath)
+    elif option == '-o':
+        if not optimize(indexpath):
+            print 'index is locked:', IndexLock(indexpath).path
+            sys.exit(EXIT_LOCKED)
+    else:
+        print __doc__
+        sys.exit(-1)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
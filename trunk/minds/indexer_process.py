@@ -0,0 +1,221 @@
+"""Usage: indexer_process.py
+
+Run the Lucene indexing in a child process.
+
+PyLucene holds the GIL while it writes the index (see
+lucene_logic.thread_test). When backgroundIndexTask indexes in the proxy
+process every other thread, including the proxy and admin threads, stalls
+until the batch is done. With indexing.indexer_process set, the proxy
+starts this module as a child process. The child owns the index Writer,
+Searcher and ArchiveHandler. The proxy only sends it the *.qtxt to index
+and waits for the reply. Waiting on the pipe releases the GIL.
+
+Messages are pickled tuples over the child's stdin and stdout.
+
+    proxy -> child
+        ('index', logpath, qtxts)
+        ('quit',)
+
+    child -> proxy
+        ('progress', indexed, discarded, total)
+        ('done', indexed, discarded, totalIndexed)
+        ('error', message)
+"""
+
+import cPickle
+import logging
+import logging.handlers
+import os
+import subprocess
+import sys
+import threading
+
+if __name__ == '__main__':
+    # Keep the real stdout for the messages. Do this before loading
+    # config, which logs to stdout. Anything else printed goes to stderr.
+    if sys.platform == 'win32':
+        import msvcrt
+        msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+        msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+    _msgout = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+from minds.config import cfg
+from minds import qmsg_processor
+from minds import queueindex
+from toollib.path import path
+
+log = logging.getLogger('indexer')
+
+
+class IndexerClient(object):
+    """ Used in the proxy process to run the indexer child process.
+        Has the same run() method as IndexProcess.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.proc = None
+        self.progress = (0, 0, 0)   # indexed, discarded, total of current batch
+        self.numBatches = 0
+        self.numRestarts = 0
+
+
+    def _start(self):
+        args = [sys.executable, '-m', 'minds.indexer_process']
+        self.proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        log.info('Started indexer process pid=%s', self.proc.pid)
+
+
+    def _send(self, msg):
+        cPickle.dump(msg, self.proc.stdin, 2)
+        self.proc.stdin.flush()
+
+
+    def _stop(self):
+        """ Forget the child process. It would exit once stdin is closed. """
+        proc, self.proc = self.proc, None
+        if not proc:
+            return
+        try:
+            proc.stdin.close()
+        except IOError:
+            pass
+        proc.wait()
+
+
+    def run(self, logpath, qtxts):
+        """ Index qtxts in the child. Returns number of indexed, discarded """
+        qtxts = filter(None, qtxts)
+        if not qtxts: return 0, 0
+
+        self.lock.acquire()
+        try:
+            if not self.proc or self.proc.poll() is not None:
+                if self.proc:
+                    log.warn('Indexer process exited %s, restart', self.proc.returncode)
+                    self.numRestarts += 1
+                self._start()
+            self.numBatches += 1
+            self.progress = (0, 0, len(qtxts))
+            try:
+                self._send(('index', str(logpath), qtxts))
+                while True:
+                    msg = cPickle.load(self.proc.stdout)
+                    if msg[0] == 'progress':
+                        self.progress = msg[1:]
+                    elif msg[0] == 'done':
+                        indexed, discarded, qmsg_processor.totalIndexed = msg[1:]
+                        break
+                    else:
+                        raise RuntimeError('Indexer error: %s' % msg[1])
+            except (EOFError, IOError, cPickle.UnpicklingError), e:
+                # the child has died. Find out which *.qtxt are left.
+                self._stop()
+                queueindex.getIndex(logpath).rescan()
+                raise RuntimeError('Indexer process failed: %s' % e)
+            except RuntimeError:
+                queueindex.getIndex(logpath).rescan()
+                raise
+        finally:
+            self.lock.release()
+
+        # the child has removed the files but not updated the queue
+        index = queueindex.getIndex(logpath)
+        for filename in qtxts:
+            index.remove(filename)
+        return indexed, discarded
+
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            if self.proc and self.proc.poll() is None:
+                try:
+                    self._send(('quit',))
+                except IOError:
+                    pass
+            self._stop()
+        finally:
+            self.lock.release()
+
+
+    def __str__(self):
+        if self.proc:
+            pid = self.proc.pid
+        else:
+            pid = None
+        return 'pid=%s batches=%s restarts=%s progress=%s/%s/%s' % (
+            (pid, self.numBatches, self.numRestarts) + tuple(self.progress))
+
+
+
+def makeIndexer():
+    """ Create an IndexerClient from config. None means index in process. """
+    if not cfg.getboolean('indexing.indexer_process', False):
+        return None
+    if getattr(sys, 'frozen', False):
+        log.warn('indexer_process is not supported in frozen application')
+        return None
+    return IndexerClient()
+
+
+
+# ----------------------------------------------------------------------
+# Child process
+
+def serve(rfile, wfile):
+    """ Index batches requested from rfile until 'quit' or EOF """
+
+    def send(msg):
+        cPickle.dump(msg, wfile, 2)
+        wfile.flush()
+
+    def onProgress(indexed, discarded, total):
+        send(('progress', indexed, discarded, total))
+
+    while True:
+        try:
+            msg = cPickle.load(rfile)
+        except EOFError:
+            return
+        if msg[0] == 'quit':
+            return
+        elif msg[0] == 'index':
+            logpath, qtxts = path(msg[1]), msg[2]
+            process = qmsg_processor.makeIndexProcess()
+            process.updateQueue = False         # the queue is owned by the proxy
+            process.onProgress = onProgress
+            try:
+                indexed, discarded = process.run(logpath, qtxts)
+            except Exception, e:
+                log.exception('Error indexing %s', qtxts[:1])
+                send(('error', str(e)))
+            else:
+                send(('done', indexed, discarded, qmsg_processor.totalIndexed))
+        else:
+            send(('error', 'Unknown command %s' % msg[0]))
+
+
+def setupLogging():
+    """ Log to indexer.log. system.log belongs to the proxy process. """
+    rootlog = logging.getLogger()
+    map(rootlog.removeHandler, rootlog.handlers)
+    logpath = cfg.getpath('logs')/'indexer.log'
+    hdlr = logging.handlers.RotatingFileHandler(logpath, 'a', 1100000, 4)
+    hdlr.setFormatter(logging.Formatter('%(asctime)s %(name)-10s - %(message)s'))
+    rootlog.addHandler(hdlr)
+    rootlog.setLevel(logging.DEBUG)
+
+
+def main(argv):
+    setupLogging()
+    if hasattr(os, 'nice'):
+        os.nice(10)
+    log.info('Indexer process started pid=%s', os.getpid())
+    serve(sys.stdin, _msgout)
+    log.info('Indexer process exit')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
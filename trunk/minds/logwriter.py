@@ -0,0 +1,200 @@
+"""Write message logs in a background thread
+
+MsgLogger.dispose() used to save the qlog/mlog on the proxy worker
+thread. With a LogWriter the CacheFile is queued and the worker returns
+to serve the browser immediately. The queue is bounded. When it is full
+dispose() blocks until the writer catches up, so a slow disk slows down
+the proxy rather than using up memory.
+"""
+
+import datetime
+import logging
+import os
+import Queue
+import threading
+import time
+
+from minds.config import cfg
+
+log = logging.getLogger('logwriter')
+
+
+def write(cachefp, id, qlog, mlog, fsync=False):
+    """ Save cachefp as qlog and/or mlog and then discard it """
+    try:
+        if fsync:
+            cachefp.fsync = True
+        if qlog:
+            cachefp.write_qlog(id)
+        if mlog:
+            cachefp.write_mlog(id)
+    finally:
+        cachefp.discard()
+
+
+
+class LogWriter(threading.Thread):
+    """ Background thread to save CacheFile. """
+
+    terminateTask = object()    # sentinel object
+
+    def __init__(self, maxsize=64, batch=16, fsync=False, onWritten=None):
+        """ maxsize - queue depth before dispose() blocks
+            batch - maximum number of logs to write in one go
+            fsync - fsync each file before rename and the logs directory
+                after each batch
+            onWritten - called with (id, qlog) after a log is written
+        """
+        threading.Thread.__init__(self, name='logwriter')
+        self.setDaemon(True)
+        self.queue = Queue.Queue(maxsize)
+        self.batch = max(batch, 1)
+        self.fsync = fsync
+        self.onWritten = onWritten
+
+        # statistics
+        self.lock = threading.Lock()
+        self.written = 0
+        self.errors = 0
+        self.batches = 0
+        self.blocked = 0            # number of put() that has to wait
+        self.maxDepth = 0
+        self.latency = 0.0          # total time from put() until written
+        self.maxLatency = 0.0
+        self.writeTime = 0.0        # total time spent in writing
+        self.starttime = datetime.datetime.now()
+
+
+    def put(self, cachefp, id, qlog, mlog):
+        """ Queue cachefp to be written. Block if the queue is full. """
+        if self.queue.full():
+            self.lock.acquire()
+            try:
+                self.blocked += 1
+            finally:
+                self.lock.release()
+        self.queue.put((cachefp, id, qlog, mlog, time.time()))
+        depth = self.queue.qsize()
+        if depth > self.maxDepth:
+            self.maxDepth = depth
+
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is self.terminateTask:
+                return
+            items = [item]
+            try:
+                while len(items) < self.batch:
+                    item = self.queue.get_nowait()
+                    if item is self.terminateTask:
+                        self._writeBatch(items)
+                        return
+                    items.append(item)
+            except Queue.Empty:
+                pass
+            self._writeBatch(items)
+
+
+    def _writeBatch(self, items):
+        t0 = time.time()
+        written = []
+        for cachefp, id, qlog, mlog, queued in items:
+            try:
+                write(cachefp, id, qlog, mlog, self.fsync)
+                written.append((id, qlog))
+            except:
+                log.exception('Unable to write log %s', id)
+        if self.fsync:
+            self._fsyncDir()
+        if self.onWritten:
+            for id, qlog in written:
+                try:
+                    self.onWritten(id, qlog)
+                except:
+                    log.exception('Error in onWritten %s', id)
+        t1 = time.time()
+
+        self.lock.acquire()
+        try:
+            self.batches += 1
+            self.written += len(written)
+            self.errors += len(items) - len(written)
+            self.writeTime += t1 - t0
+            for item in items:
+                latency = t1 - item[-1]
+                self.latency += latency
+                self.maxLatency = max(self.maxLatency, latency)
+        finally:
+            self.lock.release()
+
+
+    def _fsyncDir(self):
+        """ Make the renames durable. Not supported in Windows. """
+        try:
+            fd = os.open(cfg.getpath('logs'), os.O_RDONLY)
+        except (OSError, AttributeError):
+            return
+        try:
+            try:
+                os.fsync(fd)
+            except OSError:
+                pass
+        finally:
+            os.close(fd)
+
+
+    def close(self, timeout=None):
+        """ Write all queued logs and stop the thread """
+        if not self.isAlive():
+            return
+        try:
+            self.queue.put(self.terminateTask, True, timeout)
+        except Queue.Full:
+            log.error('Unable to stop log writer, queue depth %s', self.depth())
+            return
+        self.join(timeout)
+
+
+    def depth(self):
+        return self.queue.qsize()
+
+
+    def __str__(self):
+        self.lock.acquire()
+        try:
+            n = self.written + self.errors
+            if n:
+                avg_latency = self.latency / n
+                avg_write = self.writeTime / n
+            else:
+                avg_latency = avg_write = 0.0
+            return 'depth=%s max_depth=%s blocked=%s written=%s errors=%s batches=%s ' \
+                   'avg_latency=%.1fms max_latency=%.1fms avg_write=%.1fms since %s' % (
+                self.depth(),
+                self.maxDepth,
+                self.blocked,
+                self.written,
+                self.errors,
+                self.batches,
+                avg_latency * 1000,
+                self.maxLatency * 1000,
+                avg_write * 1000,
+                str(self.starttime)[:19],
+                )
+        finally:
+            self.lock.release()
+
+
+
+def makeWriter(onWritten=None):
+    """ Create and start a LogWriter from config. None means write synchronously. """
+    maxsize = cfg.getint('messagelog.writer_queue', 0)
+    if maxsize <= 0:
+        return None
+    batch = cfg.getint('messagelog.writer_batch', 16)
+    fsync = cfg.getboolean('messagelog.writer_fsync', False)
+    writer = LogWriter(maxsize, batch, fsync, onWritten)
+    writer.start()
+    return writer
@@ -5,6 +5,7 @@ Provide a few methods for use with MindRetrieve.
 
 import logging
 import os, os.path, sys
+import threading
 import traceback
 
 import PyLucene
@@ -16,6 +17,8 @@ __all__ = [
     'Reader',
     'Writer',
     'Searcher',
+    'SearcherManager',
+    'getSearcherManager',
 ]
 
 log = logging.getLogger('lucene')
@@ -119,6 +122,8 @@ class Writer(object):
             log.error('Error creating IndexWriter pathname=' + pathname)
             raise
         self.writer.maxFieldLength = 1048576 ########<<< todo: ????
+        # store the term vector with offsets for use by the highlighter
+        self.termVectors = cfg.getboolean('indexing.term_vectors', False)
 
 
     def __getattr__(self, attr):
@@ -140,7 +145,11 @@ class Writer(object):
 
         doc = PyLucene.Document()
         doc.add(PyLucene.Field("docid"  , docid  , True,  True, False))
-        doc.add(PyLucene.Field("content", content, False, True, True ))
+        if self.termVectors:
+            doc.add(PyLucene.Field("content", content, PyLucene.Field.Store.NO,
+                PyLucene.Field.Index.TOKENIZED, PyLucene.Field.TermVector.WITH_POSITIONS_OFFSETS))
+        else:
+            doc.add(PyLucene.Field("content", content, False, True, True ))
         if uri : doc.add(PyLucene.Field('uri'  , uri , True,  True,  False))
         if date: doc.add(PyLucene.Field('date' , date, True,  True,  False))
         if etag: doc.add(PyLucene.Field('etag' , etag, True,  False, False))
@@ -191,6 +200,146 @@ class Searcher(object):
 
 
 
+class SearcherManager(object):
+    """ Share one long-lived Searcher among concurrent requests. Opening
+        an IndexReader for every search is costly. The Searcher is reopened
+        only when the index has a new version, i.e. a writer has committed.
+
+        searcher = manager.acquire()
+        try:
+            ...
+        finally:
+            manager.release(searcher)
+
+        The old Searcher is closed after the last user has released it.
+    """
+
+    def __init__(self, **args):
+        """ pathname or directory - same as Searcher """
+        self.args = args
+        self.lock = threading.Lock()
+        self.current = None
+        self.refcount = {}          # Searcher -> number of users
+        self.numOpened = 0
+        self.numAcquired = 0
+
+
+    def _version(self):
+        if not self.current:
+            return None
+        return PyLucene.IndexReader.getCurrentVersion(self.current.reader.directory)
+
+
+    def _isCurrent(self):
+        try:
+            return self.current.generation == self._version()
+        except:
+            log.exception('Unable to read index version')
+            return False
+
+
+    def acquire(self):
+        """ Return the current Searcher. Must call release() afterward. """
+        self.lock.acquire()
+        try:
+            if not self.current or not self._isCurrent():
+                self._reopen()
+            searcher = self.current
+            self.refcount[searcher] += 1
+            self.numAcquired += 1
+            return searcher
+        finally:
+            self.lock.release()
+
+
+    def _reopen(self):
+        searcher = Searcher(**self.args)
+        # the version of the index when it is opened
+        searcher.generation = searcher.reader.reader.getVersion()
+        old, self.current = self.current, searcher
+        self.refcount[searcher] = 1     # held by self.current
+        self.numOpened += 1
+        if old:
+            self._decRef(old)
+        log.debug('Opened searcher generation %s', searcher.generation)
+
+
+    def _decRef(self, searcher):
+        self.refcount[searcher] -= 1
+        if self.refcount[searcher] <= 0:
+            del self.refcount[searcher]
+            searcher.close()
+
+
+    def release(self, searcher):
+        self.lock.acquire()
+        try:
+            self._decRef(searcher)
+        finally:
+            self.lock.release()
+
+
+    def getGeneration(self):
+        """ Return the version of the index of the current Searcher """
+        searcher = self.acquire()
+        try:
+            return searcher.generation
+        finally:
+            self.release(searcher)
+
+
+    def close(self):
+        """ Close the current Searcher once all users have released it """
+        self.lock.acquire()
+        try:
+            if self.current:
+                old, self.current = self.current, None
+                self._decRef(old)
+        finally:
+            self.lock.release()
+
+
+    def __str__(self):
+        in_use = sum(self.refcount.values())
+        if self.current:
+            generation = self.current.generation
+            in_use -= 1             # not counting the reference of self.current
+        else:
+            generation = None
+        return 'generation=%s opened=%s acquired=%s in_use=%s' % (
+            generation, self.numOpened, self.numAcquired, in_use)
+
+
+
+_managers = {}
+_managersLock = threading.Lock()
+
+def getSearcherManager(pathname=None):
+    """ Return the SearcherManager of pathname. Default to the archive index. """
+    if pathname is None:
+        pathname = cfg.getpath('archiveindex')
+    _managersLock.acquire()
+    try:
+        manager = _managers.get(pathname)
+        if not manager:
+            manager = _managers[pathname] = SearcherManager(pathname=pathname)
+        return manager
+    finally:
+        _managersLock.release()
+
+
+def closeAll():
+    _managersLock.acquire()
+    try:
+        managers = _managers.values()
+        _managers.clear()
+    finally:
+        _managersLock.release()
+    for manager in managers:
+        manager.close()
+
+
+
 def showHits(hits, *args):
     """ A helper function to show the result of a Hits """
     print 'length:', hits.length()
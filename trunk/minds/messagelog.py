@@ -19,6 +19,9 @@ import threading
 import sys
 
 from minds.config import cfg
+from minds import domain_filter
+from minds import logwriter
+from minds import queueindex
 from minds import urifs
 from minds.util import fileutil
 from minds.util import httputil
@@ -72,6 +75,14 @@ class MessageInfo:
 
     def parseRsp(self, rspBuf, bytes_received):
         ''' interpret http response and setup MessageInfo fields '''
+        self.parseRspHeader(rspBuf)
+        self._parseHeaders(bytes_received)
+
+
+    def parseRspHeader(self, rspBuf):
+        ''' interpret http response header only, i.e. status,
+            rsp_headers and ctype.
+        '''
 
         # 09/02/04 note: according to the documentation
         # httplib.HTTPResponse shouldn't instantiated directly by user.
@@ -82,7 +93,39 @@ class MessageInfo:
 
         self.status = httpRsp.status
         self.rsp_headers = dict(httpRsp.getheaders())
-        self._parseHeaders(bytes_received)
+
+        # content-type
+        self.ctype = self.rsp_headers.get('content-type','')
+        if self.ctype:
+            self.ctype = httputil.abbreviate_ctype(self.ctype)
+
+
+    def isDiscardedByHeader(self):
+        ''' Apply the discard rules and the domain filter using only the
+            request and response header (see parseRspHeader()). Return
+            True if the message is surely to be discarded so that the
+            content need not be recorded.
+        '''
+        _no_store, _no_cache, _authorization = self._parseCacheHeaders()
+        if not self._isIndexable(_no_store, _authorization, False):
+            return True
+        return bool(domain_filter.match(self.req_path))
+
+
+    def _parseCacheHeaders(self):
+        ''' Return (no_store, no_cache, authorization) flags from the
+            request and response header.
+        '''
+        # cache-control
+        items = self.rsp_headers.get('cache-control', '').split(',')
+        items = [item.strip().lower() for item in items]
+        _no_store = 'no-store' in items
+        _no_cache = 'no-cache' in items
+
+        # authorization
+        _authorization = self.req_headers.has_key('authorization')
+
+        return _no_store, _no_cache, _authorization
 
 
     def _parseHeaders(self, bytes_received):
@@ -101,19 +144,7 @@ class MessageInfo:
         except:
             self.clen = bytes_received
 
-        # content-type
-        self.ctype = self.rsp_headers.get('content-type','')
-        if self.ctype:
-            self.ctype = httputil.abbreviate_ctype(self.ctype)
-
-        # cache-control
-        items = self.rsp_headers.get('cache-control', '').split(',')
-        items = [item.strip().lower() for item in items]
-        _no_store = 'no-store' in items
-        _no_cache = 'no-cache' in items
-
-        # authorization
-        _authorization = self.req_headers.has_key('authorization')
+        _no_store, _no_cache, _authorization = self._parseCacheHeaders()
 
         self.flags = (_no_store and 'S' or '_') + (_no_cache and 'C' or '_') + \
             (_truncated     and 'T' or \
@@ -121,21 +152,27 @@ class MessageInfo:
             (self.discard   and '_' or \
              '*')))
 
+        if self._isIndexable(_no_store, _authorization, _truncated):
+            self.discard = False
+
+
+    def _isIndexable(self, _no_store, _authorization, _truncated):
+        ''' Check the response against the discard rules '''
+
         # List of rules (and heuristics) to decide if the request should be discarded.
         # This is just simple filtering. More detail analysis would be applied during indexing.
         #
         # Note: some rationale of discarding
         #   discard: POST - non-idempotent method
         #   discard: 206 - Partial Content
-        if                                          \
+        return                                      \
            (self.command == 'GET')              and \
            (self.status == 200)                 and \
            (self.ctype in ['html','txt'])       and \
            (not _authorization)                 and \
            (not _no_store)                      and \
            (not _truncated)                     and \
-           (self.host_noport not in ['localhost']):
-            self.discard = False
+           (self.host_noport not in ['localhost'])
 
 
     @staticmethod
@@ -226,23 +263,17 @@ class MsgLogger(object):
         self.currentId = None
         self.lastIssued = None                      # last time an id is issued
         self.lastRequest = datetime.datetime.now()  # last activity, assinged by proxyhandler
-
-
-    def _listdir(self, logdir):
-        return os.listdir(logdir)
+        self.writer = None                          # LogWriter, created on first use
+        self.writerInitialized = False
+        self.transformer = None                     # StreamTransformer to notify of new qlog
+        self.numDisposed = 0                        # informational, for measuring load
 
 
     def _findHighestId(self):
-        """ Scan logs dir for files for the highest id.
+        """ Get the highest id from the queue index of the logs dir.
             0 if no file found.
         """
-        logdir = cfg.getpath('logs')
-        files = filter(self.log_pattern.match, self._listdir(logdir))
-        if not files:
-            return 0
-        files = [f.rjust(14) for f in files]
-        top = max(files)
-        return int(top.split('.')[0])
+        return queueindex.getIndex().getHighestId()
 
 
     def getId(self):
@@ -269,22 +300,53 @@ class MsgLogger(object):
         """ Dispose the log in one or more format below
             mlog - for debugging, save if the mlog config is set
             qlog - queuing for indexing, save if minfo.discard is not set
+
+            cachefp is discarded afterward, possibly in the writer thread.
         """
 
         mlogFlag = cfg.getboolean('messagelog.mlog', False)
-        if not minfo.discard or mlogFlag:
+        qlogFlag = not minfo.discard
+        if qlogFlag or mlogFlag:
             minfo.id = self.getId()
 
-        if not minfo.discard:
-            cachefp.write_qlog(minfo.id)
+        self.numDisposed += 1
 
-        if mlogFlag:
-            cachefp.write_mlog(minfo.id)
+        writer = self._getWriter()
+        if writer and (qlogFlag or mlogFlag):
+            writer.put(cachefp, minfo.id, qlogFlag, mlogFlag)
+        else:
+            logwriter.write(cachefp, minfo.id, qlogFlag, mlogFlag)
+            self._written(minfo.id, qlogFlag)
 
         elapsed = datetime.datetime.now() - starttime
         log.debug('%3d.%02ds %s' % (elapsed.seconds, elapsed.microseconds/10000, minfo.logmsg()))
 
 
+    def _getWriter(self):
+        if not self.writerInitialized:
+            self.currentIdLock.acquire()
+            try:
+                if not self.writerInitialized:
+                    self.writer = logwriter.makeWriter(self._written)
+                    self.writerInitialized = True
+            finally:
+                self.currentIdLock.release()
+        return self.writer
+
+
+    def _written(self, id, qlog):
+        """ Called when the log is saved, possibly from the writer thread """
+        if qlog and self.transformer:
+            self.transformer.put(id + '.qlog')
+
+
+    def close(self):
+        """ Finish writing queued logs """
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+
     @staticmethod
     def _getMsgLogPath(id):
         return cfg.getpath('logs')/(id+'.qlog')
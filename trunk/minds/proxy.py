@@ -7,10 +7,16 @@ import threading
 
 from minds.config import cfg
 import app_httpserver
+import cachefile
 import config
 import httpserver
+import index_maintenance
+import indexer_process
+import messagelog
 import proxyhandler
 import qmsg_processor
+import queueindex
+import streamtransform
 from minds.util import threadutil
 
 
@@ -35,9 +41,14 @@ proxy_httpd = None
 def proxyMain():
     port = cfg.getint('http.proxy_port')
     numThreads = cfg.getint('http.proxy_threads', 1)
+    mode = cfg.get('http.proxy_mode', 'thread')
     server_address = ('', port)
     global proxy_httpd
-    proxy_httpd = httpserver.PooledHTTPServer(server_address, proxyhandler.ProxyHandler, numThreads)
+    if mode == 'reactor':
+        import async_proxy
+        proxy_httpd = async_proxy.ProxyServer(server_address)
+    else:
+        proxy_httpd = httpserver.PooledHTTPServer(server_address, proxyhandler.ProxyHandler, numThreads)
     log.info('Proxy: %s', proxy_httpd.report_config())
     proxy_httpd.serve_forever()
 
@@ -78,6 +89,11 @@ def indexMain():
             interval *= 2
             interval = min(interval, MAX_INDEX_INTERVAL)
             log.info('Restart index thread in %s minutes' % interval)
+            continue
+        try:
+            index_maintenance.maintenanceTask()
+        except:
+            log.exception('Error in index maintenance')
 
 
 
@@ -144,10 +160,13 @@ def isShutdown():
 
 
 def main():
-    import PyLucene
-
     setup()
 
+    # fork the transform workers before any thread is started
+    qmsg_processor.startWorkerPool()
+
+    import PyLucene
+
     # log some system info
     platform = sys.platform
     if 'win32' in sys.platform: platform += str(sys.getwindowsversion())
@@ -167,6 +186,11 @@ def main():
     version = reader.getVersion()
     reader.close()
     log.info('  Index version %s', version)
+    index_maintenance.IndexLock(dbindex).clear()     # left by a process that has died
+    cachefile.removeTempFiles()                      # left by a process that has died
+
+    messagelog.mlog.transformer = streamtransform.makeTransformer()
+    qmsg_processor.indexer = indexer_process.makeIndexer()
 
     proxyThread = threading.Thread(target=proxyMain, name='proxy')
     #proxyThread.setDaemon(True)
@@ -190,6 +214,17 @@ def main():
     log.fatal('adminThread terminated.')
     proxyThread.join()
     log.fatal('proxyThread terminated.')
+    messagelog.mlog.close()
+    log.fatal('message log writer terminated.')
+    if messagelog.mlog.transformer:
+        messagelog.mlog.transformer.close()
+        log.fatal('stream transformer terminated.')
+    if qmsg_processor.indexer:
+        qmsg_processor.indexer.close()
+        log.fatal('indexer process terminated.')
+    qmsg_processor.stopWorkerPool()
+    queueindex.closeAll()
+    lucene_logic.closeAll()
     log.fatal('End of main thread.')
 
 
@@ -10,15 +10,19 @@ Based on the 'Tiny HTTP Proxy' by SUZUKI Hisao.
 import BaseHTTPServer, select, socket, urlparse
 import cStringIO
 import datetime
+import httplib
 import logging
 import os.path
 import sys
+import time
 
 from minds.config import cfg
 from minds import cachefile
 from minds import messagelog
 from minds.util import multiblockfile
 from minds.util import fileutil
+from minds.util import httputil
+from minds.util import relay
 from minds.weblib import mhtml
 
 # todo: ftp request
@@ -26,12 +30,24 @@ from minds.weblib import mhtml
 
 log = logging.getLogger('proxy')
 
+# only requests without message body are sent over pooled connection
+# so that it is safe to retry if the connection turns out to be stale
+REUSABLE_COMMANDS = ['GET', 'HEAD']
+
+# headers that apply to a single connection and are not forwarded [RFC2616 13.5.1]
+HOP_BY_HOP_HEADERS = ['connection', 'proxy-connection', 'keep-alive']
+
 
 class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
     rbufsize = 0                        # self.rfile Be unbuffered
     SELECT_TIMEOUT = 3
     MAX_IDLING = 20
+    IDLE_POLL = 0.5                     # check for waiting connections while idle
+
+    # support persistent connection with the client. Requests still
+    # default to close unless the client asks for keep-alive.
+    protocol_version = 'HTTP/1.1'
 
 
     def __init__(self, request, client_address, server):
@@ -44,6 +60,7 @@ class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         self.starttime = datetime.datetime.now()
         self.path = None
         self.server.setStatus(self)
+        self.requestCount = 0
 
 
     # See PooledHTTPServer.finish_request() for corresponding finish() method
@@ -53,7 +70,17 @@ class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
 
     def handle_one_request(self):
-        """ Create logfp to log message. Wrap rfile to wiretap it. """
+        """ Create logfp to log message. Wrap rfile to wiretap it.
+            With a persistent connection this is called for each request.
+        """
+
+        if self.requestCount and not self._waitNextRequest():
+            self.close_connection = 1
+            return
+        self.requestCount += 1
+        self.starttime = datetime.datetime.now()
+        self.path = None
+        self.command = None
 
         messagelog.mlog.lastRequest = datetime.datetime.now()
 
@@ -73,10 +100,49 @@ class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                 self.rfile = self.rfile0
         except:
             log.exception("Problem in handling request")
+            self.close_connection = 1
 
-        if hasattr(self, 'command'):                    # note: command only assigned in BaseHTTPRequestHandler.handle_one_request()
-            if self.command != 'CONNECT':
-                messagelog.mlog.dispose(self.minfo, self.logfp, self.starttime)
+        # note: command only assigned in BaseHTTPRequestHandler.handle_one_request()
+        if self.command and self.command != 'CONNECT':
+            messagelog.mlog.dispose(self.minfo, self.logfp, self.starttime)
+        else:
+            self.logfp.discard()
+
+
+    def _waitNextRequest(self):
+        """ Wait for the next request on a persistent connection.
+            Return False if the client has closed or stayed idle for too long.
+
+            The worker thread is held while waiting. An idle client gives
+            it up as soon as a new connection is queued for a worker, so
+            idle clients never keep others out of the thread pool.
+        """
+        timeout = cfg.getint('http.client_keep_alive_timeout', 5)
+        deadline = time.time() + timeout
+        while True:
+            wait = min(deadline - time.time(), self.IDLE_POLL)
+            if wait <= 0:
+                return False
+            try:
+                (ins, _, exs) = select.select([self.connection], [], [self.connection], wait)
+            except (select.error, socket.error):
+                return False
+            if ins or exs:
+                return bool(ins) and not exs
+            if self._hasWaitingConnection():
+                log.debug('Close idle client connection to serve a waiting one')
+                return False
+
+
+    def _hasWaitingConnection(self):
+        """ Return True if a new connection is waiting for a worker thread """
+        pool = getattr(self.server, 'pool', None)
+        return bool(pool) and not pool.queue.empty()
+
+
+    def send_error(self, code, message=None):
+        self.close_connection = 1
+        BaseHTTPServer.BaseHTTPRequestHandler.send_error(self, code, message)
 
 
 
@@ -85,6 +151,7 @@ class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         #print >>sys.stderr, mhtml.LoadedWebArchive.loadedObj,'##'
         resp = mhtml.LoadedWebArchive.fetch_uri(self.path)
         if resp:
+            self.close_connection = 1           # response is not delimited
             self._serve_HTTPResponse(resp)
             return
 
@@ -94,8 +161,17 @@ class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         # verify request
         (scm, netloc, path, params, query, fragment) = urlparse.urlparse( self.path, 'http')
 
+        # keep the client connection only if it is asked for. This is
+        # confirmed in _transfer_data() once the response is complete.
+        keep_alive = self._isClientKeepAlive()
+        self.close_connection = 1
+
         # proxy connection
         soc = None
+        self.upstream_netloc = ''
+        self.upstream_keep_alive = False
+        self.reuseUpstream = False
+        self.earlyDiscard = False
         try:
             try:
                 soc = self._send_request(netloc, self.path, path, params, query)
@@ -103,7 +179,9 @@ class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                     #already logged
                     #log.warn("Failed to connect to %s", netloc)
                     return
-                rspBuf, header_size, bytes_received = self._transfer_data(soc)
+                if keep_alive:
+                    keep_alive = self._forward_request_body(soc)
+                rspBuf, header_size, bytes_received = self._transfer_data(soc, keep_alive)
                 if header_size <= 0:
                     log.warn("No response from %s %s", netloc, path)
                     return
@@ -118,23 +196,83 @@ class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
         finally:
             try:
-                if soc: soc.close()
+                if soc:
+                    if self.reuseUpstream:
+                        self.server.connpool.put(self.upstream_netloc, soc)
+                    else:
+                        soc.close()
             except Exception, e:
                 log.exception('Unable to close outgoing socket')
             try:
-                self.connection.close()
+                if self.close_connection:
+                    self.connection.close()
             except Exception, e:
                 log.exception('Unable to close incoming socket')
 
         # interpret response
         self.minfo.parseRsp(rspBuf, bytes_received)
 
+        if self.earlyDiscard:
+            # content not recorded
+            self.minfo.discard = True
+            return
+
         if self.logfp.isOverflow():
             self.minfo.discard = True
             log.warn('logOverflow bytes received: %s', bytes_received)
             return
 
 
+    def _isClientKeepAlive(self):
+        """ Check if the client asks for a persistent connection. The
+            request body, if any, must be delimited by Content-Length.
+        """
+        if cfg.getint('http.client_keep_alive_timeout', 5) <= 0:
+            return False
+        if self._getRequestBodySize() < 0:
+            return False
+        # browsers send Proxy-Connection when talking to a proxy
+        value = '%s,%s' % (self.headers.get('connection',''), self.headers.get('proxy-connection',''))
+        tokens = [t.strip() for t in value.lower().split(',')]
+        if 'close' in tokens:
+            return False
+        if self.request_version >= 'HTTP/1.1':
+            return True
+        return 'keep-alive' in tokens
+
+
+    def _getRequestBodySize(self):
+        """ Return the size of request body or -1 if it is not delimited
+            by Content-Length (e.g. chunked or 100-continue is expected).
+        """
+        if self.headers.get('transfer-encoding') or self.headers.get('expect'):
+            return -1
+        clen = self.headers.get('content-length')
+        if clen is None:
+            return 0
+        try:
+            size = int(clen)
+        except ValueError:
+            return -1
+        if size < 0:
+            return -1
+        return size
+
+
+    def _forward_request_body(self, soc):
+        """ Relay exactly the request body to server. It is recorded via
+            self.rfile. Return False if the client closed prematurely.
+        """
+        size = self._getRequestBodySize()
+        while size > 0:
+            data = self.rfile.read(min(size, 16*1024))
+            if not data:
+                return False
+            soc.sendall(data)
+            size -= len(data)
+        return True
+
+
     def _serve_HTTPResponse(self, resp):
         self.wfile.write(self.protocol_version + " 200 OK\r\n")
         headers = ['%s: %s\r\n' % (n,v) for n,v in resp.getheaders()] # TODO: we got the unnecessary MIME HEADER HERE
@@ -149,40 +287,62 @@ class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         ''' Send request to remote server '''
 
         if self.server.next_proxy_netloc:                   # use next proxy?
-            reqmsg = ["%s %s %s\r\n" % (                    # first line is http request
-                self.command,
-                fullpath,
-                self.request_version)
-            ]
-            soc = self._connect_to( self.server.next_proxy_netloc)
+            uri = fullpath
+            netloc = self.server.next_proxy_netloc
         else:
-            reqmsg = ["%s %s %s\r\n" % (                    # first line is http request
-                self.command,
-                urlparse.urlunparse(('', '', path, params, query, '')),
-                self.request_version)
-            ]
-            soc = self._connect_to(netloc)
-
-        if not soc: return None
+            uri = urlparse.urlunparse(('', '', path, params, query, ''))
 
+        pool = self.server.connpool
+        keep_alive = bool(pool) and (self.command in REUSABLE_COMMANDS)
+        reqmsg = format_request(self.command, uri, self.request_version, self.headers, keep_alive)
 
-        # headers
-        self.headers['Connection'] = 'close'
-        del self.headers['Proxy-Connection']
-        for key, val in self.headers.items():
-            key = key.capitalize()                  # header name are case-insensitive [RFC2616 4.2]
-                                                    # however, Linksys admin seems to expect case sensitive header
-                                                    # this is a hack to make it work with Linksys
-                                                    # todo: should preserve whatever the browser sent
-            reqmsg.append("%s: %s\r\n" % (key,val))
+        soc = None
+        if keep_alive:
+            soc = pool.get(netloc)
+        if soc:
+            try:
+                stale = self._isStale(soc)
+                if not stale:
+                    soc.send(reqmsg)
+            except (select.error, socket.error), e:
+                # e.g. (104, 'Connection reset by peer')
+                log.debug('Pooled connection to %s failed: %s', netloc, e)
+                stale = True
+            if not stale:
+                self.upstream_netloc = netloc
+                self.upstream_keep_alive = True
+                return soc
+            # the server has closed the idle connection, send on a new one
+            soc.close()
+            soc = None
 
-        # end of header
-        reqmsg.append("\r\n")
+        t0 = time.time()
+        soc = self._connect_to(netloc)
+        if not soc: return None
+        if keep_alive:
+            pool.addConnectTime(time.time() - t0)
 
-        soc.send(''.join(reqmsg))
+        self.upstream_netloc = netloc
+        self.upstream_keep_alive = keep_alive
+        soc.send(reqmsg)
         return soc
 
 
+    def _isStale(self, soc):
+        """ Check a pooled connection without blocking before sending on it.
+            Return True if the server has closed it or sent something
+            unexpected. An idle connection should have nothing to read.
+        """
+        (ins, _, exs) = select.select([soc], [], [soc], 0)
+        if exs:
+            return True
+        if not ins:
+            return False
+        if soc.recv(1, socket.MSG_PEEK):
+            log.debug('Unexpected data on pooled connection')
+        return True
+
+
     def _connect_to(self, netloc):
         soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         i = netloc.find(':')
@@ -199,11 +359,15 @@ class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         return soc
 
 
-    def _transfer_data(self, soc):
+    def _transfer_data(self, soc, keep_alive=False):
         """ Transfers data across:
 
             browser  <-- self.connection -->  proxy  <-- soc -->  destination
 
+            keep_alive - the client connection is to be kept open. The
+                request is already sent and the client is not read
+                from since it may have pipelined the next request.
+
             Returns rspBuf, header_size, bytes_received (content)
         """
 
@@ -213,7 +377,10 @@ class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         rspSize = 0                     # total count of response data read
         bodyPos = 0                     # position of response message body, 0 means not yet read
 
-        proxy_pump = self._proxy_pump(self.connection, soc)
+        if keep_alive:
+            proxy_pump = self._proxy_pump(None, soc)
+        else:
+            proxy_pump = self._proxy_pump(self.connection, soc)
 
         # read until message body is found
         for cData, sData in proxy_pump:
@@ -240,44 +407,145 @@ class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         # But disconnect rfile from reqLogFp in anycase.
         self.rfile = self.rfile0
 
-        # write response header in a new block
-        fp = multiblockfile.MbWriter(self.logfp)
-        rspBuf.seek(0)
-        copyfileobj(rspBuf, fp, bodyPos)
-        fp.complete()
-
-        # write reposne body in a new block
-        maxresponse = cfg.getint('messagelog.maxresponse', 1024)    # max maxresponse size in kb
-        rspLogFp = multiblockfile.MbWriter(self.logfp)
-        rspLogFp = fileutil.BoundedFile(rspLogFp, maxresponse*1024)
-        rspBuf.seek(bodyPos)
-        copyfileobj(rspBuf, rspLogFp, rspSize-bodyPos)
+        # with a keep-alive connection the server would not close at
+        # the end of response. Find the end from the response framing.
+        framing = self._parseFraming(rspBuf, bodyPos)
+        if not framing or framing.isDelimitedByClose():
+            keep_alive = False
+
+        # relay the response header with our own connection header
+        header = rspBuf.getvalue()[:bodyPos]
+        if framing:
+            header = format_response_header(header, keep_alive)
+        self.wfile.write(header)
+
+        # no need to record the response if it is going to be discarded
+        # anyway. Just stream it through.
+        self.earlyDiscard = self._isEarlyDiscard(rspBuf, bodyPos)
+        if self.earlyDiscard:
+            rspLogFp = None
+        else:
+            # write response header in a new block
+            fp = multiblockfile.MbWriter(self.logfp)
+            rspBuf.seek(0)
+            copyfileobj(rspBuf, fp, bodyPos)
+            fp.complete()
+
+            # write reposne body in a new block
+            maxresponse = cfg.getint('messagelog.maxresponse', 1024)    # max maxresponse size in kb
+            rspLogFp = multiblockfile.MbWriter(self.logfp)
+            rspLogFp = fileutil.BoundedFile(rspLogFp, maxresponse*1024)
+
+        # only record and relay up to the end of this response
+        excess = False
+        data = rspBuf.getvalue()[bodyPos:rspSize]
+        if framing:
+            n = framing.feed(data)
+            excess = n < len(data)
+            data = data[:n]
+            rspSize = bodyPos + n
+        if rspLogFp:
+            rspLogFp.write(data)
+        self.wfile.write(data)
 
         # read the remaining message body (could be nothing)
-        for cData, sData in proxy_pump:
-            if cData:
-                pass
-            elif sData:
-                rspSize += len(sData)
-                rspLogFp.write(sData)
-
-        rspLogFp.complete()
+        if self.earlyDiscard and framing and not framing.chunked and not framing.done:
+            # nothing to record or parse
+            n = self._relay_body(soc, framing.remain)
+            rspSize += n
+            framing.skip(n)
+        elif not (framing and framing.done):
+            for cData, sData in proxy_pump:
+                if cData:
+                    pass
+                elif sData:
+                    if framing:
+                        n = framing.feed(sData)
+                        excess = n < len(sData)
+                        sData = sData[:n]
+                    rspSize += len(sData)
+                    if rspLogFp:
+                        rspLogFp.write(sData)
+                    self.wfile.write(sData)
+                    if framing and framing.done:
+                        break
+
+        self.reuseUpstream = self.upstream_keep_alive and bool(framing) and \
+            framing.done and framing.keep_alive and not excess
+        if keep_alive and framing.done:
+            self.close_connection = 0
+
+        if rspLogFp:
+            rspLogFp.complete()
 
         rspBuf.seek(0)
         return rspBuf, bodyPos, rspSize - bodyPos
 
 
 
+    def _relay_body(self, soc, size):
+        """ Relay size bytes of response body (-1 means until closed)
+            from server to client, kernel side if possible.
+        """
+        r = relay.Relay()
+        try:
+            n = r.copy(soc, self.connection, size, self.SELECT_TIMEOUT, self.MAX_IDLING)
+        finally:
+            r.close()
+        log.debug('Relayed %s bytes (%s) - %s', n, r, self.path)
+        return n
+
+
+    def _isEarlyDiscard(self, rspBuf, bodyPos):
+        """ Check the response header against the discard rules and the
+            domain filter. Content is always recorded when mlog is on.
+        """
+        if cfg.getboolean('messagelog.mlog', False):
+            return False
+        try:
+            self.minfo.parseRspHeader(cStringIO.StringIO(rspBuf.getvalue()[:bodyPos]))
+        except (httplib.HTTPException, ValueError), e:
+            # let parseRsp() report it
+            return False
+        return self.minfo.isDiscardedByHeader()
+
+
+    def _parseFraming(self, rspBuf, bodyPos):
+        """ Build a ResponseFraming from the response header in rspBuf.
+            None if it cannot be parsed.
+        """
+        try:
+            filesoc = fileutil.FileSocket(cStringIO.StringIO(rspBuf.getvalue()[:bodyPos]))
+            httpRsp = httplib.HTTPResponse(filesoc)
+            httpRsp.begin()
+        except (httplib.HTTPException, ValueError), e:
+            log.debug('Unable to parse response header: %s', e)
+            return None
+        if httpRsp.status < 200:
+            # interim response, the final response is yet to come
+            return None
+        headers = dict(httpRsp.getheaders())
+        return httputil.ResponseFraming(self.command, httpRsp.status, httpRsp.version, headers)
+
+
+
     def _proxy_pump(self, clientSoc, serverSoc):
         """ Generator to pump IO between client and server using select().
             generates (clientData, serverData);
             only one of clientData or serverData is not None
+
+            Client data is forwarded to the server. Server data is left
+            for the caller to forward. clientSoc can be None to only
+            read from the server.
         """
 
         # todo: would it be simplier if it only generate response data, rather than either request or response data?
         # must make sure all socket are flushed
 
-        iw = [clientSoc, serverSoc]
+        if clientSoc:
+            iw = [clientSoc, serverSoc]
+        else:
+            iw = [serverSoc]
         count = 0
         while count < self.MAX_IDLING:
             count += 1
@@ -297,11 +565,10 @@ class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                 count = 0
 
                 if i is serverSoc:
-                    clientSoc.send(data)
                     yield None, data
                 else:
                     # data from client
-                    serverSoc.send(data)
+                    serverSoc.sendall(data)
                     yield data, None
 
 
@@ -336,6 +603,7 @@ class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
         # rfile already recorded the request line. But we will discard it.
         self.rfile = self.rfile0
+        self.close_connection = 1
 
         soc = self._connect_to(self.path)
         if not soc:
@@ -352,12 +620,12 @@ class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                 self.wfile.write("Proxy-agent: %s\r\n" % self.version_string())
                 self.wfile.write("\r\n")
 
-                proxy_pump = self._proxy_pump(self.connection, soc)
-                clen = 0
-                for cData, sData in proxy_pump:
-                    if sData:
-                        clen += len(sData)
-                #log.debug('Tunnel ended clen %s for %s', clen, self.path)
+                r = relay.Relay()
+                try:
+                    sent, received = r.tunnel(self.connection, soc, self.SELECT_TIMEOUT, self.MAX_IDLING)
+                finally:
+                    r.close()
+                log.debug('Tunnel ended sent %s received %s (%s) - %s', sent, received, r, self.path)
 
             except socket.error, e:
                 # socket.error is common enough that we don't want to print the stack trace
@@ -382,6 +650,57 @@ class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         log.debug(format, *args)
 
 
+def format_request(command, uri, request_version, headers, keep_alive=False):
+    """ Format the request line and headers to be sent to the next hop.
+        Note that headers is altered.
+    """
+    reqmsg = ["%s %s %s\r\n" % (command, uri, request_version)]   # first line is http request
+
+    # headers
+    if keep_alive:
+        headers['Connection'] = 'keep-alive'
+    else:
+        headers['Connection'] = 'close'
+    del headers['Proxy-Connection']
+    for key, val in headers.items():
+        key = key.capitalize()                  # header name are case-insensitive [RFC2616 4.2]
+                                                # however, Linksys admin seems to expect case sensitive header
+                                                # this is a hack to make it work with Linksys
+                                                # todo: should preserve whatever the browser sent
+        reqmsg.append("%s: %s\r\n" % (key,val))
+
+    # end of header
+    reqmsg.append("\r\n")
+
+    return ''.join(reqmsg)
+
+
+
+def format_response_header(header, keep_alive):
+    """ Replace the hop-by-hop connection headers in the response header
+        from upstream with the one for the client connection.
+    """
+    lines = header.rstrip('\r\n').split('\r\n')
+    result = lines[:1]                          # status line
+    skip = False
+    for line in lines[1:]:
+        if line[:1] in ' \t':                    # continuation of the last header
+            if not skip:
+                result.append(line)
+            continue
+        name = line.split(':',1)[0].strip().lower()
+        skip = name in HOP_BY_HOP_HEADERS
+        if not skip:
+            result.append(line)
+    if keep_alive:
+        result.append('Connection: keep-alive')
+    else:
+        result.append('Connection: close')
+    result.append('\r\n')
+    return '\r\n'.join(result)
+
+
+
 def copyfileobj(fsrc, fdst, size):
     """ copy data of size from file-like object fsrc to file-like object fdst"""
     length=16*1024
@@ -404,8 +723,9 @@ from util.rspreader import RspReader
 
 
 class TestServer:
-    def __init__(self, next_proxy=''):
+    def __init__(self, next_proxy='', connpool=None):
         self.next_proxy_netloc = next_proxy
+        self.connpool = connpool
 
     def setStatus(self, obj):
         """ dummy method """
@@ -445,17 +765,40 @@ class ProxyHandlerFixture(ProxyHandler):
         self.connect_dest = netloc
         return self.server_soc
 
+    def _waitNextRequest(self):
+        """ select on FileSocket is not supported. End of c_in ends the connection. """
+        return True
+
+    def _isStale(self, soc):
+        """ select and MSG_PEEK on FileSocket is not supported """
+        pos = soc.fin.tell()
+        data = soc.fin.read(1)
+        soc.fin.seek(pos)
+        return not data
+
+    def _relay_body(self, soc, size):
+        """ FileSocket has no fileno() to select or splice """
+        n = 0
+        while size < 0 or n < size:
+            if size < 0:
+                data = soc.fin.read(8192)
+            else:
+                data = soc.fin.read(min(8192, size-n))
+            if not data: break
+            self.wfile.write(data)
+            n += len(data)
+        return n
+
     def _proxy_pump(self, clientSoc, serverSoc):
         """ Need to override _proxy_pump() since select on FileSocket is not supported """
-        while True:
+        while clientSoc:
             data = clientSoc.fin.read()
             if not data: break
             serverSoc.send(data)
             yield data, None
         while True:
-            data = serverSoc.fin.read()
+            data = serverSoc.fin.read(8192)
             if not data: break
-            clientSoc.send(data)
             yield None, data
 
 
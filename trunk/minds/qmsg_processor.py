@@ -10,17 +10,27 @@ The following commands are available in interactive mode:
 """
 
 import datetime
+import itertools
 import logging
-import re
+import os
 import sys
 import StringIO
+import threading
 import time
+import traceback
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None          # Python < 2.6, always transform in process
 
 from minds.config import cfg
 from minds import docarchive
 from minds import messagelog
 from minds import distillML
 from minds import distillparse
+from minds import index_maintenance
+from minds import queueindex
 from minds.util import httputil
 from minds.util import rspreader
 
@@ -36,51 +46,37 @@ def getQueueStatus():
 
     global totalIndexed, archive_date
     if totalIndexed < 0:
-        indexpath = cfg.getpath('archiveindex')
-        reader = lucene_logic.Reader(indexpath)
-        totalIndexed = reader.reader.numDocs()
-        # find out archive_date from the first 10 document
-        for i in range(1,min(11,totalIndexed)):
-            doc = reader.reader.document(i)
-            d = doc.get('date')
-            if d:
-                archive_date = d
-                break
-        reader.close()
-    logpath = cfg.getpath('logs')
-    numQueued = len(_getQueuedText(logpath)) + len(_getQueuedLogs(logpath))
+        manager = lucene_logic.getSearcherManager()
+        searcher = manager.acquire()
+        try:
+            reader = searcher.reader.reader
+            totalIndexed = reader.numDocs()
+            # find out archive_date from the first 10 document
+            for i in range(1,min(11,totalIndexed)):
+                doc = reader.document(i)
+                d = doc.get('date')
+                if d:
+                    archive_date = d
+                    break
+        finally:
+            manager.release(searcher)
+    numQueued = queueindex.getIndex().numQueued()
     return totalIndexed, archive_date, numQueued
 
 
 
-QLOG_PATTERN = re.compile('\d{9}\.qlog')
-QTXT_PATTERN = re.compile('\d{9}\.qtxt')
+QLOG_PATTERN = queueindex.QLOG_PATTERN
+QTXT_PATTERN = queueindex.QTXT_PATTERN
 
 def _getQueuedLogs(logpath):
-    """ Get the list of *.qlog. Sorted in ascending order """
-
-    try:
-        files = [p.name for p in logpath.listdir()]
-    except:
-        # assume baseDir does not exist
-        return []
-    qlogs = filter(QLOG_PATTERN.match, files)
-    qlogs.sort()
-    return qlogs
+    """ Get the list of *.qlog from the queue index. Sorted in ascending order """
+    return queueindex.getIndex(logpath).getQueuedLogs()
 
 
 
 def _getQueuedText(logpath):
-    """ Get the list of *.qtxt. Sorted in ascending order """
-
-    try:
-        files = [p.name for p in logpath.listdir()]
-    except:
-        # assume baseDir does not exist
-        return []
-    qtxts = filter(QTXT_PATTERN.match, files)
-    qtxts.sort()
-    return qtxts
+    """ Get the list of *.qtxt from the queue index. Sorted in ascending order """
+    return queueindex.getIndex(logpath).getQueuedText()
 
 
 
@@ -181,11 +177,10 @@ def backgroundIndexTask(forceIndex=False):
     II. Index phrase
 
         Add *.qtxt into index
-        Optimize
 
-        During optimize, block out searching.
-        (12/03/04 note: Due to GIL and PyLucene implementation, it
-        will actually block out every thing, including proxy.)
+        The index is optimized separately by index_maintenance.
+        (12/03/04 note: Due to GIL and PyLucene implementation, optimize
+        would block out every thing, including proxy.)
 
         Returns transformed, index, discarded
     """
@@ -199,14 +194,22 @@ def backgroundIndexTask(forceIndex=False):
     indexed = 0
     discarded_i = 0
 
-    qlogs = _getQueuedLogs(logpath)
-    if forceIndex or _shouldTransform(now, interval):
+    # with a StreamTransformer qlogs are transformed as they arrive
+    streaming = messagelog.mlog.transformer is not None
+
+    if not streaming and (forceIndex or _shouldTransform(now, interval)):
+        qlogs = _getQueuedLogs(logpath)
         transformed, discarded_t = TransformProcess().run(logpath, qlogs)
 
     qtxts = _getQueuedText(logpath)
-    if forceIndex or \
-        (_shouldTransform(now, interval) and _shouldIndex(now, logpath, qtxts)): # first check is if there is new activity
-        indexed, discarded_i = IndexProcess().run(logpath, qtxts)
+    if forceIndex:
+        shouldIndex = True
+    elif streaming:
+        shouldIndex = _shouldIndex(now, logpath, qtxts)
+    else:
+        shouldIndex = _shouldTransform(now, interval) and _shouldIndex(now, logpath, qtxts) # first check is if there is new activity
+    if shouldIndex:
+        indexed, discarded_i = makeIndexProcess().run(logpath, qtxts)
 
     return transformed, indexed, discarded_t + discarded_i
 
@@ -219,11 +222,17 @@ g_archive_interval = 1
 
 class TransformProcess(object):
 
-    def __init__(self, removeQlog=True, backupQlog=False):
+    def __init__(self, removeQlog=True, backupQlog=False, workers=None):
+        """ workers - number of worker processes. 0 or 1 means transform
+                in this process. Default to indexing.transform_workers.
+        """
         self.num_transformed = 0
         self.num_discarded = 0
         self.backupQlog = backupQlog        # todo: remove this switch in the future
         self.removeQlog = removeQlog
+        if workers is None:
+            workers = cfg.getint('indexing.transform_workers', 0)
+        self.workers = workers
 
 
     def run(self, logpath, qlogs):
@@ -234,48 +243,100 @@ class TransformProcess(object):
 
         log.info('Transforming %s documents starting from %s' % (len(qlogs), qlogs[0]))
 
-        # initialize configuration parameters
+        index = queueindex.getIndex(logpath)
+        self._readConfig()
+
+        jobs = []
+        for filename in qlogs:
+            inpath = logpath/filename
+            jobs.append((inpath, inpath.splitext()[0] + '.qtxt'))
+
+        pool = self._getPool(len(jobs))
+        if pool:
+            # results come back in the order of qlogs
+            config = _getWorkerConfig()
+            results = pool.imap(_transformWorker, [(inpath, outpath, config) for inpath, outpath in jobs])
+        else:
+            results = itertools.imap(self._transform, jobs)
+        for filename, (inpath, outpath), (transformed, error) in itertools.izip(qlogs, jobs, results):
+            if error:
+                log.warn(error)
+            self._postprocess(logpath, filename, inpath, outpath, transformed, index)
+
+        log.info('Transformed %s; Discarded %s', self.num_transformed, self.num_discarded)
+
+        return self.num_transformed, self.num_discarded
+
+
+
+    def transformOne(self, logpath, filename):
+        """ Transform a single qlog in this process. Return whether it is transformed. """
+        self._readConfig()
+        inpath = logpath/filename
+        outpath = inpath.splitext()[0] + '.qtxt'
+        transformed, error = self._transform((inpath, outpath))
+        self._postprocess(logpath, filename, inpath, outpath, transformed, queueindex.getIndex(logpath))
+        return transformed
+
+
+
+    def _readConfig(self):
+        """ initialize configuration parameters """
         global g_maxuri, g_archive_interval
         g_maxuri = cfg.getint('messagelog.maxuri',1024)
         g_archive_interval = cfg.getint('indexing.archive_interval',1)
 
-        for filename in qlogs:              # main loop
 
-            inpath = logpath/filename
-            outpath = inpath.splitext()[0] + '.qtxt'
 
-            transformed = False             # transform
-            try:
-                transformed = self.transformDoc(inpath, outpath)
-            except messagelog.ParseMessageLogError, e:
-                log.warn('Error %s: %s', str(e), filename)
-            except:
-                log.exception('Error transforming: %s', filename)
+    def _getPool(self, numJobs):
+        """ Return the worker pool or None to transform in this process """
+        if self.workers < 2 or numJobs < 2:
+            return None
+        if not workerPool and threading.activeCount() == 1:
+            # e.g. run from command line. The proxy starts it on startup.
+            startWorkerPool(self.workers)
+        return workerPool
 
-            # postprocess qlog
-            try:
-                if self.backupQlog:
-                    savepath = logpath/'tmp'/filename
-                    if savepath.exists(): savepath.remove()
-                    inpath.rename(savepath)
 
-                # whether it is successfully transformed or not, remove the
-                # input file to avoid build up. Hopefully the error message is
-                # informative enough for diagnosis.
-                elif self.removeQlog:
-                    inpath.remove()
 
-            except OSError:
-                log.exception('Error in postprocess of %s', inpath)
+    def _transform(self, job):
+        """ Transform in this process. Return transformed, error (already logged) """
+        inpath, outpath = job
+        try:
+            return self.transformDoc(inpath, outpath), None
+        except messagelog.ParseMessageLogError, e:
+            log.warn('Error %s: %s', str(e), inpath.name)
+        except:
+            log.exception('Error transforming: %s', inpath.name)
+        return False, None
 
-            if transformed:
-                self.num_transformed += 1
-            else:
-                self.num_discarded += 1
 
-        log.info('Transformed %s; Discarded %s', self.num_transformed, self.num_discarded)
 
-        return self.num_transformed, self.num_discarded
+    def _postprocess(self, logpath, filename, inpath, outpath, transformed, index):
+        """ Remove the qlog and update the counters """
+        try:
+            if self.backupQlog:
+                savepath = logpath/'tmp'/filename
+                if savepath.exists(): savepath.remove()
+                inpath.rename(savepath)
+
+            # whether it is successfully transformed or not, remove the
+            # input file to avoid build up. Hopefully the error message is
+            # informative enough for diagnosis.
+            elif self.removeQlog:
+                inpath.remove()
+
+        except OSError:
+            log.exception('Error in postprocess of %s', inpath)
+
+        if self.backupQlog or self.removeQlog:
+            index.remove(filename)
+
+        if transformed:
+            index.add(outpath.name)
+            self.num_transformed += 1
+        else:
+            self.num_discarded += 1
 
 
 
@@ -335,6 +396,67 @@ class TransformProcess(object):
 
 
 
+# pool of transform worker processes shared by TransformProcess
+workerPool = None
+
+def startWorkerPool(workers=None):
+    """ Start the pool of indexing.transform_workers processes. Call this
+        before any thread is started. A process forked while other threads
+        hold locks (e.g. of logging) may deadlock. Return the pool or None.
+    """
+    global workerPool
+    if workers is None:
+        workers = cfg.getint('indexing.transform_workers', 0)
+    if workerPool or workers < 2 or not multiprocessing:
+        return workerPool
+    try:
+        workerPool = multiprocessing.Pool(workers, _initWorker)
+    except (OSError, ImportError):
+        log.exception('Unable to start %s transform workers', workers)
+    return workerPool
+
+
+def stopWorkerPool():
+    global workerPool
+    if workerPool:
+        workerPool.close()
+        workerPool.join()
+        workerPool = None
+
+
+def _getWorkerConfig():
+    """ Return the configuration globals to be set in a worker process.
+        See TransformProcess._readConfig().
+    """
+    return {
+        'g_maxuri': g_maxuri,
+        'g_archive_interval': g_archive_interval,
+    }
+
+
+def _initWorker():
+    """ Initialize a transform worker process """
+    # yield to the proxy and the browser
+    if hasattr(os, 'nice'):
+        os.nice(10)
+
+
+
+def _transformWorker(job):
+    """ Transform a qlog in a worker process. Return transformed, error.
+        Errors are sent back to be logged in order.
+    """
+    inpath, outpath, config = job
+    globals().update(config)
+    try:
+        return TransformProcess(workers=0).transformDoc(inpath, outpath), None
+    except messagelog.ParseMessageLogError, e:
+        return False, 'Error %s: %s' % (str(e), inpath.name)
+    except:
+        return False, 'Error transforming: %s\n%s' % (inpath.name, traceback.format_exc())
+
+
+
 def _formatTimestamp(dt):
     """ format time stamp """
     return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -399,12 +521,27 @@ class IndexProcess(object):
         self.freshdocs = {}
         self.numIndexed = 0
         self.numDiscarded = 0
+        self.updateQueue = True     # remove indexed *.qtxt from queueindex
+        self.onProgress = None      # called with (indexed, discarded, total)
+
+
+    def _progress(self, total):
+        if self.onProgress:
+            self.onProgress(self.numIndexed, self.numDiscarded, total)
+
+
+    def _getQueue(self, logpath):
+        """ Return the QueueIndex to update or None """
+        if self.updateQueue:
+            return queueindex.getIndex(logpath)
+        return None
 
 
     def _open(self):
         from minds import lucene_logic
         indexpath = cfg.getpath('archiveindex')
         self.writer = lucene_logic.Writer(indexpath)
+        self.writer.writer.mergeFactor = cfg.getint('indexing.merge_factor', 50)   # leave merging to index_maintenance
         self.searcher = lucene_logic.Searcher(pathname=indexpath)
 
 
@@ -418,8 +555,21 @@ class IndexProcess(object):
         qtxts = filter(None, qtxts)         # defensively remove '' entries. Otherwise path would point to logpath for '' entry.
         if not qtxts: return 0, 0
 
+        # do not write while index_maintenance is optimizing
+        lock = index_maintenance.IndexLock(cfg.getpath('archiveindex'))
+        if not lock.acquire():
+            log.info('Index is locked. Index %s documents later.', len(qtxts))
+            return 0, 0
+        try:
+            return self._run(logpath, qtxts)
+        finally:
+            lock.release()
+
+
+    def _run(self, logpath, qtxts):
         log.info('Indexing %s documents starting from %s' % (len(qtxts), qtxts[0]))
 
+        index = self._getQueue(logpath)
         self._open()
         self.arcHandler = docarchive.ArchiveHandler('w')
         try:
@@ -438,10 +588,13 @@ class IndexProcess(object):
                     filepath.remove()   # remove whether it is success or not
                 except:
                     log.exception('Error removing %s', filepath)
+                if index:
+                    index.remove(filename)
+                self._progress(len(qtxts))
 
         finally:
             try:
-                log.info('Optimize and close index')
+                log.info('Close index')
                 self._finish()
             except: # do not throw error in finally clause
                 log.exception('Error trying to close index state')
@@ -509,6 +662,212 @@ class IndexProcess(object):
 
 
 
+class BulkIndexProcess(IndexProcess):
+    """ Index a batch of *.qtxt in phases rather than one document at a
+        time. Parse all of them first. Look up the archived versions of
+        their uri in one pass over the index and resolve duplicates in
+        memory. Then write the archive in id order, so that each zip file
+        is opened once, and feed the index writer tuned for bulk loading.
+    """
+
+    def __init__(self, mergeFactor=None, minMergeDocs=None):
+        """ mergeFactor, minMergeDocs - IndexWriter parameters. Default to
+                indexing.bulk_merge_factor and indexing.bulk_min_merge_docs
+        """
+        IndexProcess.__init__(self)
+        if mergeFactor is None:
+            mergeFactor = cfg.getint('indexing.bulk_merge_factor', 20)
+        if minMergeDocs is None:
+            minMergeDocs = cfg.getint('indexing.bulk_min_merge_docs', 100)
+        self.mergeFactor = mergeFactor
+        self.minMergeDocs = minMergeDocs
+        self.timing = []                # list of (phase, seconds)
+
+
+    def _open(self):
+        from minds import lucene_logic
+        self.writer = lucene_logic.Writer(cfg.getpath('archiveindex'))
+        self.writer.writer.mergeFactor = self.mergeFactor
+        self.writer.writer.minMergeDocs = self.minMergeDocs     # documents buffered in RAM
+
+
+    def _run(self, logpath, qtxts):
+        log.info('Bulk indexing %s documents starting from %s' % (len(qtxts), qtxts[0]))
+
+        index = self._getQueue(logpath)
+        t0 = time.time()
+        self.done = []                  # qtxts indexed or discarded, to be removed
+        self._open()                    # fail before anything is archived if the index is locked
+        try:
+            docs = self._parseAll(logpath, qtxts)
+            self._lap('parse', t0)
+
+            self._loadArchived([meta['uri'] for filename, data, meta, content in docs])
+            docs = self._dedup(docs)
+            self._lap('dedup', t0)
+            self._progress(len(qtxts))
+
+            self.arcHandler = docarchive.ArchiveHandler('w')
+            docs = self._archiveAll(docs)
+            self.arcHandler.close()
+            self._lap('archive', t0)
+
+            self._indexAll(docs)
+            self._lap('index', t0)
+            self._progress(len(qtxts))
+
+        finally:
+            try:
+                log.info('Close index')
+                self._finish()
+            except: # do not throw error in finally clause
+                log.exception('Error trying to close index state')
+            self._lap('close', t0)
+
+            # if a phase has failed the rest are left in the queue
+            for filename in self.done:
+                filepath = logpath/filename
+                try:
+                    if filepath.exists():
+                        filepath.remove()
+                except:
+                    log.exception('Error removing %s', filepath)
+                if index:
+                    index.remove(filename)
+
+        if self.writer:
+            global totalIndexed
+            totalIndexed = self.writer.writer.docCount()    # already closed???
+
+        elapsed = time.time() - t0
+        log.info('indexed #%s discarded #%s in %.1fs %.1f docs/s (%s)',
+            self.numIndexed,
+            self.numDiscarded,
+            elapsed,
+            len(qtxts) / max(elapsed, 0.001),
+            ' '.join(['%s=%.2fs' % t for t in self.timing]),
+            )
+        return self.numIndexed, self.numDiscarded
+
+
+    def _lap(self, phase, t0):
+        """ Record the time spent in phase """
+        elapsed = time.time() - t0 - sum([t for p, t in self.timing])
+        self.timing.append((phase, elapsed))
+        log.debug('%s %.2fs', phase, elapsed)
+
+
+    def _parseAll(self, logpath, qtxts):
+        """ Return list of (filename, data, meta, content) """
+        docs = []
+        for filename in qtxts:
+            filepath = logpath/filename
+            try:
+                fp = filepath.open('rb')
+                try:
+                    data = fp.read()
+                finally:
+                    fp.close()
+                meta, content = distillparse.parseDistillML(StringIO.StringIO(data), distillparse.writeHeader)
+                meta['uri']                                 # if there is no uri, throw an exception and discard this doc
+            except:
+                self.numDiscarded += 1
+                self.done.append(filename)
+                log.exception('Failed in indexDoc: %s', filepath)
+                continue
+            docs.append((filename, data, meta, content))
+        return docs
+
+
+    def _loadArchived(self, uris):
+        """ Load the latest archived version of each uri into freshdocs """
+        from minds import lucene_logic
+        import PyLucene
+        reader = lucene_logic.Reader(pathname=cfg.getpath('archiveindex'))
+        try:
+            for uri in dict.fromkeys(uris):
+                termDocs = reader.termDocs(PyLucene.Term('uri', uri))
+                try:
+                    meta0 = None
+                    while termDocs.next():
+                        doc = reader.document(termDocs.doc())
+                        date = doc.get('date')
+                        if meta0 is None or date > meta0['date']:
+                            meta0 = {
+                                'uri': doc.get('uri'),
+                                'date': date,
+                                'etag': doc.get('etag'),
+                            }
+                finally:
+                    termDocs.close()
+                if meta0:
+                    self.freshdocs[uri] = meta0
+        finally:
+            reader.close()
+
+
+    def _dedup(self, docs):
+        """ Drop documents similar to the archived or earlier version """
+        result = []
+        for filename, data, meta, content in docs:
+            uri = meta['uri']
+            meta0 = self.freshdocs.get(uri)
+            if meta0:
+                similar = isSimilar(meta0, meta)
+                if similar:
+                    self.numDiscarded += 1
+                    self.done.append(filename)
+                    log.info('discard %s archived(%s) - %s' % (filename, similar, uri))
+                    continue
+            self.freshdocs[uri] = meta
+            result.append((filename, data, meta, content))
+        return result
+
+
+    def _archiveAll(self, docs):
+        """ Add docs to the archive. Return list of (filename, id, meta, content) """
+        result = []
+        for filename, data, meta, content in docs:
+            try:
+                id = docarchive.idCounter.getNewId()
+                self.arcHandler.add_document(id, StringIO.StringIO(data))
+            except:
+                self.numDiscarded += 1
+                self.done.append(filename)
+                log.exception('Failed in indexDoc: %s', filename)
+                continue
+            result.append((filename, id, meta, content))
+            log.info('%s -> %s' % (filename, id))
+        return result
+
+
+    def _indexAll(self, docs):
+        for filename, id, meta, content in docs:
+            try:
+                self.writer.addDocument(id, meta, content)
+                self.numIndexed += 1
+            except:
+                self.numDiscarded += 1
+                log.exception('Failed in indexDoc: %s', id)
+            self.done.append(filename)
+
+
+
+# IndexerClient of the indexer subprocess, if it is enabled
+indexer = None
+
+def makeIndexProcess():
+    """ Return the indexer subprocess if there is one. Otherwise return
+        BulkIndexProcess if indexing.bulk_index is set, or IndexProcess.
+    """
+    if indexer:
+        return indexer
+    if cfg.getboolean('indexing.bulk_index', False):
+        return BulkIndexProcess()
+    return IndexProcess()
+
+
+
 def isSimilar(meta0, meta1):
     """ Search index for similar versions of the document. This is used
     to prevent repeatly archiving similar version of the same URI. The
@@ -589,7 +948,7 @@ def main(argv):
     elif option == '-i':
         logpath  = cfg.getpath('logs')
         qtxts = _getQueuedText(logpath)
-        indexed, discarded = IndexProcess().run(logpath, qtxts)
+        indexed, discarded = makeIndexProcess().run(logpath, qtxts)
         print indexed, discarded
 
     elif option == '-b':
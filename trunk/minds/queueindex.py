@@ -0,0 +1,298 @@
+"""Index of the queued logs in the logs directory
+
+The proxy and qmsg_processor used to list the logs directory to find
+the highest id and the pending *.qlog and *.qtxt on every background
+tick and every /history page. The directory can hold thousands of
+files. QueueIndex keeps the pending files in memory and records each
+change in a journal file (queue.jnl) so that it can be reloaded at
+startup. The directory is only scanned when there is no journal or when
+it was not closed cleanly, i.e. after a crash.
+
+Journal format, one record per line
+
+    + filename      file added
+    - filename      file removed
+    highest n       highest id seen
+    closed          written on clean close
+"""
+
+import logging
+import os
+import re
+import threading
+
+from minds.config import cfg
+
+log = logging.getLogger('queueidx')
+
+JOURNAL = 'queue.jnl'
+
+QLOG_PATTERN = re.compile('\d{9}\.qlog')
+QTXT_PATTERN = re.compile('\d{9}\.qtxt')
+ID_PATTERN   = re.compile('\d{1,9}\.(qlog|mlog|qtxt)$')
+
+COMPACT_MIN = 1000      # compact journal when it has this many stale records
+
+
+class QueueIndex(object):
+    """ The set of *.qlog and *.qtxt in a directory and the highest id
+        used. Loaded on first use. Thread safe.
+    """
+
+    def __init__(self, logpath):
+        self.logpath = logpath
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.qlogs = {}
+        self.qtxts = {}
+        self.highestId = 0
+        self.journal = None
+        self.records = 0                # records in journal
+
+
+    def _listdir(self):
+        return os.listdir(self.logpath)
+
+
+    def _load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        jpath = self.logpath/JOURNAL
+        if jpath.exists() and self._replay(jpath):
+            log.info('Loaded queue journal: %s qlog %s qtxt highest=%s',
+                len(self.qlogs), len(self.qtxts), self.highestId)
+        else:
+            self._scan()
+        self._compact()
+
+
+    def _replay(self, jpath):
+        """ Replay the journal. Return False if it was not closed cleanly. """
+        closed = False
+        fp = jpath.open('rb')
+        try:
+            for line in fp:
+                line = line.strip()
+                if not line:
+                    continue
+                closed = False
+                if line == 'closed':
+                    closed = True
+                elif line.startswith('+ '):
+                    self._add(line[2:])
+                elif line.startswith('- '):
+                    self._remove(line[2:])
+                elif line.startswith('highest '):
+                    try:
+                        self.highestId = max(self.highestId, int(line[8:]))
+                    except ValueError:
+                        pass
+        finally:
+            fp.close()
+        if not closed:
+            log.warn('Queue journal not closed cleanly, rescan %s', self.logpath)
+            # still remember the highest id in case the files are already processed
+            highest = self.highestId
+            self.qlogs = {}
+            self.qtxts = {}
+            self.highestId = highest
+        return closed
+
+
+    def _scan(self):
+        """ Rebuild from the directory """
+        try:
+            files = self._listdir()
+        except OSError:
+            # assume logpath does not exist
+            files = []
+        for filename in files:
+            self._add(filename)
+        log.info('Scanned %s: %s qlog %s qtxt highest=%s', self.logpath,
+            len(self.qlogs), len(self.qtxts), self.highestId)
+
+
+    def _add(self, filename):
+        """ Update the in-memory state. Return whether filename is relevant. """
+        if not ID_PATTERN.match(filename):
+            return False
+        id = int(filename.split('.')[0])
+        if id > self.highestId:
+            self.highestId = id
+        if QLOG_PATTERN.match(filename):
+            self.qlogs[filename] = True
+        elif QTXT_PATTERN.match(filename):
+            self.qtxts[filename] = True
+        return True
+
+
+    def _remove(self, filename):
+        """ Update the in-memory state. Return whether filename was queued. """
+        if filename in self.qlogs:
+            del self.qlogs[filename]
+            return True
+        if filename in self.qtxts:
+            del self.qtxts[filename]
+            return True
+        return False
+
+
+    def _write(self, record):
+        if self.records > 2 * (len(self.qlogs) + len(self.qtxts)) + COMPACT_MIN:
+            self._compact()
+        if not self.journal:
+            self.journal = (self.logpath/JOURNAL).open('ab')
+        self.journal.write(record + '\n')
+        self.journal.flush()
+        self.records += 1
+
+
+    def _compact(self):
+        """ Rewrite the journal with only the current state """
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+        jpath = self.logpath/JOURNAL
+        tmppath = jpath + '.tmp'
+        records = ['highest %s' % self.highestId]
+        records.extend(['+ %s' % f for f in sorted(self.qlogs.keys())])
+        records.extend(['+ %s' % f for f in sorted(self.qtxts.keys())])
+        try:
+            fp = tmppath.open('wb')
+            try:
+                fp.write('\n'.join(records) + '\n')
+            finally:
+                fp.close()
+            if jpath.exists():
+                jpath.remove()
+            tmppath.rename(jpath)
+        except (IOError, OSError):
+            log.exception('Unable to write queue journal %s', jpath)
+            return
+        self.records = len(records)
+
+
+    def add(self, filename):
+        """ Record a new file saved in the logs directory """
+        self.lock.acquire()
+        try:
+            self._load()
+            if self._add(filename):
+                self._write('+ %s' % filename)
+        finally:
+            self.lock.release()
+
+
+    def remove(self, filename):
+        """ Record a file removed from the logs directory """
+        self.lock.acquire()
+        try:
+            self._load()
+            if self._remove(filename):
+                self._write('- %s' % filename)
+        finally:
+            self.lock.release()
+
+
+    def getQueuedLogs(self):
+        """ Get the list of *.qlog. Sorted in ascending order """
+        self.lock.acquire()
+        try:
+            self._load()
+            return sorted(self.qlogs.keys())
+        finally:
+            self.lock.release()
+
+
+    def getQueuedText(self):
+        """ Get the list of *.qtxt. Sorted in ascending order """
+        self.lock.acquire()
+        try:
+            self._load()
+            return sorted(self.qtxts.keys())
+        finally:
+            self.lock.release()
+
+
+    def numQueued(self):
+        self.lock.acquire()
+        try:
+            self._load()
+            return len(self.qlogs) + len(self.qtxts)
+        finally:
+            self.lock.release()
+
+
+    def getHighestId(self):
+        """ Highest id of *.qlog, *.mlog and *.qtxt seen. 0 if none. """
+        self.lock.acquire()
+        try:
+            self._load()
+            return self.highestId
+        finally:
+            self.lock.release()
+
+
+    def rescan(self):
+        """ Discard the index and rebuild it from the directory. Use this
+            after files are added or removed by other means.
+        """
+        self.lock.acquire()
+        try:
+            self.loaded = True
+            self.qlogs = {}
+            self.qtxts = {}
+            self.highestId = 0
+            self._scan()
+            self._compact()
+        finally:
+            self.lock.release()
+
+
+    def close(self):
+        """ Mark the journal as closed cleanly """
+        self.lock.acquire()
+        try:
+            if not self.loaded:
+                return
+            self._write('closed')
+            self.journal.close()
+            self.journal = None
+            self.loaded = False
+            self.qlogs = {}
+            self.qtxts = {}
+            self.highestId = 0
+        finally:
+            self.lock.release()
+
+
+
+_indexes = {}
+_indexesLock = threading.Lock()
+
+def getIndex(logpath=None):
+    """ Return the QueueIndex of logpath. Default to the logs directory. """
+    if logpath is None:
+        logpath = cfg.getpath('logs')
+    _indexesLock.acquire()
+    try:
+        index = _indexes.get(logpath)
+        if not index:
+            index = _indexes[logpath] = QueueIndex(logpath)
+        return index
+    finally:
+        _indexesLock.release()
+
+
+def closeAll():
+    _indexesLock.acquire()
+    try:
+        indexes = _indexes.values()
+    finally:
+        _indexesLock.release()
+    for index in indexes:
+        try:
+            index.close()
+        except:
+            log.exception('Unable to close queue index %s', index.logpath)
@@ -1,22 +1,29 @@
 """
 """
 import logging
+import random
 import StringIO
 import sys
+import time
 
 from PyLucene import QueryParser, StandardAnalyzer
 from PyLucene import Highlighter, QueryScorer, SimpleFragmenter, SimpleHTMLFormatter
+try:
+    from PyLucene import TokenSources
+except ImportError:
+    TokenSources = None
 
 from minds.config import cfg
 from minds import docarchive
 from minds import distillparse
 from minds import lucene_logic
+from minds.util.lrucache import LRUCache
 
 log = logging.getLogger('search')
 
 
 class MatchItem:
-    def __init__(self, hits, key):
+    def __init__(self, hits, key, searcher):
 
         # lucene data
         self.index      = key   # hits index
@@ -32,14 +39,12 @@ class MatchItem:
         self.title      = ''
         self.description= ''
 
-        self.load(hits, key)
+        self.load(hits, key, searcher)
 
 
-    def load(self, hits, key):
-        self.id         = hits[key][1]
-        self.doc        = hits[key][2]
-        self.score      = hits[key][0]
-        self.score0     = hits[key][3]
+    def load(self, hits, key, searcher):
+        self.score, self.id, self.score0 = hits[key]
+        self.doc        = searcher.doc(self.id)
 
         self.docid      = self.doc.get('docid'      )
         self.date       = self.doc.get('date'       )
@@ -48,16 +53,30 @@ class MatchItem:
         # title & description are filled at hightlight()
 
 
-    def highlight(self, analyzer, highlighter):
+    def highlight(self, analyzer, highlighter, reader=None):
+        """ reader - if given, use the term vector of the document stored
+                at index time instead of tokenizing the content again.
+        """
         maxNumFragmentsRequired = 2
         try:
-            fp = docarchive.get_document(self.docid)
+            meta, text, headerLen = getDocumentText(self.docid)
         except Exception, e:
             # maybe the index is outdate to refer to some non-exist file
             log.exception('Unable to get "%s"' % self.docid)
         else:
-            meta, content = distillparse.parseDistillML(fp)
-            tokenStream = analyzer.tokenStream('content', StringIO.StringIO(content))
+            tokenStream = None
+            if reader is not None and TokenSources:
+                try:
+                    # the offsets are relative to the indexed text,
+                    # which begins with the header
+                    tokenStream = TokenSources.getTokenStream(reader, self.id, 'content')
+                    content = text
+                except Exception, e:
+                    # indexed without term vector
+                    tokenStream = None
+            if tokenStream is None:
+                content = text[headerLen:]
+                tokenStream = analyzer.tokenStream('content', StringIO.StringIO(content))
             self.description = highlighter.getBestFragments(tokenStream, content, maxNumFragmentsRequired, "...")
             self.title = meta.get('title','')
 
@@ -72,16 +91,40 @@ def parseQuery(phrase):
     return query
 
 
+# Parsed text of recently shown documents. Archived documents never
+# change, so the docid is the key.
+_textCache = LRUCache(cfg.getint('search.snippet_cache', 200))
+
+def getDocumentText(docid):
+    """ Return meta, text, headerLen of the archived document. text is
+        the content as it is indexed, i.e. prefixed by distillparse.writeHeader.
+        text[headerLen:] is the content.
+    """
+    result = _textCache.get(docid)
+    if result is None:
+        fp = docarchive.get_document(docid)
+        meta, text = distillparse.parseDistillML(fp, distillparse.writeHeader)
+        header = StringIO.StringIO()
+        distillparse.writeHeader(header, meta)
+        result = meta, text, len(header.getvalue())
+        _textCache.put(docid, result)
+    return result
+
+
+
 MAXRESULT = 1000
 
 def sortHits(hits, maxDoc):
-    """ Return list of (adj score, id, doc, original score) """
+    """ Return list of (adj score, id, original score).
+        The stored fields are not loaded. Use searcher.doc(id) for the
+        items to be shown.
+    """
     hitList = []
-    for i in xrange(min(1000,hits.length())):
+    for i in xrange(min(MAXRESULT,hits.length())):
         id = hits.id(i)
         score = hits.score(i)
         date_adjusted = score / (maxDoc - id)
-        hitList.append((date_adjusted, id, hits.doc(i), score))
+        hitList.append((date_adjusted, id, score))
 
     if not hitList:
         return []
@@ -90,43 +133,82 @@ def sortHits(hits, maxDoc):
 
     # normalize score
     high_score = hitList[0][0]
-    hitList = [(s/high_score, id, doc, score0) for s,id,doc,score0 in hitList]
+    hitList = [(s/high_score, id, score0) for s,id,score0 in hitList]
 
     return hitList
 
 
 
+# Sorted hit lists of recent queries, so that paging through the result
+# does not run the search again. The key includes the index generation.
+# The cache is cleared when the indexer has committed a new generation.
+_hitCache = LRUCache(cfg.getint('search.result_cache', 20))
+_hitCacheGeneration = None
+
+def getHitList(searcher, query):
+    """ Return the number of hits and the sorted list of
+        (adj score, id, original score) of the rewritten query.
+    """
+    global _hitCacheGeneration
+    generation = getattr(searcher, 'generation', None)
+    if generation is None:
+        # not opened by SearcherManager, no way to tell if it is current
+        hits = searcher.search(query)
+        return hits.length(), sortHits(hits, searcher.reader.maxDoc()+2000)
+
+    if generation != _hitCacheGeneration:
+        _hitCache.clear()
+        _hitCacheGeneration = generation
+
+    key = (query.toString(), generation)
+    result = _hitCache.get(key)
+    if result is None:
+        hits = searcher.search(query)
+        result = hits.length(), sortHits(hits, searcher.reader.maxDoc()+2000)
+        _hitCache.put(key, result)
+    return result
+
+
+
 def search(query, start, end):
 
     # search
-    indexpath = cfg.getpath('archiveindex')
-    searcher = lucene_logic.Searcher(pathname=indexpath)
-    query = query.rewrite(searcher.reader.reader)
-    hits = searcher.search(query)
+    manager = lucene_logic.getSearcherManager()
+    searcher = manager.acquire()
+    try:
+        return _search(searcher, query, start, end)
+    finally:
+        manager.release(searcher)
+
 
-    hitList = sortHits(hits, searcher.reader.maxDoc()+2000)
+def _search(searcher, query, start, end):
+
+    query = query.rewrite(searcher.reader.reader)
+    length, hitList = getHitList(searcher, query)
 
     # prepare for highlighter
     formatter = SimpleHTMLFormatter("<span class='highlight'>", "</span>")
     highlighter = Highlighter( formatter, QueryScorer(query))
     highlighter.setTextFragmenter(SimpleFragmenter(50))
     analyzer = StandardAnalyzer()
+    reader = None
+    if cfg.getboolean('indexing.term_vectors', False):
+        reader = searcher.reader.reader
 
     # build a MatchItem list
     result = []
     for i in xrange(start,end):
-        if i >= hits.length():
+        if i >= len(hitList):
             break
-        item = MatchItem(hitList, i)
+        item = MatchItem(hitList, i, searcher)
         try:
-            item.highlight(analyzer, highlighter)
+            item.highlight(analyzer, highlighter, reader)
         except Exception, e:
             log.exception('Error highlighting %s' % item);
         #item.explaination = str(searcher.explain(query, item.id))
         result.append(item)
 
-    searcher.close()
-    return hits.length(), result
+    return length, result
 
 
 
@@ -169,8 +251,67 @@ def run_search(querystring, start):
     print "\nFrom %s of %s documents found." % (start, length)
 
 
+def _sortHitsLoadDocs(hits, maxDoc):
+    """ The old sortHits that loads the Document of every hit """
+    hitList = []
+    for i in xrange(min(MAXRESULT,hits.length())):
+        id = hits.id(i)
+        score = hits.score(i)
+        hitList.append((score / (maxDoc - id), id, hits.doc(i), score))
+    hitList.sort(reverse=True)
+    return hitList
+
+
+def benchmark(n, repeat=3):
+    """ Compare sortHits() with loading the Document of every hit on a
+        RAM index of n generated documents.
+    """
+    words = ['w%s' % i for i in range(1000)]
+    rand = random.Random(0)
+    writer = lucene_logic.Writer()
+    directory = writer.directory
+    t0 = time.time()
+    try:
+        for i in xrange(n):
+            content = u' '.join(rand.sample(words, 50))
+            meta = {'uri': u'http://host%s/page%s' % (i % 97, i), 'date': u'2006-01-01T00:00:00Z'}
+            writer.addDocument(u'%09d' % i, meta, u'common ' + content)
+        writer.optimize()
+    finally:
+        writer.close()
+    print 'Indexed %s documents in %.1fs' % (n, time.time() - t0)
+
+    searcher = lucene_logic.Searcher(directory=directory)
+    try:
+        maxDoc = searcher.reader.maxDoc()+2000
+        for querystring in ['common', 'w1', 'w1 AND w2']:
+            query = parseQuery(querystring)
+            print '\nQuery: %s  hits: %s' % (querystring, searcher.search(query).length())
+            for name, sort in [('all docs', _sortHitsLoadDocs),
+                               ('lazy',     sortHits),
+                              ]:
+                best = None
+                for r in range(repeat):
+                    t0 = time.time()
+                    hits = searcher.search(query)
+                    hitList = sort(hits, maxDoc)
+                    # render the first page
+                    for item in hitList[:10]:
+                        searcher.doc(item[1]).get('uri')
+                    elapsed = time.time() - t0
+                    if best is None or elapsed < best:
+                        best = elapsed
+                print '%-10s %.3fs' % (name, best)
+    finally:
+        searcher.close()
+
+
 def main(argv):
 
+    if len(argv) > 2 and argv[1] == '-b':
+        benchmark(int(argv[2]))
+        return
+
     lastQuery = ''
     lastStart = 0
 
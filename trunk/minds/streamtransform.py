@@ -0,0 +1,141 @@
+"""Transform qlogs as soon as they are written
+
+backgroundIndexTask only transforms when the proxy has been idle for
+indexing.interval minutes. On a busy proxy the *.qlog can pile up
+without bound. StreamTransformer is a low priority thread fed by
+MsgLogger as each qlog is saved. Instead of waiting for an idle period
+it slows down in proportion to the recent request rate of the proxy, up
+to stream_max_delay per document, so that the queue keeps moving.
+"""
+
+import datetime
+import logging
+import Queue
+import threading
+import time
+
+from minds.config import cfg
+from minds import messagelog
+from minds import qmsg_processor
+from minds import queueindex
+
+log = logging.getLogger('streamtf')
+
+
+class StreamTransformer(threading.Thread):
+
+    terminateTask = object()    # sentinel object
+
+    def __init__(self, logpath, delay_per_request=0.2, max_delay=5.0):
+        """ delay_per_request - seconds to wait before each transform for
+                every request per second the proxy is serving
+            max_delay - longest wait between transforms
+        """
+        threading.Thread.__init__(self, name='streamtf')
+        self.setDaemon(True)
+        self.logpath = logpath
+        self.delay_per_request = delay_per_request
+        self.max_delay = max_delay
+        self.queue = Queue.Queue()
+        self.stopEvent = threading.Event()
+        self.process = qmsg_processor.TransformProcess(workers=0)
+
+        # for measuring proxy load
+        self.lastCount = 0
+        self.lastTime = time.time()
+
+        # statistics
+        self.latency = 0.0          # total time from put() until transformed
+        self.maxLatency = 0.0
+        self.delayed = 0.0          # total time spent in throttling
+        self.starttime = datetime.datetime.now()
+
+
+    def put(self, filename):
+        """ Queue a qlog saved in logpath """
+        self.queue.put((filename, time.time()))
+
+
+    def run(self):
+        # pick up the backlog from last time
+        for filename in queueindex.getIndex(self.logpath).getQueuedLogs():
+            self.put(filename)
+
+        while True:
+            item = self.queue.get()
+            if item is self.terminateTask:
+                return
+            self._throttle()
+            if self.stopEvent.isSet():
+                return
+            filename, queued = item
+            if not (self.logpath/filename).exists():
+                continue            # already transformed by other means
+            try:
+                self.process.transformOne(self.logpath, filename)
+            except:
+                log.exception('Unable to transform %s', filename)
+            latency = time.time() - queued
+            self.latency += latency
+            self.maxLatency = max(self.maxLatency, latency)
+
+
+    def _getDelay(self):
+        """ Delay according to the requests per second seen since last call """
+        now = time.time()
+        count = messagelog.mlog.numDisposed
+        elapsed = now - self.lastTime
+        requests = count - self.lastCount
+        self.lastCount = count
+        self.lastTime = now
+        if elapsed <= 0 or requests <= 0:
+            return 0.0
+        return min(self.max_delay, requests / elapsed * self.delay_per_request)
+
+
+    def _throttle(self):
+        delay = self._getDelay()
+        if delay > 0:
+            self.delayed += delay
+            self.stopEvent.wait(delay)
+
+
+    def close(self, timeout=None):
+        """ Stop the thread. Untransformed qlogs are left for next time. """
+        self.stopEvent.set()
+        self.queue.put(self.terminateTask)
+        if self.isAlive():
+            self.join(timeout)
+
+
+    def depth(self):
+        return self.queue.qsize()
+
+
+    def __str__(self):
+        n = self.process.num_transformed + self.process.num_discarded
+        if n:
+            avg_latency = self.latency / n
+        else:
+            avg_latency = 0.0
+        return 'depth=%s transformed=%s discarded=%s avg_latency=%.1fs max_latency=%.1fs delayed=%.1fs since %s' % (
+            self.depth(),
+            self.process.num_transformed,
+            self.process.num_discarded,
+            avg_latency,
+            self.maxLatency,
+            self.delayed,
+            str(self.starttime)[:19],
+            )
+
+
+
+def makeTransformer():
+    """ Create and start a StreamTransformer from config. None if it is disabled. """
+    if not cfg.getboolean('indexing.stream_transform', False):
+        return None
+    delay_per_request = cfg.getint('indexing.stream_delay_per_request', 200) / 1000.0
+    max_delay = cfg.getint('indexing.stream_max_delay', 5000) / 1000.0
+    transformer = StreamTransformer(cfg.getpath('logs'), delay_per_request, max_delay)
+    transformer.start()
+    return transformer
@@ -0,0 +1,177 @@
+"""
+"""
+
+import os
+import unittest
+import zipfile
+import zlib
+
+from minds.safe_config import cfg as testcfg
+from minds import archive_file
+
+
+class TestArchiveFile(unittest.TestCase):
+
+    def setUp(self):
+        self.apath = testcfg.getpath('data')/'archive_file'
+        if self.apath.exists():
+            self.apath.rmtree()
+        self.apath.makedirs()
+        self.path = str(self.apath/'000001.idx')
+
+
+    def tearDown(self):
+        self.apath.rmtree()
+
+
+    def _write(self, docs, compress=archive_file.COMPRESS_DEFLATE):
+        writer = archive_file.ArchiveWriter(self.path, compress)
+        try:
+            for name, data in docs:
+                writer.writestr(name, data)
+        finally:
+            writer.close()
+
+
+    def test_read_write(self):
+        docs = [('000', 'a' * 1000), ('001', 'xyz'), ('005', ''), ('999', 'last')]
+        self._write(docs)
+        reader = archive_file.ArchiveReader(self.path)
+        try:
+            for name, data in docs:
+                self.assertEqual(reader.read(name), data)
+            self.assertEqual(reader.namelist(), ['000', '001', '005', '999'])
+            self.assertRaises(KeyError, reader.read, '002')     # gap
+            self.assertRaises(KeyError, reader.read, 'abc')     # invalid
+        finally:
+            reader.close()
+        self.assertRaises(ValueError, reader.read, '000')
+
+
+    def test_compress(self):
+        self._write([('000', 'a' * 1000), ('001', 'xyz')])
+        writer = archive_file.ArchiveWriter(self.path)
+        try:
+            self.assertEqual(writer.getinfo('000')[4], archive_file.METHOD_DEFLATED)
+            self.assertEqual(writer.getinfo('001')[4], archive_file.METHOD_STORED)  # not smaller
+            self.assertRaises(KeyError, writer.getinfo, '002')
+        finally:
+            writer.close()
+
+        self._write([('002', 'a' * 1000)], compress=archive_file.COMPRESS_NONE)
+        reader = archive_file.ArchiveReader(self.path)
+        try:
+            self.assertEqual(reader.read('002'), 'a' * 1000)
+        finally:
+            reader.close()
+
+
+    def test_appended(self):
+        self._write([('000', 'one')])
+        reader = archive_file.ArchiveReader(self.path)
+        try:
+            self.assertEqual(reader.read('000'), 'one')
+            self._write([('001', 'two')])
+            self.assertEqual(reader.read('001'), 'two')         # remapped
+            self.assertEqual(reader.read('000'), 'one')
+        finally:
+            reader.close()
+
+
+    def test_bad_file(self):
+        file(self.path, 'wb').write('not an archive')
+        file(archive_file.datPath(self.path), 'wb').write('not an archive')
+        self.assertRaises(archive_file.BadArchive, archive_file.ArchiveReader, self.path)
+        self.assertRaises(archive_file.BadArchive, archive_file.ArchiveWriter, self.path)
+
+
+    def test_convert(self):
+        zip_path = str(self.apath/'000001.zip')
+        zfile = zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED)
+        zfile.writestr('000', 'this is file 001000')
+        zfile.writestr('003', 'this is file 001003' * 100)
+        zfile.writestr('---', 'invalid filename')
+        zfile.close()
+
+        self.assertEqual(archive_file.convertZip(zip_path), 2)
+        self.assertEqual(archive_file.convertZip(zip_path), -1)     # already converted
+        self.assert_(os.path.exists(zip_path))                      # zip is left in place
+        self.assertEqual(archive_file.verifyZip(zip_path), ['---'])
+
+        reader = archive_file.ArchiveReader(self.path)
+        try:
+            self.assertEqual(reader.read('003'), 'this is file 001003' * 100)
+            self.assertEqual(reader.namelist(), ['000', '003'])
+        finally:
+            reader.close()
+
+
+
+    def _doc(self, i):
+        return ('uri: http://www.example.com/page%s\r\ndate: 2006-01-01T00:00:00Z\r\n'
+                'title: Example %s\r\n\r\n<p>Example site navigation home about contact\n'
+                '<p>document %s text\n<p>Copyright example.com all rights reserved\n') % (i,i,i)
+
+
+    def test_presetDictionary(self):
+        samples = [self._doc(i) for i in range(10)]
+        dictionary = archive_file.trainDictionary(samples)
+        self.assert_(dictionary.find('Copyright example.com all rights reserved') >= 0)
+        self.assert_(len(dictionary) <= archive_file.DICT_SIZE)
+
+        pd = archive_file.PresetDictionary(dictionary)
+        data = self._doc(99)
+        compressed = pd.compress(data)
+        self.assert_(len(compressed) < len(zlib.compress(data)))
+        self.assertEqual(pd.decompress(compressed), data)
+
+        # without compressobj.copy()
+        pd.compressor = pd.decompressor = None
+        self.assertEqual(pd.compress(data), compressed)
+        self.assertEqual(pd.decompress(compressed), data)
+
+
+    def test_dict_mode(self):
+        # the previous archive provides the samples
+        prev_path = str(self.apath/'000000.idx')
+        writer = archive_file.ArchiveWriter(prev_path)
+        for i in range(10):
+            writer.writestr('%03d' % i, self._doc(i))
+        writer.close()
+
+        self._write([('000', self._doc(1000)), ('001', 'x')], archive_file.COMPRESS_DICT)
+        self.assert_(os.path.exists(archive_file.dicPath(self.path)))
+        writer = archive_file.ArchiveWriter(self.path, archive_file.COMPRESS_DICT)
+        try:
+            self.assertEqual(writer.getinfo('000')[4], archive_file.METHOD_DICT)
+            self.assertEqual(writer.getinfo('001')[4], archive_file.METHOD_STORED)
+            writer.writestr('002', self._doc(1002))
+        finally:
+            writer.close()
+
+        reader = archive_file.ArchiveReader(self.path)
+        try:
+            self.assertEqual(reader.read('000'), self._doc(1000))
+            self.assertEqual(reader.read('001'), 'x')
+            self.assertEqual(reader.read('002'), self._doc(1002))
+        finally:
+            reader.close()
+
+
+    def test_convert_dict(self):
+        zip_path = str(self.apath/'000001.zip')
+        zfile = zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED)
+        for i in range(20):
+            zfile.writestr('%03d' % i, self._doc(i))
+        zfile.close()
+
+        self.assertEqual(archive_file.convertZip(zip_path, archive_file.COMPRESS_DICT), 20)
+        self.assert_(os.path.exists(archive_file.dicPath(self.path)))
+        self.assertEqual(archive_file.verifyZip(zip_path), [])
+        dat_size = os.path.getsize(archive_file.datPath(self.path))
+        self.assert_(dat_size < os.path.getsize(zip_path))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
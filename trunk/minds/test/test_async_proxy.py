@@ -0,0 +1,144 @@
+"""
+"""
+
+import asyncore
+import BaseHTTPServer
+import socket
+import threading
+import traceback
+import unittest
+
+from minds.safe_config import cfg as testcfg
+from minds import async_proxy
+from minds import messagelog
+from minds import queueindex
+from minds.util import fileutil
+from minds.util.multiblockfile import MbReader
+
+logpath = testcfg.getpath('logs')
+
+TEST_HTML = '<html><head><title>test</title></head><body><p>%s</p></body></html>' % ('hello world ' * 20)
+
+
+class TestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(TEST_HTML)))
+        self.end_headers()
+        self.wfile.write(TEST_HTML)
+
+    def log_message(self, format, *args):
+        pass
+
+
+
+class TestAsyncProxy(unittest.TestCase):
+
+    def setUp(self):
+        self.assertEqual(logpath, 'testlogs')
+        self.cleanup()
+
+        # destination server
+        self.httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), TestHandler)
+        self.dest = '127.0.0.1:%s' % self.httpd.server_address[1]
+        t = threading.Thread(target=self.httpd.handle_request)
+        t.setDaemon(True)
+        t.start()
+
+        # proxy
+        self.proxy = async_proxy.ProxyServer(('127.0.0.1', 0))
+        self.running = True
+        self.loop_thread = threading.Thread(target=self._loop)
+        self.loop_thread.setDaemon(True)
+        self.loop_thread.start()
+
+
+    def _loop(self):
+        while self.running:
+            asyncore.loop(0.05, False, self.proxy.socket_map, 1)
+
+
+    def tearDown(self):
+        self.running = False
+        self.loop_thread.join()
+        self.proxy.close_all()
+        self.httpd.server_close()
+        self.cleanup()
+
+
+    def cleanup(self):
+        files = fileutil.listdir(logpath, messagelog.mlog.log_pattern)
+        for f in files:
+            try: (logpath/f).remove()
+            except OSError: traceback.print_exc()
+        queueindex.getIndex(logpath).rescan()
+        messagelog.mlog = messagelog.MsgLogger()    # reset currentId after cleanup()
+
+
+    def _request(self, msg):
+        soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        soc.settimeout(10)
+        soc.connect(self.proxy.server_address)
+        soc.sendall(msg)
+        data = []
+        while True:
+            d = soc.recv(8192)
+            if not d: break
+            data.append(d)
+        soc.close()
+        return ''.join(data)
+
+
+    def testGET(self):
+        rsp = self._request('GET http://%s/ HTTP/1.0\r\nHost: %s\r\n\r\n' % (self.dest, self.dest))
+        self.assert_(rsp.startswith('HTTP/1.0 200'))
+        self.assert_(rsp.endswith(TEST_HTML))
+
+        # check 1 message logged
+        self.assertEqual(messagelog.mlog.currentId, 2)
+        fp = messagelog.mlog._getMsgLogPath('000000001').open('rb')
+        try:
+            minfo = messagelog.MessageInfo.parseMessageLog(fp)
+        finally:
+            fp.close()
+        self.assertEqual(minfo.req_path, 'http://%s/' % self.dest)
+        self.assertEqual(minfo.status, 200)
+        self.assertEqual(minfo.clen, len(TEST_HTML))
+        self.assertEqual(minfo.discard, False)
+        self.assertEqual(self.proxy.worker_status, [])
+
+
+    def testPipelined(self):
+        req1 = 'GET http://%s/1 HTTP/1.1\r\nHost: %s\r\n\r\n' % (self.dest, self.dest)
+        req2 = 'GET http://%s/2 HTTP/1.1\r\nHost: %s\r\n\r\n' % (self.dest, self.dest)
+        rsp = self._request(req1 + req2)
+
+        # only the first one is answered, then the connection is closed
+        self.assertEqual(rsp.count('HTTP/1.0 200'), 1)
+        self.assert_(rsp.endswith(TEST_HTML))
+
+        # the second request is not recorded as the body of the first
+        self.assertEqual(messagelog.mlog.currentId, 2)
+        fp = messagelog.mlog._getMsgLogPath('000000001').open('rb')
+        try:
+            self.assertEqual(MbReader(fp).read(), req1)
+        finally:
+            fp.close()
+
+
+    def testConnectFailed(self):
+        # nothing listen on the port of the closed server socket
+        soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        soc.bind(('127.0.0.1', 0))
+        dest = '127.0.0.1:%s' % soc.getsockname()[1]
+        soc.close()
+
+        rsp = self._request('GET http://%s/ HTTP/1.0\r\n\r\n' % dest)
+        self.assert_(rsp.startswith('HTTP/1.0 404'))
+        self.assertEqual(messagelog.mlog.currentId, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
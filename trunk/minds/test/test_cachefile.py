@@ -6,6 +6,7 @@ import unittest
 
 from minds.safe_config import cfg as testcfg
 from minds import cachefile
+from minds.util import multiblockfile
 
 
 class TestCacheFile(unittest.TestCase):
@@ -69,5 +70,62 @@ class TestCacheFile(unittest.TestCase):
         self.assert_(not self.mlogpath.exists())
 
 
+    def test_spill(self):
+        c = cachefile.CacheFile(100, 50)
+        fp = multiblockfile.MbWriter(c)
+        fp.write('hello')
+        fp.complete()
+        self.assert_(not c.isSpilled())
+
+        fp = multiblockfile.MbWriter(c)
+        fp.write('how are you?')
+        fp.complete()
+        self.assert_(c.isSpilled())
+        spillpath = c.spillpath
+        self.assert_(spillpath.exists())
+
+        # first save is a rename, the second is a copy
+        c.write_qlog(self.FILE_BASE)
+        self.assert_(not spillpath.exists())
+        c.write_mlog(self.FILE_BASE)
+        c.discard()
+        data = self.qlogpath.open('rb').read()
+        self.assertEqual(data, self.mlogpath.open('rb').read())
+
+        fp = multiblockfile.MbReader(self.qlogpath.open('rb'))
+        self.assertEqual(fp.read(), 'hello')
+        fp.complete()
+        fp = multiblockfile.MbReader(fp.fp)
+        self.assertEqual(fp.read(), 'how are you?')
+        fp.fp.close()
+
+
+    def test_spill_discard(self):
+        c = cachefile.CacheFile(100, 10)
+        c.write('how are you?')
+        spillpath = c.spillpath
+        self.assert_(spillpath.exists())
+        c.discard()
+        self.assert_(not spillpath.exists())
+        self.assert_(not self.qlogpath.exists())
+
+
+    def test_removeTempFiles(self):
+        # temp files left by a process that has died
+        c = cachefile.CacheFile(100, 10)
+        c.write('how are you?')
+        spillpath = c.spillpath
+        c.fp.close()
+        tmppath = self.qlogpath + '.tmp'
+        tmppath.open('wb').close()
+
+        self.qlogpath.open('wb').close()            # not a temp file
+        self.assertEqual(cachefile.removeTempFiles(), 2)
+        self.assert_(not spillpath.exists())
+        self.assert_(not tmppath.exists())
+        self.assert_(self.qlogpath.exists())
+
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
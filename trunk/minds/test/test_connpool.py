@@ -0,0 +1,85 @@
+"""
+"""
+
+import socket
+import time
+import unittest
+
+from minds.safe_config import cfg as testcfg
+from minds import connpool
+
+
+def _socketpair():
+    """ Make a pair of connected sockets (socket.socketpair is not available in Windows) """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    client.connect(listener.getsockname())
+    server, address = listener.accept()
+    listener.close()
+    return client, server
+
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = connpool.ConnectionPool(max_per_host=2, idle_timeout=10)
+        self.peers = []
+
+
+    def tearDown(self):
+        self.pool.close()
+        for s in self.peers:
+            s.close()
+
+
+    def _connect(self):
+        client, server = _socketpair()
+        self.peers.append(server)
+        return client
+
+
+    def test_get_put(self):
+        self.assertEqual(self.pool.get('h:80'), None)
+        soc = self._connect()
+        self.pool.put('h:80', soc)
+        self.assertEqual(self.pool.get('h:81'), None)     # different netloc
+        self.assert_(self.pool.get('h:80') is soc)
+        self.assertEqual(self.pool.get('h:80'), None)     # taken
+        self.assertEqual(self.pool.hits, 1)
+        self.assertEqual(self.pool.misses, 3)
+
+
+    def test_max_per_host(self):
+        for i in range(3):
+            self.pool.put('h:80', self._connect())
+        self.assertEqual(self.pool.numIdle(), 2)
+
+
+    def test_idle_timeout(self):
+        self.pool.put('h:80', self._connect())
+        self.pool.idle_timeout = 0
+        self.assertEqual(self.pool.get('h:80'), None)
+        self.assertEqual(self.pool.numIdle(), 0)
+
+
+    def test_closed_by_server(self):
+        self.pool.put('h:80', self._connect())
+        self.peers[0].close()
+        time.sleep(0.1)
+        self.assertEqual(self.pool.get('h:80'), None)
+
+
+    def test_purge(self):
+        self.pool.put('h:80', self._connect())
+        self.pool.put('h:81', self._connect())
+        self.pool.idle_timeout = 0
+        self.pool.purge()
+        self.assertEqual(self.pool.numIdle(), 0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
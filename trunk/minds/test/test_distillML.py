@@ -10,6 +10,18 @@ from minds.util import patterns_tester
 testpath = testcfg.getpath('testDoc')
 
 
+class StreamFile(object):
+    """ A file without seek(), like a network stream """
+    def __init__(self, fp):
+        self.fp = fp
+    def read(self, *args):
+        return self.fp.read(*args)
+    def readline(self, *args):
+        return self.fp.readline(*args)
+    def close(self):
+        self.fp.close()
+
+
 class TestDistill(unittest.TestCase):
 
     def setUp(self):
@@ -108,6 +120,22 @@ class TestDistill(unittest.TestCase):
         self.assert_(s.find(u'<&amp;,&lt;, ,",&gt;>') > 0)  # entities
 
 
+    def testDistillStream(self):
+
+        # rstream does not need to support seek()
+
+        self.fp = rspreader.openlog(testpath/'basictags.html')
+        expect = StringIO.StringIO()
+        result = distillML.distill(self.fp, expect, {})
+        self.assertEqual(0, result)
+        self.fp.close()
+
+        self.fp = StreamFile(rspreader.openlog(testpath/'basictags.html'))
+        result = distillML.distill(self.fp, self.buf, {})
+        self.assertEqual(0, result)
+        self.assertEqual(expect.getvalue(), self.buf.getvalue())
+
+
     def testDistillTxt(self):
         self.fp = rspreader.openlog(testpath/'plaintext.mlog')
         result = distillML.distillTxt(self.fp, self.buf, {})
@@ -57,6 +57,18 @@ class TestParseDistillML(unittest.TestCase):
         self.assertEqual('abcdef<item>ghijklmn', content)
 
 
+    def testParseSameAsLoop(self):
+        # compare with the old character loop, with tags at every buffer boundary.
+        # The loop only works when bufsize >= MAX_OUTPUT_TAG_LEN.
+        header = 'uri: http://x/\n\n'
+        body = u'<p>a<<h1>b</h1>>c<pre><x></pre><\u00e5</p' + u'<br><<br' * 3 + '<'
+        for bufsize in range(distillML.MAX_OUTPUT_TAG_LEN, 12) + [32768]:
+            input = header + body.encode('utf8')
+            expect = distillparse._parseDistillMLLoop(StringIO.StringIO(input), bufsize=bufsize)
+            result = distillparse.parseDistillML(StringIO.StringIO(input), bufsize=bufsize)
+            self.assertEqual(expect, result)
+
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -7,6 +7,7 @@ import unittest
 import zipfile
 
 from minds.safe_config import cfg as testcfg
+from minds import archive_file
 from minds import docarchive
 
 
@@ -31,8 +32,14 @@ class BaseTest(unittest.TestCase):
         self.apath = testcfg.getpath('archive')
         self.cleanup()
 
+    def tearDown(self):
+        # leave no archive or manifest.txt behind in testdata
+        self.cleanup()
+
     def cleanup(self):
         assert(self.apath == 'testdata/archive')    # avoid deleting wrong data in config goof
+        docarchive.zipCache.closeAll()
+        docarchive.datCache.closeAll()
         self.apath.rmtree(True)
         self.apath.mkdir()
 
@@ -76,6 +83,17 @@ class TestDocArchive(BaseTest):
         self.assertRaises(KeyError, docarchive.get_document, '000222777')
 
 
+    def test_get_document_appended(self):
+
+        _add_documents([('000000000', 'this is file 000000000')])
+        self.assertEqual(docarchive.get_document('000000000').read(), 'this is file 000000000')
+
+        # the opened archive is refreshed after new document is added
+        _add_documents([('000000001', 'this is file 000000001')])
+        self.assertEqual(docarchive.get_document('000000001').read(), 'this is file 000000001')
+        self.assertEqual(docarchive.get_document('000000000').read(), 'this is file 000000000')
+
+
 
 class TestIdCounter(BaseTest):
 
@@ -223,5 +241,136 @@ class TestArchiveHandler(BaseTest):
 
 
 
+class TestManifest(BaseTest):
+
+    def _findIdRange(self, scan):
+        """ Return the range found by a new IdCounter. Fail if it scans
+            the archive when scan is False.
+        """
+        ic = docarchive.IdCounter()
+        if not scan:
+            def no_scan(arcpath):
+                raise AssertionError('archive opened %s' % arcpath)
+            ic._namelistOf = no_scan
+        ic._findIdRange()
+        return ic._beginId, ic._endId
+
+
+    def test_manifest(self):
+        _add_documents([
+            ('000000001', 'this is file 000000001'),
+            ('000001009', 'this is file 000001009'),
+        ])
+        self.assert_(not (self.apath/'manifest.txt').exists())
+        self.assertEqual(self._findIdRange(True), (1,1010))     # build the manifest
+
+        manifest = docarchive.Manifest.load(self.apath)
+        self.assertEqual((manifest.beginId, manifest.endId), (1,1010))
+        self.assertEqual(manifest.archives['000000'][0], 1)
+        self.assertEqual(manifest.archives['000001'][0], 1)
+
+        self.assertEqual(self._findIdRange(False), (1,1010))
+
+
+    def test_updated_by_ArchiveHandler(self):
+        _add_documents([('000000001', 'this is file 000000001')])
+        self.assertEqual(self._findIdRange(True), (1,2))
+
+        _add_documents([
+            ('000000002', 'this is file 000000002'),
+            ('000001000', 'this is file 000001000'),
+            ('000001001', 'this is file 000001001'),
+        ])
+        self.assertEqual(self._findIdRange(False), (1,1002))
+        manifest = docarchive.Manifest.load(self.apath)
+        self.assertEqual(manifest.archives['000000'][0], 2)
+        self.assertEqual(manifest.archives['000001'][0], 2)
+
+
+    def test_outdated(self):
+        _add_documents([('000000001', 'this is file 000000001')])
+        self.assertEqual(self._findIdRange(True), (1,2))
+
+        # added without going through ArchiveHandler
+        zfile = zipfile.ZipFile(self.apath/'000000.zip', 'a', zipfile.ZIP_DEFLATED)
+        zfile.writestr('005', 'this is file 000000005')
+        zfile.close()
+        self.assertRaises(AssertionError, self._findIdRange, False)
+        self.assertEqual(self._findIdRange(True), (1,6))
+        self.assertEqual(self._findIdRange(False), (1,6))
+
+        # first archive purged
+        _add_documents([('000001001', 'this is file 000001001')])
+        self.assertEqual(self._findIdRange(False), (1,1002))
+        docarchive.zipCache.closeAll()
+        (self.apath/'000000.zip').remove()
+        self.assertEqual(self._findIdRange(True), (1001,1002))
+
+        # invalid manifest
+        file(self.apath/'manifest.txt','wb').write('garbage')
+        self.assertEqual(self._findIdRange(True), (1001,1002))
+
+
+
+class TestDatFormat(BaseTest):
+    """ Documents are written to NNNNNN.dat/.idx with archive.format=dat """
+
+    def setUp(self):
+        self.format0 = testcfg.get('archive.format', 'zip')
+        BaseTest.setUp(self)
+
+
+    def tearDown(self):
+        testcfg.set('archive.format', self.format0)
+        self.cleanup()
+
+
+    def test_get_document(self):
+        testcfg.set('archive.format', 'dat')
+        _add_documents([
+            ('000000000', 'this is file 000000000'),
+            ('000001002', 'this is file 000001002'),
+        ])
+        self.assert_(not (self.apath/'000000.zip').exists())
+        self.assert_((self.apath/'000000.idx').exists())
+
+        self.assertEqual(docarchive.get_document('000000000').read(), 'this is file 000000000')
+        self.assertEqual(docarchive.get_document('000001002').read(), 'this is file 000001002')
+        self.assertRaises(KeyError, docarchive.get_document, '000000001')
+        self.assertRaises(KeyError, docarchive.get_document, '000222777')
+
+        ic = docarchive.IdCounter()
+        ic._findIdRange()
+        self.assertEqual((ic._beginId, ic._endId), (0, 1003))
+
+        # ArchiveHandler reads either format
+        ah = docarchive.ArchiveHandler('r')
+        try:
+            zfile, filename = ah._open('000001002')
+            self.assertEqual(zfile.read(filename), 'this is file 000001002')
+        finally:
+            ah.close()
+
+
+    def test_converted(self):
+        _add_documents([
+            ('000000000', 'this is file 000000000'),
+            ('000000001', 'this is file 000000001'),
+        ])
+        archive_file.convertZip(self.apath/'000000.zip')
+
+        # added to the zip after conversion
+        _add_documents([('000000002', 'this is file 000000002')])
+
+        for i in range(3):
+            id = '%09d' % i
+            self.assertEqual(docarchive.get_document(id).read(), 'this is file %s' % id)
+
+        ic = docarchive.IdCounter()
+        ic._findIdRange()
+        self.assertEqual((ic._beginId, ic._endId), (0, 3))
+
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -15,11 +15,14 @@ class TestDomainFilter(unittest.TestCase):
         self.domain2 = testcfg.get('filter.domain.2', '')
         self.domain3 = testcfg.get('filter.domain.3', '')
         self.domain4 = testcfg.get('filter.domain.4', '')
+        self.domain_file = testcfg.get('filter.domain_file', '')
         testcfg.set('filter.domain.0', '.xyz.com')           # domain start by '.'
         testcfg.set('filter.domain.1', ' abc.com , , def ')  # whitespaces, nothing between ,,
         testcfg.set('filter.domain.2', ',')                  # lone ,
         testcfg.set('filter.domain.3', '')                   # blank
         testcfg.set('filter.domain.4', '')
+        testcfg.set('filter.domain_file', '')
+        self.blocklist = testcfg.getpath('data')/'blocklist.txt'
 
 
     def tearDown(self):
@@ -28,6 +31,10 @@ class TestDomainFilter(unittest.TestCase):
         testcfg.set('filter.domain.2', self.domain2)
         testcfg.set('filter.domain.3', self.domain3)
         testcfg.set('filter.domain.4', self.domain4)
+        testcfg.set('filter.domain_file', self.domain_file)
+        if self.blocklist.exists():
+            self.blocklist.remove()
+        domain_filter.g_exdm = None
 
 
     def testLoad0(self):
@@ -80,5 +87,53 @@ class TestDomainFilter(unittest.TestCase):
         self.assertEqual('.xyz.com', domain_filter.match('http://u:p@www.xyz.com/index.html?a=b#c'))
 
 
+
+    def testFilterOrder(self):
+        # the first domain listed wins
+        domain_filter.g_exdm = ['.www.xyz.com', '.xyz.com', 'www.xyz.com']
+        self.assertEqual('.www.xyz.com', domain_filter.match('http://a.www.xyz.com/'))
+        self.assertEqual('.xyz.com',     domain_filter.match('http://www.xyz.com/'))
+        self.assertEqual('.xyz.com',     domain_filter.match('http://a.b.xyz.com/'))
+
+        # g_exdm switched over is picked up
+        domain_filter.g_exdm = ['www.xyz.com', '.xyz.com']
+        self.assertEqual('www.xyz.com',  domain_filter.match('http://www.xyz.com/'))
+
+
+    def testFilterSameAsScan(self):
+        exdms = ['.xyz.com', 'abc.com', 'def', '.c.b.a', 'b.a', '.', '.com', 'x..y']
+        hosts = ['', 'xyz.com', 'www.xyz.com', 'abc.com', 'a.abc.com', 'def', 'def.',
+                 'a', 'b.a', 'c.b.a', 'd.c.b.a', 'e.d.c.b.a', 'a.', '.', '..', 'x..y', 'w.x..y']
+        for n in range(len(exdms)+1):
+            dfilter = domain_filter.DomainFilter(exdms[n:] + exdms[:n])
+            for host in hosts:
+                # linear scan as done before
+                for ex in dfilter.exdms:
+                    if ex[0] == '.' and host.endswith(ex) or host == ex:
+                        break
+                else:
+                    ex = None
+                self.assertEqual(ex, dfilter.match(host), host)
+                self.assertEqual(ex, dfilter.match(host), host)   # cached
+
+
+    def testBlocklistFile(self):
+        fp = file(self.blocklist, 'wb')
+        fp.write('# ad servers\n.ads.example.com\n\ntracker.example.net  # comment\n')
+        fp.close()
+        testcfg.set('filter.domain_file', self.blocklist)
+        domain_filter.load()
+        self.assertEqual(['.xyz.com', 'abc.com', 'def', '.ads.example.com', 'tracker.example.net'],
+            domain_filter.g_exdm)
+        self.assertEqual('.ads.example.com',    domain_filter.match('http://x.ads.example.com/'))
+        self.assertEqual('tracker.example.net', domain_filter.match('http://tracker.example.net/'))
+        self.assertEqual('abc.com',             domain_filter.match('http://abc.com/'))
+
+        # missing file is not fatal
+        self.blocklist.remove()
+        domain_filter.load()
+        self.assertEqual(['.xyz.com', 'abc.com', 'def'], domain_filter.g_exdm)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -60,6 +60,16 @@ class TestEncodeTools(unittest.TestCase):
         self.assertEqual(('iso-8859-1',encode_tools.DEFAULT), result)
 
 
+    def test_findMetaHttpEquiv(self):
+        find = encode_tools.findMetaHttpEquiv
+        self.assertEqual('', find(''))
+        self.assertEqual('big5', find('<html><head><meta content="text/html; charset=big5" HTTP-EQUIV=content-type></head>'))
+        self.assertEqual('utf-8', find("<meta\nname='x'\nhttp-equiv='Content-Type'\ncontent='text/html;charset=UTF-8'>"))
+        self.assertEqual('big5', find('<meta name="keywords" content="a; charset=x"><meta http-equiv="Content-Type" content="text/html; charset=big5">'))
+        self.assertEqual('', find('<!-- <meta http-equiv="Content-Type" content="text/html; charset=big5"> -->'))
+        self.assertEqual('', find('<metadata http-equiv="Content-Type" content="text/html; charset=big5">'))
+
+
     def test_determine_lenient(self):
 
         result = encode_tools.determineEncoding(
@@ -0,0 +1,161 @@
+"""
+"""
+
+import datetime
+import os
+import struct
+import time
+import unittest
+
+from minds.safe_config import cfg as testcfg
+from minds import index_maintenance
+from minds import messagelog
+
+
+class TestIndexMaintenance(unittest.TestCase):
+
+    def setUp(self):
+        self.indexpath = testcfg.getpath('data')/'maintenance_index'
+        self._cleanup()
+        self.indexpath.makedirs()
+        messagelog.mlog = messagelog.MsgLogger()
+        self.config0 = {}
+        for key in ['indexing.interval', 'indexing.optimize_segments', 'indexing.optimize_window']:
+            self.config0[key] = testcfg.get(key, '')
+        testcfg.set('indexing.interval', '3')
+        testcfg.set('indexing.optimize_segments', '10')
+        testcfg.set('indexing.optimize_window', '')
+
+
+    def tearDown(self):
+        messagelog.mlog = messagelog.MsgLogger()
+        for key, value in self.config0.items():
+            testcfg.set(key, value)
+        self._cleanup()
+
+
+    def _cleanup(self):
+        if self.indexpath.exists():
+            self.indexpath.rmtree()
+        index_maintenance.IndexLock(self.indexpath).clear()
+
+
+    def _writeSegments(self, count, format=-1):
+        fp = file(self.indexpath/'segments', 'wb')
+        if format < 0:
+            fp.write(struct.pack('>iqii', format, 123, 45, count))
+        else:
+            fp.write(struct.pack('>ii', 45, count))
+        fp.write('\0' * 8 * count)
+        fp.close()
+
+
+    def test_countSegments(self):
+        self.assertEqual(index_maintenance.countSegments(self.indexpath), 0)
+        self._writeSegments(7)
+        self.assertEqual(index_maintenance.countSegments(self.indexpath), 7)
+        self._writeSegments(3, format=0)
+        self.assertEqual(index_maintenance.countSegments(self.indexpath), 3)
+
+
+    def test_window(self):
+        parseWindow = index_maintenance.parseWindow
+        inWindow = index_maintenance.inWindow
+        self.assertEqual(parseWindow(''), None)
+        self.assertEqual(parseWindow('bad'), None)
+        self.assertEqual(parseWindow(' 2-6 '), (2,6))
+        self.assertEqual(parseWindow('22-24'), (22,0))
+
+        def at(hour):
+            return datetime.datetime(2000,1,1,hour,30)
+        self.assert_(inWindow(at(5), None))
+        self.assert_(    inWindow(at(2),  (2,6)))
+        self.assert_(    inWindow(at(5),  (2,6)))
+        self.assert_(not inWindow(at(6),  (2,6)))
+        self.assert_(    inWindow(at(23), (22,4)))
+        self.assert_(    inWindow(at(3),  (22,4)))
+        self.assert_(not inWindow(at(12), (22,4)))
+
+
+    def test_shouldOptimize(self):
+        now = datetime.datetime(2000,1,1,3,0)
+        messagelog.mlog.lastRequest = now - datetime.timedelta(minutes=10)
+        shouldOptimize = index_maintenance.shouldOptimize
+
+        # below threshold
+        self._writeSegments(9)
+        self.assertEqual(shouldOptimize(now, self.indexpath), 0)
+
+        self._writeSegments(10)
+        self.assertEqual(shouldOptimize(now, self.indexpath), 10)
+
+        # proxy is busy
+        messagelog.mlog.lastRequest = now - datetime.timedelta(minutes=1)
+        self.assertEqual(shouldOptimize(now, self.indexpath), 0)
+        messagelog.mlog.lastRequest = now - datetime.timedelta(minutes=10)
+
+        # outside of window
+        testcfg.set('indexing.optimize_window', '4-6')
+        self.assertEqual(shouldOptimize(now, self.indexpath), 0)
+        testcfg.set('indexing.optimize_window', '2-6')
+        self.assertEqual(shouldOptimize(now, self.indexpath), 10)
+
+        # disabled
+        testcfg.set('indexing.optimize_segments', '0')
+        self.assertEqual(shouldOptimize(now, self.indexpath), 0)
+
+
+    def test_IndexLock(self):
+        lock1 = index_maintenance.IndexLock(self.indexpath)
+        lock2 = index_maintenance.IndexLock(self.indexpath)
+        self.assert_(not lock1.isLocked())
+        self.assert_(lock1.acquire())
+        self.assert_(lock2.isLocked())
+        self.assert_(not lock2.acquire())
+        lock2.release()                         # not held, no effect
+        self.assert_(lock1.isLocked())
+        lock1.release()
+        self.assert_(lock2.acquire())
+        lock2.release()
+
+        # stale lock left by a process that has died
+        self.assert_(lock1.acquire())
+        mtime = time.time() - index_maintenance.STALE_LOCK_SECONDS - 60
+        os.utime(lock1.path, (mtime, mtime))
+        self.assert_(not lock2.isLocked())
+        self.assert_(lock2.acquire())
+        lock2.release()
+
+
+    def test_locked(self):
+        now = datetime.datetime(2000,1,1,3,0)
+        messagelog.mlog.lastRequest = now - datetime.timedelta(minutes=10)
+        self._writeSegments(10)
+
+        called = []
+        def optimizeProcess(indexpath):
+            called.append(indexpath)
+            return 0
+        backup = index_maintenance._optimizeProcess, testcfg.get('path.archiveindex')
+        index_maintenance._optimizeProcess = optimizeProcess
+        testcfg.set('path.archiveindex', self.indexpath)
+        lock = index_maintenance.IndexLock(self.indexpath)
+        try:
+            # the indexer is writing
+            self.assert_(lock.acquire())
+            self.assert_(not index_maintenance.optimize(self.indexpath))
+            self.assert_(not index_maintenance.maintenanceTask(now))
+            self.assertEqual(called, [])
+            lock.release()
+
+            self.assert_(index_maintenance.maintenanceTask(now))
+            self.assertEqual(called, [self.indexpath])
+        finally:
+            lock.release()
+            index_maintenance._optimizeProcess, archiveindex = backup
+            testcfg.set('path.archiveindex', archiveindex)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
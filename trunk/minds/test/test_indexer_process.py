@@ -0,0 +1,83 @@
+"""
+"""
+
+import cPickle
+import StringIO
+import unittest
+
+from minds.safe_config import cfg as testcfg
+from minds import indexer_process
+
+
+def _pickles(*msgs):
+    buf = StringIO.StringIO()
+    for msg in msgs:
+        cPickle.dump(msg, buf, 2)
+    buf.seek(0)
+    return buf
+
+
+def _unpickles(buf):
+    buf.seek(0)
+    result = []
+    while True:
+        try:
+            result.append(cPickle.load(buf))
+        except EOFError:
+            return result
+
+
+
+class TestIndexerProcess(unittest.TestCase):
+
+    def setUp(self):
+        self.logpath = testcfg.getpath('logs')
+        self.client = None
+
+
+    def tearDown(self):
+        if self.client:
+            self.client.close()
+
+
+    def test_serve(self):
+        rfile = _pickles(
+            ('index', str(self.logpath), []),
+            ('bad command',),
+            ('quit',),
+            ('index', str(self.logpath), []),       # not reached
+            )
+        wfile = StringIO.StringIO()
+        indexer_process.serve(rfile, wfile)
+        result = _unpickles(wfile)
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result[0][:3], ('done', 0, 0))
+        self.assertEqual(result[1][0], 'error')
+
+
+    def test_serve_eof(self):
+        wfile = StringIO.StringIO()
+        indexer_process.serve(_pickles(), wfile)
+        self.assertEqual(_unpickles(wfile), [])
+
+
+    def test_child(self):
+        # nothing but the messages should come out of the child's stdout
+        self.client = indexer_process.IndexerClient()
+        self.assertEqual(self.client.run(self.logpath, []), (0, 0))
+        self.assertEqual(self.client.proc, None)  # not started for nothing
+
+        self.client._start()
+        self.client._send(('index', str(self.logpath), []))
+        msg = cPickle.load(self.client.proc.stdout)
+        self.assertEqual(msg[:3], ('done', 0, 0))
+
+        proc = self.client.proc
+        self.client.close()
+        self.assertEqual(proc.returncode, 0)
+        self.assertEqual(self.client.proc, None)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+"""
+
+import threading
+import time
+import unittest
+
+from minds.safe_config import cfg as testcfg
+from minds import cachefile
+from minds import logwriter
+
+
+class MockCacheFile(cachefile.CacheFile):
+    """ Record the filenames in saved. Optionally wait for an event before saving. """
+
+    def __init__(self, saved, event=None):
+        super(MockCacheFile,self).__init__(10)
+        self.saved = saved
+        self.event = event
+        self.discarded = False
+
+    def _save(self, filename):
+        if self.event:
+            self.event.wait()
+        self.saved.append(filename)
+
+    def discard(self):
+        self.discarded = True
+
+
+
+class TestLogWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = logwriter.LogWriter(maxsize=2, batch=5)
+        self.writer.start()
+
+
+    def tearDown(self):
+        self.writer.close(5)
+
+
+    def test_write(self):
+        saved = []
+        cfps = [MockCacheFile(saved) for i in range(5)]
+        self.writer.put(cfps[0], '000000001', True, False)
+        self.writer.put(cfps[1], '000000002', True, True)
+        self.writer.put(cfps[2], '000000003', False, True)
+        self.writer.close(5)
+        self.assertEqual(saved, [
+            '000000001.qlog',
+            '000000002.qlog',
+            '000000002.mlog',
+            '000000003.mlog',
+        ])
+        self.assert_(cfps[0].discarded)
+        self.assert_(cfps[2].discarded)
+        self.assertEqual(self.writer.written, 3)
+        self.assertEqual(self.writer.depth(), 0)
+
+
+    def test_backpressure(self):
+        self.writer.close(5)
+        self.writer = logwriter.LogWriter(maxsize=2, batch=1)
+        self.writer.start()
+
+        saved = []
+        event = threading.Event()
+        try:
+            # first one is taken by the writer thread and blocked on event
+            self.writer.put(MockCacheFile(saved, event), '000000000', True, False)
+            for i in range(50):
+                if not self.writer.depth(): break
+                time.sleep(0.1)
+
+            # the next two fill up the queue
+            for i in range(1,3):
+                self.writer.put(MockCacheFile(saved, event), '%09d' % i, True, False)
+
+            # the next put() should be blocked until event is set
+            t = threading.Thread(target=self.writer.put, args=(MockCacheFile(saved, event), '000000003', True, False))
+            t.setDaemon(True)
+            t.start()
+            t.join(0.3)
+            self.assert_(t.isAlive())
+            self.assertEqual(saved, [])
+        finally:
+            event.set()
+
+        t.join(5)
+        self.writer.close(5)
+        self.assertEqual(len(saved), 4)
+        self.assertEqual(self.writer.blocked, 1)
+        self.assertEqual(self.writer.maxDepth, 2)
+
+
+    def test_error(self):
+        class BadCacheFile(MockCacheFile):
+            def _save(self, filename):
+                raise IOError('disk full')
+        saved = []
+        bad = BadCacheFile(saved)
+        self.writer.put(bad, '000000001', True, False)
+        self.writer.put(MockCacheFile(saved), '000000002', True, False)
+        self.writer.close(5)
+        self.assertEqual(saved, ['000000002.qlog'])
+        self.assert_(bad.discarded)
+        self.assertEqual(self.writer.errors, 1)
+        self.assert_(str(self.writer).startswith('depth=0'))
+
+
+    def test_onWritten(self):
+        self.writer.close(5)
+        notified = []
+        self.writer = logwriter.LogWriter(onWritten=lambda id, qlog: notified.append((id, qlog)))
+        self.writer.start()
+        saved = []
+        self.writer.put(MockCacheFile(saved), '000000001', True, False)
+        self.writer.put(MockCacheFile(saved), '000000002', False, True)
+        self.writer.close(5)
+        self.assertEqual(notified, [('000000001', True), ('000000002', False)])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
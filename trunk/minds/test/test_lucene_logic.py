@@ -85,5 +85,35 @@ class TestLuceneLogic(unittest.TestCase):
         self.assertEqual(version, reader.getVersion())
 
 
+    def test_searcherManager(self):
+        manager = lucene_logic.SearcherManager(pathname=self.indexpath)
+        try:
+            s1 = manager.acquire()
+            s2 = manager.acquire()
+            self.assert_(s1 is s2)                          # shared
+            self.assertEqual(s1.reader.numDocs(), 1)
+            manager.release(s2)
+
+            # a writer commits a new generation
+            writer = lucene_logic.Writer(self.indexpath)
+            writer.addDocument(u'1', {'uri': u'http://a', 'date': '2004'}, u'content1')
+            writer.close()
+
+            s3 = manager.acquire()
+            self.assert_(s3 is not s1)                      # reopened
+            self.assert_(s3.generation > s1.generation)
+            self.assertEqual(s3.reader.numDocs(), 2)
+            self.assertEqual(s1.reader.numDocs(), 1)        # s1 is still usable until released
+            manager.release(s1)
+            manager.release(s3)
+
+            s4 = manager.acquire()
+            self.assert_(s4 is s3)                          # no change
+            manager.release(s4)
+            self.assertEqual(manager.numOpened, 2)
+        finally:
+            manager.close()
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
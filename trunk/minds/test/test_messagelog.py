@@ -11,6 +11,8 @@ import unittest
 from minds.safe_config import cfg as testcfg
 from minds import cachefile
 from minds import messagelog
+from minds import queueindex
+from minds.util import fileutil
 from minds.util import multiblockfile
 
 
@@ -156,26 +158,14 @@ class MockCacheFile(cachefile.CacheFile):
         self.saved.append(filename)
 
     def discard(self):
-        self.saved = None
-
-
-
-class MsgLoggerFixture(messagelog.MsgLogger):
-    """ overrides _listdir() to help test _findHighestId """
-
-    def __init__(self, *args):
-        super(MsgLoggerFixture,self).__init__(*args)
-        self.dirlist = []
-
-    def _listdir(self, logdir):
-        return self.dirlist
+        self.discarded = True
 
 
 
 class TestMsgLogger(unittest.TestCase):
 
     def setUp(self):
-        self.mlog = MsgLoggerFixture()
+        self.mlog = messagelog.MsgLogger()
         self.minfo = messagelog.MessageInfo._makeTestMinfo([('content-type','text/plain')],7)
         self.minfoX = messagelog.MessageInfo._makeTestMinfo([('content-type','text/plain')],7,status='404')
         self.assert_(not self.minfo.discard)    # good minfo
@@ -183,27 +173,40 @@ class TestMsgLogger(unittest.TestCase):
         self.starttime = datetime.datetime.now()
 
 
-    def test_findHighestId(self):
+    def _removeLogs(self, logpath, files):
+        for f in files:
+            if (logpath/f).exists():
+                (logpath/f).remove()
+        queueindex.getIndex(logpath).rescan()
 
-        # no file
-        self.mlog.dirlist = []
-        self.assertEqual(self.mlog._findHighestId(), 0)
 
-        # irrevelant file
-        self.mlog.dirlist = ['abc']
-        self.assertEqual(self.mlog._findHighestId(), 0)
-
-        # 1 files
-        self.mlog.dirlist = ['000000001.qlog']
-        self.assertEqual(self.mlog._findHighestId(), 1)
-
-        # 2 files
-        self.mlog.dirlist = ['000000001.qlog', '000000007.qlog']
-        self.assertEqual(self.mlog._findHighestId(), 7)
-
-        # more files
-        self.mlog.dirlist = ['000000001.qlog', '000000007.qlog', 'def', '000000009.qlog']
-        self.assertEqual(self.mlog._findHighestId(), 9)
+    def test_findHighestId(self):
+        # the initial id is seeded from the queue index of the logs dir
+        logpath = testcfg.getpath('logs')
+        files = ['abc', '000000001.qlog', '000000007.mlog', '000000009.qtxt']
+        self._removeLogs(logpath, files + fileutil.listdir(logpath, messagelog.mlog.log_pattern))
+        try:
+            # no file
+            self.assertEqual(self.mlog._findHighestId(), 0)
+
+            # irrevelant file
+            (logpath/'abc').touch()
+            queueindex.getIndex(logpath).rescan()
+            self.assertEqual(self.mlog._findHighestId(), 0)
+
+            # 1 files
+            (logpath/'000000001.qlog').touch()
+            queueindex.getIndex(logpath).rescan()
+            self.assertEqual(self.mlog._findHighestId(), 1)
+
+            # more files of mixed types
+            (logpath/'000000007.mlog').touch()
+            (logpath/'000000009.qtxt').touch()
+            queueindex.getIndex(logpath).rescan()
+            self.assertEqual(self.mlog._findHighestId(), 9)
+            self.assertEqual(self.mlog.getId(), '000000010')
+        finally:
+            self._removeLogs(logpath, files)
 
 
     def testLastIssued(self):
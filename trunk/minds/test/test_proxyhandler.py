@@ -2,18 +2,46 @@
 """
 
 import os.path
+import Queue
+import socket
+import StringIO
+import time
 import traceback
 import unittest
 
 from minds.safe_config import cfg as testcfg
+from minds import connpool
 from minds import messagelog
 from minds import proxyhandler
+from minds import queueindex
 from minds.util import fileutil
 from minds.util.multiblockfile import MbReader
 
 testpath = testcfg.getpath('testDoc')
 logpath = testcfg.getpath('logs')
 
+class MultiServerFixture(proxyhandler.ProxyHandlerFixture):
+    """ Connect to a new server stream from s_ins for each request """
+
+    def __init__(self, c_in, s_ins, **args):
+        self.s_ins = s_ins
+        proxyhandler.ProxyHandlerFixture.__init__(self, c_in, None, **args)
+
+    def _connect_to(self, netloc):
+        self.connect_dest = netloc
+        self.server_soc = fileutil.FileSocket(self.s_ins.pop(0), self.s_out)
+        return self.server_soc
+
+
+
+class SocketHandler(proxyhandler.ProxyHandler):
+    """ ProxyHandler on a socket that does not handle any request """
+    def __init__(self, connection, server=None):
+        self.connection = connection
+        self.server = server
+
+
+
 class TestProxyHandler(unittest.TestCase):
 
     # note that we uses proxyhandler.testHandleMlog() to run through most
@@ -31,6 +59,7 @@ class TestProxyHandler(unittest.TestCase):
         for f in files:
             try: (logpath/f).remove()
             except OSError: traceback.print_exc()
+        queueindex.getIndex(logpath).rescan()
         messagelog.mlog = messagelog.MsgLogger()    # reset currentId after cleanup()
 
 
@@ -80,6 +109,203 @@ class TestProxyHandler(unittest.TestCase):
         self.assertEqual(messagelog.mlog.currentId, 2)
 
 
+    def testUpstreamPool(self):
+        pool = connpool.ConnectionPool()
+        testServer = proxyhandler.TestServer(connpool=pool)
+        c_in = StringIO.StringIO('GET http://myhost/ HTTP/1.0\r\nHost: myhost\r\n\r\n')
+        s_in = StringIO.StringIO('HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: 5\r\n\r\nhello')
+        pHandler = proxyhandler.ProxyHandlerFixture(c_in, s_in, server=testServer)
+
+        # ask for keep-alive and return the connection to the pool
+        pHandler.s_out.seek(0)
+        self.assert_(pHandler.s_out.read().find('Connection: keep-alive') > 0)
+        self.assertEqual(pool.misses, 1)
+        self.assertEqual(pool.idle['myhost'][0][0], pHandler.server_soc)
+
+        # response delimited by connection close cannot be reused
+        pool = connpool.ConnectionPool()
+        testServer = proxyhandler.TestServer(connpool=pool)
+        c_in = StringIO.StringIO('GET http://myhost/ HTTP/1.0\r\nHost: myhost\r\n\r\n')
+        s_in = StringIO.StringIO('HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\nhello')
+        pHandler = proxyhandler.ProxyHandlerFixture(c_in, s_in, server=testServer)
+        self.assertEqual(pool.numIdle(), 0)
+
+
+    def testUpstreamPoolStale(self):
+        # the server has closed the pooled connection after it was checked alive
+        stale_out = StringIO.StringIO()
+        stale_soc = fileutil.FileSocket(StringIO.StringIO(''), stale_out)
+        pool = connpool.ConnectionPool()
+        pool.idle['myhost'] = [(stale_soc, time.time())]
+        backup = connpool._isAlive
+        connpool._isAlive = lambda soc: True
+        try:
+            testServer = proxyhandler.TestServer(connpool=pool)
+            c_in = StringIO.StringIO('GET http://myhost/ HTTP/1.0\r\nHost: myhost\r\n\r\n')
+            s_in = StringIO.StringIO('HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: 5\r\n\r\nhello')
+            pHandler = proxyhandler.ProxyHandlerFixture(c_in, s_in, server=testServer)
+        finally:
+            connpool._isAlive = backup
+
+        # request sent to a new connection instead of the pooled one
+        self.assertEqual(pool.hits, 1)
+        self.assert_(stale_out.closed)
+        self.assertEqual(stale_out.len, 0)          # nothing sent to it
+        self.assertEqual(pHandler.connect_dest, 'myhost')
+        pHandler.s_out.seek(0)
+        self.assert_(pHandler.s_out.read().find('GET / HTTP/1.0\r\n') == 0)
+
+        # the response is relayed and the new connection pooled
+        pHandler.c_out.seek(0)
+        self.assert_(pHandler.c_out.read().endswith('\r\n\r\nhello'))
+        self.assertEqual(pool.idle['myhost'][0][0], pHandler.server_soc)
+        self.assertEqual(messagelog.mlog.currentId, 2)
+
+
+    def testIsStale(self):
+        handler = SocketHandler(None)
+        soc, server = socket.socketpair()
+        try:
+            self.assert_(not handler._isStale(soc))
+            server.send('x')                            # unexpected data
+            self.assert_(handler._isStale(soc))
+        finally:
+            soc.close()
+            server.close()
+
+        soc, server = socket.socketpair()
+        try:
+            server.close()                              # closed by server
+            self.assert_(handler._isStale(soc))
+        finally:
+            soc.close()
+
+
+    def testClientKeepAlive(self):
+        # two pipelined requests, the last one ask to close
+        c_in = StringIO.StringIO(
+            'GET http://myhost/1 HTTP/1.1\r\nHost: myhost\r\nProxy-Connection: keep-alive\r\n\r\n'
+            'POST http://myhost/2 HTTP/1.1\r\nHost: myhost\r\nContent-Length: 3\r\nConnection: close\r\n\r\nabc'
+            )
+        s_ins = [
+            StringIO.StringIO('HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: 5\r\nConnection: close\r\n\r\nhello'),
+            StringIO.StringIO('HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nworld\r\n0\r\n\r\n'),
+        ]
+        pHandler = MultiServerFixture(c_in, s_ins)
+
+        # request body relayed
+        pHandler.s_out.seek(0)
+        s_out = pHandler.s_out.read()
+        self.assert_(s_out.find('POST /2 HTTP/1.1\r\n') > 0)
+        self.assert_(s_out.endswith('\r\n\r\nabc'))
+
+        # connection header rewritten for the client
+        pHandler.c_out.seek(0)
+        c_out = pHandler.c_out.read()
+        self.assertEqual(c_out,
+            'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: 5\r\nConnection: keep-alive\r\n\r\nhello'
+            'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n5\r\nworld\r\n0\r\n\r\n'
+            )
+
+        # each message logged separately (POST is not logged)
+        self.assertEqual(messagelog.mlog.currentId, 2)
+        fp = messagelog.mlog._getMsgLogPath('000000001').open('rb')
+        try:
+            self.assertEqual(MbReader(fp).read(),
+                'GET http://myhost/1 HTTP/1.1\r\nHost: myhost\r\nProxy-Connection: keep-alive\r\n\r\n')
+        finally:
+            fp.close()
+
+
+    def testClientKeepAliveNotDelimited(self):
+        # response delimited by connection close has to close the client connection
+        c_in = StringIO.StringIO(
+            'GET http://myhost/1 HTTP/1.1\r\nHost: myhost\r\n\r\n'
+            'GET http://myhost/2 HTTP/1.1\r\nHost: myhost\r\n\r\n'
+            )
+        s_ins = [
+            StringIO.StringIO('HTTP/1.0 200 OK\r\nContent-Type: text/html\r\n\r\nhello'),
+            StringIO.StringIO('HTTP/1.0 200 OK\r\nContent-Type: text/html\r\n\r\nworld'),
+        ]
+        pHandler = MultiServerFixture(c_in, s_ins)
+        pHandler.c_out.seek(0)
+        self.assertEqual(pHandler.c_out.read(), 'HTTP/1.0 200 OK\r\nContent-Type: text/html\r\nConnection: close\r\n\r\nhello')
+        self.assertEqual(messagelog.mlog.currentId, 2)
+
+
+    def testResponseExcess(self):
+        # data after the end of response, e.g. the next pipelined response
+        body = 'a' * 10000
+        c_in = StringIO.StringIO('GET http://myhost/ HTTP/1.1\r\nHost: myhost\r\n\r\n')
+        s_in = StringIO.StringIO('HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: %s\r\n\r\n%sHTTP/1.1 200 OK' % (len(body), body))
+        pHandler = proxyhandler.ProxyHandlerFixture(c_in, s_in)
+
+        pHandler.c_out.seek(0)
+        self.assert_(pHandler.c_out.read().endswith('\r\n\r\n' + body))
+
+        # only the body of this response is recorded
+        self.assertEqual(messagelog.mlog.currentId, 2)
+        fp = messagelog.mlog._getMsgLogPath('000000001').open('rb')
+        try:
+            MbReader(fp).complete()                     # request
+            MbReader(fp).complete()                     # response header
+            self.assertEqual(MbReader(fp).read(len(body)+100), body)
+        finally:
+            fp.close()
+
+
+    def testWaitNextRequest(self):
+        class Pool:
+            queue = Queue.Queue()
+        class Server:
+            pool = Pool()
+
+        connection, client = socket.socketpair()
+        handler = SocketHandler(connection, Server())
+        try:
+            # the next request arrives
+            client.send('GET')
+            self.assert_(handler._waitNextRequest())
+            handler.connection.recv(3)
+
+            # give up the worker thread for a waiting connection
+            Pool.queue.put('new connection')
+            t0 = time.time()
+            self.assert_(not handler._waitNextRequest())
+            self.assert_(time.time() - t0 < 2)
+        finally:
+            handler.connection.close()
+            client.close()
+
+
+    def testEarlyDiscard(self):
+        body = 'GIF89a' + '\0' * 2000
+        c_in = StringIO.StringIO('GET http://myhost/a.gif HTTP/1.0\r\nHost: myhost\r\n\r\n')
+        s_in = StringIO.StringIO('HTTP/1.0 200 OK\r\nContent-Type: image/gif\r\nContent-Length: %s\r\n\r\n%s' % (len(body), body))
+        pHandler = proxyhandler.ProxyHandlerFixture(c_in, s_in)
+
+        # response relayed to client but not recorded
+        pHandler.c_out.seek(0)
+        self.assert_(pHandler.c_out.read().endswith(body))
+        self.assert_(pHandler.earlyDiscard)
+        self.assert_(pHandler.logfp.cursize < 100)
+        self.assertEqual(pHandler.minfo.ctype, 'gif')
+        self.assertEqual(pHandler.minfo.discard, True)
+        self.assertEqual(messagelog.mlog.currentId, None)
+
+
+    def testEarlyDiscardDomain(self):
+        from minds import domain_filter
+        backup = domain_filter.g_exdm
+        domain_filter.g_exdm = ['.creativecommons.org', 'creativecommons.org']
+        try:
+            pHandler = proxyhandler.testHandleMlog(testpath/'creative_commons.qlog')
+        finally:
+            domain_filter.g_exdm = backup
+        self.assert_(pHandler.earlyDiscard)
+        self.assertEqual(messagelog.mlog.currentId, None)
+
+
     def testHandlerOverflow(self):
 
         backup = testcfg.cparser.get('messagelog', 'max_messagelog')
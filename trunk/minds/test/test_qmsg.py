@@ -12,8 +12,10 @@ import PyLucene
 from minds.safe_config import cfg as testcfg
 from minds import messagelog
 from minds import qmsg_processor
+from minds import queueindex
 from minds import distillML
 from minds import docarchive
+from minds import index_maintenance
 from minds import lucene_logic
 from minds.util import fileutil
 from minds.util import patterns_tester
@@ -403,6 +405,7 @@ class TestQmsg(unittest.TestCase):
         for f in files:
             try: (self.logpath/f).remove()
             except OSError: traceback.print_exc()
+        queueindex.getIndex(self.logpath).rescan()
 
 
 
@@ -424,6 +427,7 @@ class TestQmsg(unittest.TestCase):
             dest = '%09d.qlog' % (i+1)
             queued.append(dest)
             (testpath/src).copy(self.logpath/dest)
+        queueindex.getIndex(self.logpath).rescan()
 
         return queued
 
@@ -438,6 +442,19 @@ class TestQmsg(unittest.TestCase):
 
 
     def testTransformDocs(self):
+        self._testTransformDocs(qmsg_processor.TransformProcess(workers=0))
+
+
+
+    def testTransformDocsParallel(self):
+        try:
+            self._testTransformDocs(qmsg_processor.TransformProcess(workers=2))
+        finally:
+            qmsg_processor.stopWorkerPool()
+
+
+
+    def _testTransformDocs(self, process):
 
         TEST_FILES = [
             '200(getopt_org).mlog',         # 1
@@ -463,7 +480,7 @@ class TestQmsg(unittest.TestCase):
         # -------------------------------------
         # This is the main process to be tested
         # -------------------------------------
-        transformed, discarded = qmsg_processor.TransformProcess().run(self.logpath, invalid_entries + queued)
+        transformed, discarded = process.run(self.logpath, invalid_entries + queued)
 
         self.assertEqual(3, transformed)
         self.assertEqual(4, discarded)                              # 3 bad + 1 invalid + 1 empty
@@ -480,6 +497,14 @@ class TestQmsg(unittest.TestCase):
 
 
     def test_discarded_archived(self):
+        self._test_discarded_archived(qmsg_processor.IndexProcess())
+
+
+    def test_discarded_archived_bulk(self):
+        self._test_discarded_archived(qmsg_processor.BulkIndexProcess())
+
+
+    def _test_discarded_archived(self, process):
 
         # add a doc to index that matches creative_commons.qlog's etag
         writer = lucene_logic.Writer(self.indexpath)
@@ -498,7 +523,7 @@ class TestQmsg(unittest.TestCase):
             '000000002.qtxt',
             '000000003.qtxt',                                       # archived(v=W/13865) found in freshdocs
         ]
-        indexed, discarded = qmsg_processor.IndexProcess().run(self.logpath, queued)
+        indexed, discarded = process.run(self.logpath, queued)
         self.assertEqual(1, indexed)
         self.assertEqual(2, discarded)
 
@@ -507,6 +532,14 @@ class TestQmsg(unittest.TestCase):
 
 
     def test_indexDocs(self):
+        self._test_indexDocs(qmsg_processor.IndexProcess())
+
+
+    def test_indexDocsBulk(self):
+        self._test_indexDocs(qmsg_processor.BulkIndexProcess(mergeFactor=2, minMergeDocs=2))
+
+
+    def _test_indexDocs(self, process):
 
         files = ['000000001.qtxt', '000000004.qtxt', '000000006.qtxt']
         for f in files:
@@ -517,7 +550,7 @@ class TestQmsg(unittest.TestCase):
         # -------------------------------------
         # This is the main process to be tested
         # -------------------------------------
-        numIndexed, numDiscarded = qmsg_processor.IndexProcess().run(self.logpath, invalid_entries + files)
+        numIndexed, numDiscarded = process.run(self.logpath, invalid_entries + files)
 
         self.assertEqual(3, numIndexed)
 
@@ -559,6 +592,43 @@ class TestQmsg(unittest.TestCase):
         self._check_archive_doc('000999002', 'All rights reserved.', 'date: 2000-01-01T12:34:56Z')
 
 
+    def test_indexDocsLocked(self):
+        files = ['000000001.qtxt', '000000004.qtxt']
+        for f in files:
+            (testpath/f).copy(self.logpath/f)
+
+        # index_maintenance is optimizing
+        lock = index_maintenance.IndexLock(self.indexpath)
+        self.assert_(lock.acquire())
+        try:
+            self.assertEqual(qmsg_processor.IndexProcess().run(self.logpath, files), (0,0))
+            self.assertEqual(qmsg_processor.BulkIndexProcess().run(self.logpath, files), (0,0))
+        finally:
+            lock.release()
+        for f in files:
+            self.assert_((self.logpath/f).exists(), f)
+
+
+    def test_indexDocsBulkFailed(self):
+
+        files = ['000000001.qtxt', '000000004.qtxt', '000000006.qtxt']
+        for f in files:
+            (testpath/f).copy(self.logpath/f)
+
+        # the index phase fails after the documents are archived
+        def fail(docs):
+            raise IOError('index failed')
+        process = qmsg_processor.BulkIndexProcess()
+        process._indexAll = fail
+        self.assertRaises(IOError, process.run, self.logpath, files)
+
+        # nothing is removed from the queue
+        for f in files:
+            self.assert_((self.logpath/f).exists(), f)
+        self.assertEqual(0, process.numIndexed)
+
+
+
     def test_backgroundIndexTask(self):
 
         TEST_FILES = [
@@ -0,0 +1,138 @@
+"""
+"""
+
+import unittest
+
+from minds.safe_config import cfg as testcfg
+from minds import queueindex
+
+
+class QueueIndexFixture(queueindex.QueueIndex):
+    """ overrides _listdir() to help test the directory scan """
+
+    def __init__(self, *args):
+        super(QueueIndexFixture,self).__init__(*args)
+        self.dirlist = []
+        self.scanned = 0
+
+    def _listdir(self):
+        self.scanned += 1
+        return self.dirlist
+
+
+
+class TestQueueIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.logpath = testcfg.getpath('logs')/'queueindex'
+        self.cleanup()
+        self.logpath.makedirs()
+
+
+    def tearDown(self):
+        self.cleanup()
+
+
+    def cleanup(self):
+        if self.logpath.exists():
+            self.logpath.rmtree()
+
+
+    def test_findHighestId(self):
+        index = QueueIndexFixture(self.logpath)
+
+        # no file
+        index.dirlist = []
+        index.rescan()
+        self.assertEqual(index.getHighestId(), 0)
+
+        # irrevelant file
+        index.dirlist = ['abc']
+        index.rescan()
+        self.assertEqual(index.getHighestId(), 0)
+
+        # 1 files
+        index.dirlist = ['000000001.qlog']
+        index.rescan()
+        self.assertEqual(index.getHighestId(), 1)
+
+        # 2 files
+        index.dirlist = ['000000001.qlog', '000000007.qlog']
+        index.rescan()
+        self.assertEqual(index.getHighestId(), 7)
+
+        # more files
+        index.dirlist = ['000000001.qlog', '000000007.mlog', 'def', '000000009.qtxt']
+        index.rescan()
+        self.assertEqual(index.getHighestId(), 9)
+
+
+    def test_queue(self):
+        index = QueueIndexFixture(self.logpath)
+        index.dirlist = ['000000001.qlog', '000000002.qtxt', '000000003.mlog', 'system.log']
+
+        self.assertEqual(index.getQueuedLogs(), ['000000001.qlog'])
+        self.assertEqual(index.getQueuedText(), ['000000002.qtxt'])
+        self.assertEqual(index.getHighestId(), 3)
+        self.assertEqual(index.scanned, 1)
+
+        index.add('000000004.qlog')
+        index.remove('000000001.qlog')
+        index.add('000000001.qtxt')
+        self.assertEqual(index.getQueuedLogs(), ['000000004.qlog'])
+        self.assertEqual(index.getQueuedText(), ['000000001.qtxt', '000000002.qtxt'])
+        self.assertEqual(index.numQueued(), 3)
+        self.assertEqual(index.getHighestId(), 4)
+        self.assertEqual(index.scanned, 1)      # no more scanning
+
+
+    def test_journal(self):
+        index = QueueIndexFixture(self.logpath)
+        index.dirlist = ['000000001.qlog', '000000002.qlog']
+        index.getQueuedLogs()
+        index.remove('000000001.qlog')
+        index.add('000000002.qtxt')
+        index.remove('000000002.qlog')
+        index.add('000000003.mlog')
+        index.close()
+
+        # reload from journal without scanning
+        index = QueueIndexFixture(self.logpath)
+        self.assertEqual(index.getQueuedLogs(), [])
+        self.assertEqual(index.getQueuedText(), ['000000002.qtxt'])
+        self.assertEqual(index.getHighestId(), 3)
+        self.assertEqual(index.scanned, 0)
+
+
+    def test_recovery(self):
+        index = QueueIndexFixture(self.logpath)
+        index.add('000000005.qlog')
+        index.remove('000000005.qlog')
+        # not closed, e.g. crashed
+
+        # rescan on restart but remember the highest id in the journal
+        index = QueueIndexFixture(self.logpath)
+        index.dirlist = ['000000002.qtxt']
+        self.assertEqual(index.getQueuedText(), ['000000002.qtxt'])
+        self.assertEqual(index.getHighestId(), 5)
+        self.assertEqual(index.scanned, 1)
+
+
+    def test_compact(self):
+        index = QueueIndexFixture(self.logpath)
+        for i in range(queueindex.COMPACT_MIN):
+            index.add('%09d.qlog' % i)
+            index.remove('%09d.qlog' % i)
+        index.add('000009999.qlog')
+        index.close()
+        lines = (self.logpath/queueindex.JOURNAL).lines()
+        self.assert_(len(lines) <= queueindex.COMPACT_MIN + 3, len(lines))
+
+        index = QueueIndexFixture(self.logpath)
+        self.assertEqual(index.getQueuedLogs(), ['000009999.qlog'])
+        self.assertEqual(index.scanned, 0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -46,6 +46,8 @@ class TestSearch(unittest.TestCase):
 
     def _cleanup(self):
         assert(self.apath == 'testdata/archive')    # avoid deleting wrong data in config goof
+        lucene_logic.closeAll()                     # release the shared searcher
+        docarchive.zipCache.closeAll()
         self.apath.rmtree()
 
 
@@ -90,5 +92,56 @@ class TestSearch(unittest.TestCase):
         #for r in result: print r.description, r.score, r.docid
 
 
+    def testResultCache(self):
+        search._hitCache.clear()
+        query = search.parseQuery('dummy')
+        length, result = search.search(query, 0, 1)
+        self.assertEqual(2, length)
+        self.assertEqual(['000000003'], [item.docid for item in result])
+        misses = search._hitCache.misses
+
+        # next page come from the cache
+        length, result = search.search(search.parseQuery('dummy'), 1, 2)
+        self.assertEqual(2, length)
+        self.assertEqual(['000000001'], [item.docid for item in result])
+        self.assertEqual(misses, search._hitCache.misses)
+        self.assertEqual(1, len(search._hitCache))
+
+        # the indexer commits a new document
+        _add_documents([('000000004', 'dummy content4')])
+        writer = lucene_logic.Writer(pathname=self.indexpath)
+        writer.addDocument('000000004', _makeMeta('u4', '2001-01-01T10:00:00Z', None, None), 'dummy content4')
+        writer.close()
+
+        length, result = search.search(query, 0, 10)
+        self.assertEqual(3, length)
+        self.assertEqual('000000004', result[0].docid)
+        self.assertEqual(misses+1, search._hitCache.misses)
+        self.assertEqual(1, len(search._hitCache))             # old generation cleared
+
+
+    def testTextCache(self):
+        search._textCache.clear()
+        query = search.parseQuery('dummy')
+        length, result = search.search(query, 0, 10)
+        self.assertEqual(2, len(search._textCache))
+        description = result[0].description
+
+        meta, text, headerLen = search.getDocumentText('000000003')
+        self.assertEqual(u'dummy content3', text[headerLen:])
+
+        # highlight again without reading the archive
+        get_document = docarchive.get_document
+        def no_archive(docid):
+            raise AssertionError('archive read %s' % docid)
+        docarchive.get_document = no_archive
+        try:
+            length, result = search.search(query, 0, 10)
+        finally:
+            docarchive.get_document = get_document
+        self.assertEqual(description, result[0].description)
+        self.assert_(result[0].description.find("<span class='highlight'>dummy</span>") >= 0)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""
+"""
+
+import time
+import unittest
+
+from minds.safe_config import cfg as testcfg
+from minds import messagelog
+from minds import queueindex
+from minds import streamtransform
+from minds.util import fileutil
+
+
+testpath = testcfg.getpath('testDoc')
+
+
+class TestStreamTransformer(unittest.TestCase):
+
+    def setUp(self):
+        self.logpath = testcfg.getpath('logs')
+        self.assertEqual(self.logpath, 'testlogs')
+        self.cleanup()
+        self.transformer = streamtransform.StreamTransformer(self.logpath, 0.5, 2.0)
+
+
+    def tearDown(self):
+        self.transformer.close(5)
+        self.cleanup()
+
+
+    def cleanup(self):
+        files = fileutil.listdir(self.logpath, queueindex.QLOG_PATTERN) + \
+                fileutil.listdir(self.logpath, queueindex.QTXT_PATTERN)
+        for f in files:
+            (self.logpath/f).remove()
+        queueindex.getIndex(self.logpath).rescan()
+        messagelog.mlog = messagelog.MsgLogger()
+
+
+    def test_transform(self):
+        # a backlog from last time
+        (testpath/'plaintext.mlog').copy(self.logpath/'000000001.qlog')
+        queueindex.getIndex(self.logpath).rescan()
+
+        self.transformer.start()
+        (testpath/'gif.qlog').copy(self.logpath/'000000002.qlog')
+        self.transformer.put('000000002.qlog')
+        (testpath/'200(getopt_org).mlog').copy(self.logpath/'000000003.qlog')
+        self.transformer.put('000000003.qlog')
+        self.transformer.put('000000004.qlog')                  # does not exist
+        process = self.transformer.process
+        for i in range(100):
+            if process.num_transformed + process.num_discarded >= 3 and not self.transformer.depth():
+                break
+            time.sleep(0.1)
+        self.transformer.close(10)
+
+        self.assertEqual(self.transformer.process.num_transformed, 2)
+        self.assertEqual(self.transformer.process.num_discarded, 1)
+        index = queueindex.getIndex(self.logpath)
+        self.assertEqual(index.getQueuedLogs(), [])
+        self.assertEqual(index.getQueuedText(), ['000000001.qtxt', '000000003.qtxt'])
+        self.assert_((self.logpath/'000000003.qtxt').exists())
+
+
+    def test_notify(self):
+        messagelog.mlog.transformer = self.transformer
+        messagelog.mlog._written('000000001', False)
+        self.assertEqual(self.transformer.depth(), 0)
+        messagelog.mlog._written('000000002', True)
+        self.assertEqual(self.transformer.depth(), 1)
+
+
+    def test_delay(self):
+        t = self.transformer
+        self.assertEqual(t._getDelay(), 0.0)                    # idle
+
+        t.lastTime -= 1.0
+        messagelog.mlog.numDisposed += 2                        # 2 requests/s
+        self.assertAlmostEqual(t._getDelay(), 1.0, 1)
+
+        t.lastTime -= 1.0
+        messagelog.mlog.numDisposed += 100                      # very busy
+        self.assertEqual(t._getDelay(), 2.0)                    # max_delay
+
+
+
+if __name__ == '__main__':
+    unittest.main()
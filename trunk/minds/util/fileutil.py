@@ -103,6 +103,53 @@ class RecordFile(FileFilter):
 
 
 
+class PrefixedFile(FileFilter):
+    """ Read prefix and then the rest of fp. Use it to put back data
+        already read from a stream that does not support seek().
+    """
+
+    def __init__(self, fp, prefix):
+        FileFilter.__init__(self, fp)
+        self.prefix = prefix
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.fp.read(size)
+        if size is None or size < 0:
+            data = self.prefix + self.fp.read()
+            self.prefix = ''
+        elif size < len(self.prefix):
+            data = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+        else:
+            data = self.prefix
+            self.prefix = ''
+        return data
+
+    def readline(self, size=-1):
+        if not self.prefix:
+            return self.fp.readline(size)
+        if size is None:
+            size = -1
+        i = self.prefix.find('\n') + 1
+        if i > 0 and (size < 0 or i <= size):
+            data = self.prefix[:i]
+            self.prefix = self.prefix[i:]
+            return data
+        if 0 <= size <= len(self.prefix):
+            return self.read(size)
+        # the line continues in fp
+        data = self.prefix
+        self.prefix = ''
+        if size < 0:
+            return data + self.fp.readline()
+        return data + self.fp.readline(size - len(data))
+
+    def readlines(self, *args):
+        return list(self)
+
+
+
 class BoundedFile(FileFilter):
     """ An output file those size is bounded by a cap. Node if the base
         file is text mode in Windows, the final size may exceed the cap
@@ -155,6 +202,9 @@ class FileSocket:
     def send(self, data, flags=0):
         self.fout.write(data)
 
+    def sendall(self, data, flags=0):
+        self.fout.write(data)
+
     def close(self):
         ''' a reasonable action '''
         self.fin.close()
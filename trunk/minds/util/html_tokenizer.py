@@ -0,0 +1,233 @@
+"""Usage: html_tokenizer.py filename
+
+A faster HTML tokenizer with the same contract as html_pull_parser.
+
+html_pull_parser feeds the document to sgmllib in chunks. sgmllib calls
+a handler method for every piece of data, tag and entity and copies the
+remaining buffer on every feed. Here the whole document is read and
+scanned with a few compiled regular expressions. The result is the same
+token stream as HtmlPullParser, including sgmllib's treatment of
+malformed markup, except that DATA may be split at different places.
+Declarations (<!DOCTYPE ...>, <![CDATA[...]]>) are rare and are handed
+to HtmlPullParser to get the identical result.
+
+html_pull_parser.generate_tokens() stops when a feed yields no token,
+e.g. when a document is truncated in its first tag or the first block is
+an unterminated comment. generate_tokens() here always tokenizes the
+whole document.
+
+indexing.html_tokenizer selects the tokenizer used by distillML. The
+encoding is sniffed by encode_tools without a tokenizer.
+"""
+
+import htmlentitydefs
+import re
+import sys
+
+from minds.util import html_pull_parser
+from minds.util.html_pull_parser import DATA, TAG, ENDTAG, COMMENT, BUFSIZE
+from toollib import sgmllib
+
+# sgmllib.attrfind, except a value must not contain < or > or begin with
+# an unmatched quote. Otherwise the tag is parsed the slow way.
+_ATTR = r"""\s*[a-zA-Z_][-:.a-zA-Z_0-9]*(?:\s*=\s*(?:'[^'<>]*'|"[^"<>]*"|(?!['"])[-a-zA-Z0-9./,:;+*%?!&$\(\)_#=~\'"@]*))?"""
+
+# The common cases are matched at the current position in one go.
+# (?=(x))\N matches x without backtracking into it, like the tagfind and
+# attrfind in sgmllib.
+_token = re.compile(r"""
+    ([^&<]+)                                        # 1 data
+  | <(?=([a-zA-Z][-_.a-zA-Z0-9]*))\2((?:(?=(%s))\4)*)\s*> # 2,3,4 start tag
+  | <([a-zA-Z][-_.a-zA-Z0-9]*)                      # 5 start tag with odd attributes
+  | </([^<>]*)(?:>|(?=<))                           # 6 end tag
+  | <!--(.*?)--\s*>                                 # 7 comment
+  | &\#([0-9]+|[xX][0-9a-fA-F]+);                   # 8 char ref
+  | &([a-zA-Z][-.a-zA-Z0-9]*)(?:;|(?=[^a-zA-Z0-9])) # 9 entity ref
+""" % _ATTR, re.S | re.X)
+
+_endbracket = sgmllib.endbracket
+_attrfind   = sgmllib.attrfind
+_incomplete = sgmllib.incomplete
+
+
+def _read_all(fp):
+    chunks = []
+    while True:
+        data = fp.read(BUFSIZE)
+        if not data:
+            break
+        chunks.append(data)
+    if len(chunks) == 1:
+        return chunks[0]
+    return ''.join(chunks)
+
+
+def _attr((attrname, rest, attrvalue)):
+    """ Make an attribute from the groups of sgmllib.attrfind """
+    if not rest:
+        attrvalue = attrname
+    elif attrvalue[:1] == '\'' == attrvalue[-1:] or \
+         attrvalue[:1] == '"' == attrvalue[-1:]:
+        attrvalue = attrvalue[1:-1]
+    return (attrname.lower(), attrvalue)
+
+
+def _parse_attrs(text, k, j):
+    """ Parse attributes from k up to the bracket at j like sgmllib """
+    attrs = []
+    # same as sgmllib, attrfind may run pass j
+    while k < j:
+        am = _attrfind.match(text, k)
+        if not am: break
+        attrs.append(_attr(am.group(1, 2, 3)))
+        k = am.end()
+    return attrs
+
+
+def tokenize(text, comment=False, keep_entity_ref={}):
+    """ Return the list of tokens of text as html_pull_parser would generate """
+
+    tokens = []
+    append = tokens.append
+    lasttag = '???'
+    decl_parser = None
+    i = 0
+    n = len(text)
+    while i < n:
+        # scanner.match() continues from where the last match ends
+        m = None
+        for m in iter(_token.scanner(text, i).match, None):
+            kind = m.lastindex
+            if kind == 1:
+                append((DATA, m.group(1)))
+
+            elif kind == 3:                         # start tag
+                tag, attrs = m.group(2, 3)
+                tag = lasttag = tag.lower()
+                if attrs:
+                    attrs = map(_attr, _attrfind.findall(attrs))
+                else:
+                    attrs = []
+                append((TAG, tag, attrs))
+
+            elif kind == 5:                         # start tag with odd attributes
+                k = m.end()
+                j = _endbracket.search(text, k)
+                if not j:
+                    append((DATA, text[m.start():]))  # incomplete
+                    i = n
+                    break
+                j = j.start()
+                tag = lasttag = m.group(5).lower()
+                append((TAG, tag, _parse_attrs(text, k, j)))
+                if text[j] == '>':
+                    j += 1
+                if j != k:
+                    i = j
+                    break                           # restart the scanner at j
+
+            elif kind == 6:
+                append((ENDTAG, m.group(6).strip().lower()))
+
+            elif kind == 7:
+                if comment:
+                    append((COMMENT, m.group(7)))
+
+            elif kind == 8:
+                name = m.group(8)
+                try:
+                    if name[:1].lower() == 'x':
+                        ch = int(name[1:],16)
+                    else:
+                        ch = int(name)
+                except ValueError:
+                    pass
+                else:
+                    append((DATA, unichr(ch)))
+
+            else:
+                ref = m.group(9)
+                if ref in keep_entity_ref:
+                    append((DATA, '&%s;' % ref))
+                else:
+                    ch = htmlentitydefs.name2codepoint.get(ref)
+                    if ch is not None:
+                        append((DATA, unichr(ch)))
+
+        else:
+            # Nothing matched at i. The less common cases, in the order
+            # of sgmllib.SGMLParser.goahead()
+            if m:
+                i = m.end()
+            if i >= n:
+                break
+            if text.startswith('<>', i):
+                append((TAG, lasttag, []))
+                i += 2
+                continue
+            if text.startswith('</', i) or text.startswith('<!--', i):
+                break                               # unterminated
+            if text.startswith('<?', i):
+                j = text.find('>', i+2)
+                if j < 0:
+                    break
+                i = j + 1
+                continue
+            if text.startswith('<!', i):
+                if not decl_parser:
+                    decl_parser = html_pull_parser.HtmlPullParser()
+                    decl_parser.rawdata = text
+                j = decl_parser.parse_declaration(i)
+                if j < 0:
+                    break
+                tokens.extend(decl_parser.stream)
+                decl_parser.stream = []
+                i = j
+                continue
+            im = _incomplete.match(text, i)
+            if not im:
+                append((DATA, text[i]))
+                i += 1
+                continue
+            j = im.end()
+            if j == n:
+                break
+            append((DATA, text[i:j]))
+            i = j
+
+    if i < n:
+        append((DATA, text[i:]))
+    return tokens
+
+
+
+def generate_tokens(fp, comment=False, keep_entity_ref=None):
+    """ Same as html_pull_parser.generate_tokens() """
+    if keep_entity_ref is None:
+        keep_entity_ref = {
+                            'gt' : 1,
+                            'lt' : 1,
+                            'amp': 1,
+                            }
+    return iter(tokenize(_read_all(fp), comment, keep_entity_ref))
+
+
+def generate_tokens3(fp, comment=False, keep_entity_ref=None, verbose=0):
+    """ Parse HTML and yield (kind, data, attrs). Same as html_pull_parser.generate_tokens3() """
+    if keep_entity_ref is None:
+        keep_entity_ref = {}
+    for token in tokenize(_read_all(fp), comment, keep_entity_ref):
+        if len(token) == 2:
+            yield (token[0], token[1], None)
+        else:
+            yield token
+
+
+def main(argv):
+    fp = file(argv[1],'rb')
+    for t in generate_tokens(fp):
+        print t
+
+
+if __name__ == '__main__':
+    main(sys.argv)
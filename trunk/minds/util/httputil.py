@@ -253,6 +253,132 @@ mime_map = {
 }
 
 
+# ----------------------------------------------------------------------
+# message framing
+# ----------------------------------------------------------------------
+
+# states of reading a chunked message body
+_CHUNK_SIZE, _CHUNK_DATA, _CHUNK_END, _CHUNK_TRAILER = range(1,5)
+
+class ResponseFraming(object):
+    """ Keep track of where a HTTP response body ends [RFC2616 4.4].
+        Feed the body data as it is received and check the done flag.
+
+        Attributes
+            done - the end of the message is reached
+            keep_alive - the connection can be reused for another
+                         request once the message is done
+    """
+
+    def __init__(self, command, status, version, headers):
+        """ version - 10 or 11 (as in httplib.HTTPResponse.version)
+            headers - dictionary with lowercase keys
+        """
+        self.done = False
+        self.chunked = False
+        self.remain = -1            # -1 means read until connection close
+        self.state = _CHUNK_SIZE
+        self.line = ''
+
+        tencoding = headers.get('transfer-encoding','').lower()
+        if command == 'HEAD' or (100 <= status < 200) or status in (204, 304):
+            self.remain = 0
+        elif 'chunked' in tencoding:
+            self.chunked = True
+        else:
+            try:
+                self.remain = int(headers.get('content-length',''))
+            except ValueError:
+                pass
+            if self.remain < 0:
+                self.remain = -1
+
+        tokens = [t.strip() for t in headers.get('connection','').lower().split(',')]
+        if self.chunked or self.remain >= 0:
+            if version >= 11:
+                self.keep_alive = 'close' not in tokens
+            else:
+                self.keep_alive = 'keep-alive' in tokens
+        else:
+            self.keep_alive = False
+
+        if self.remain == 0:
+            self.done = True
+
+
+    def isDelimitedByClose(self):
+        return not self.chunked and self.remain < 0
+
+
+    def skip(self, n):
+        """ Account for n bytes of non-chunked body that has been relayed
+            without going through feed().
+        """
+        if self.chunked or self.done or self.remain < 0:
+            return
+        self.remain -= min(n, self.remain)
+        if not self.remain:
+            self.done = True
+
+
+    def feed(self, data):
+        """ Return the number of bytes in data that belong to this
+            message. Any remaining data is beyond the end of message.
+        """
+        if self.done:
+            return 0
+
+        if not self.chunked:
+            if self.remain < 0:
+                return len(data)
+            n = min(len(data), self.remain)
+            self.remain -= n
+            if not self.remain:
+                self.done = True
+            return n
+
+        pos = 0
+        while pos < len(data) and not self.done:
+            if self.state == _CHUNK_DATA:
+                n = min(len(data)-pos, self.remain)
+                pos += n
+                self.remain -= n
+                if not self.remain:
+                    self.state = _CHUNK_END
+                continue
+
+            # the other states read a line
+            i = data.find('\n', pos)
+            if i < 0:
+                self.line += data[pos:]
+                return len(data)
+            line = (self.line + data[pos:i]).strip()
+            self.line = ''
+            pos = i+1
+
+            if self.state == _CHUNK_SIZE:
+                try:
+                    size = int(line.split(';',1)[0], 16)
+                except ValueError:
+                    # cannot make sense of it, fallback to read until close
+                    self.chunked = False
+                    self.remain = -1
+                    self.keep_alive = False
+                    return len(data)
+                if size > 0:
+                    self.state = _CHUNK_DATA
+                    self.remain = size
+                else:
+                    self.state = _CHUNK_TRAILER
+            elif self.state == _CHUNK_END:
+                self.state = _CHUNK_SIZE
+            elif not line:                  # _CHUNK_TRAILER ends with an empty line
+                self.done = True
+
+        return pos
+
+
+
 # ----------------------------------------------------------------------
 # testing
 # ----------------------------------------------------------------------
@@ -321,5 +447,61 @@ class TestHttputil(unittest.TestCase):
         self.assertEqual(canonicalize('ftp://h//a/b//c/'),      'ftp://h//a/b//c/')     # empty part part
 
 
+class TestResponseFraming(unittest.TestCase):
+
+    def _feed(self, framing, data, size=1):
+        """ feed data in pieces of size; return number of bytes consumed """
+        n = 0
+        for i in range(0, len(data), size):
+            n += framing.feed(data[i:i+size])
+        return n
+
+
+    def test_content_length(self):
+        f = ResponseFraming('GET', 200, 11, {'content-length': '5'})
+        self.assertEqual(f.feed('abc'), 3)
+        self.assert_(not f.done)
+        self.assertEqual(f.feed('defg'), 2)
+        self.assert_(f.done)
+        self.assert_(f.keep_alive)
+
+
+    def test_no_body(self):
+        self.assert_(ResponseFraming('HEAD', 200, 11, {'content-length': '5'}).done)
+        self.assert_(ResponseFraming('GET' , 304, 11, {}).done)
+        self.assert_(ResponseFraming('GET' , 204, 10, {}).done)
+
+
+    def test_read_until_close(self):
+        f = ResponseFraming('GET', 200, 11, {})
+        self.assert_(f.isDelimitedByClose())
+        self.assert_(not f.keep_alive)
+        self.assertEqual(f.feed('abc'), 3)
+        self.assert_(not f.done)
+
+
+    def test_keep_alive(self):
+        self.assert_(not ResponseFraming('GET', 200, 11, {'content-length': '1', 'connection': 'close'}).keep_alive)
+        self.assert_(not ResponseFraming('GET', 200, 10, {'content-length': '1'}).keep_alive)
+        self.assert_(ResponseFraming('GET', 200, 10, {'content-length': '1', 'connection': 'Keep-Alive'}).keep_alive)
+
+
+    def test_chunked(self):
+        body = '5;ext=1\r\nhello\r\nb\r\n, world 123\r\n0\r\nx-trailer: 1\r\n\r\n'
+        for size in [1, 3, 7, len(body)]:
+            f = ResponseFraming('GET', 200, 11, {'transfer-encoding': 'chunked'})
+            self.assertEqual(self._feed(f, body + 'NEXT', size), len(body))
+            self.assert_(f.done)
+            self.assert_(f.keep_alive)
+
+
+    def test_chunked_invalid(self):
+        f = ResponseFraming('GET', 200, 11, {'transfer-encoding': 'chunked'})
+        self.assertEqual(f.feed('xyz\r\nabc'), 8)
+        self.assert_(not f.done)
+        self.assert_(f.isDelimitedByClose())
+        self.assert_(not f.keep_alive)
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""A small least recently used cache
+"""
+
+import threading
+
+
+class LRUCache(object):
+    """ A dictionary of at most maxsize items. When it is full the least
+        recently used item is dropped. Thread safe.
+    """
+
+    # An entry is a list [prev, next, key, value] in a circular doubly
+    # linked list. root.next is the most recently used.
+    PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+    def __init__(self, maxsize=256, onEvict=None):
+        """ onEvict - optional function(key, value) called when an item
+                is dropped to make room. It is called outside the lock.
+        """
+        self.maxsize = max(maxsize, 1)
+        self.onEvict = onEvict
+        self.lock = threading.Lock()
+        self.clear()
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.map = {}
+            self.root = root = [None, None, None, None]
+            root[self.PREV] = root[self.NEXT] = root
+        finally:
+            self.lock.release()
+
+
+    def _unlink(self, entry):
+        prev, next = entry[self.PREV], entry[self.NEXT]
+        prev[self.NEXT] = next
+        next[self.PREV] = prev
+
+
+    def _linkFront(self, entry):
+        root = self.root
+        first = root[self.NEXT]
+        entry[self.PREV] = root
+        entry[self.NEXT] = first
+        first[self.PREV] = entry
+        root[self.NEXT] = entry
+
+
+    def get(self, key, default=None):
+        """ Return the value of key and mark it recently used """
+        self.lock.acquire()
+        try:
+            entry = self.map.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._unlink(entry)
+            self._linkFront(entry)
+            return entry[self.VALUE]
+        finally:
+            self.lock.release()
+
+
+    def put(self, key, value):
+        evicted = None
+        self.lock.acquire()
+        try:
+            entry = self.map.get(key)
+            if entry is not None:
+                entry[self.VALUE] = value
+                self._unlink(entry)
+                self._linkFront(entry)
+                return
+            if len(self.map) >= self.maxsize:
+                evicted = last = self.root[self.PREV]
+                self._unlink(last)
+                del self.map[last[self.KEY]]
+            entry = [None, None, key, value]
+            self._linkFront(entry)
+            self.map[key] = entry
+        finally:
+            self.lock.release()
+        if evicted and self.onEvict:
+            self.onEvict(evicted[self.KEY], evicted[self.VALUE])
+
+
+    def remove(self, key):
+        """ Remove key. Return its value or None if not found. """
+        self.lock.acquire()
+        try:
+            entry = self.map.pop(key, None)
+            if entry is None:
+                return None
+            self._unlink(entry)
+            return entry[self.VALUE]
+        finally:
+            self.lock.release()
+
+
+    def __contains__(self, key):
+        return key in self.map
+
+
+    def __len__(self):
+        return len(self.map)
+
+
+    def keys(self):
+        """ Keys from the most to the least recently used """
+        self.lock.acquire()
+        try:
+            result = []
+            entry = self.root[self.NEXT]
+            while entry is not self.root:
+                result.append(entry[self.KEY])
+                entry = entry[self.NEXT]
+            return result
+        finally:
+            self.lock.release()
+
+
+    def __str__(self):
+        return 'size=%s/%s hits=%s misses=%s' % (len(self.map), self.maxsize, self.hits, self.misses)
@@ -0,0 +1,177 @@
+"""Relay data between sockets without looking at it
+
+Used for HTTPS tunnels and for response bodies that are not logged. On
+Linux the data is moved inside the kernel using splice(2) through a pipe
+(Python has no os.splice, it is called via ctypes). Elsewhere, or when
+splice is not supported on the socket, it falls back to recv/sendall
+with a buffer that grows as long as the reads fill it up.
+"""
+
+import errno
+import logging
+import os
+import select
+import socket
+import sys
+
+log = logging.getLogger('relay')
+
+MIN_BUFSIZE = 8192
+MAX_BUFSIZE = 256*1024
+PIPE_SIZE = 65536                       # default pipe capacity in Linux
+
+SPLICE_F_MOVE = 1
+SPLICE_F_MORE = 4
+
+_splice = None
+if sys.platform.startswith('linux'):
+    try:
+        import ctypes
+        import ctypes.util
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        _splice = _libc.splice
+        _splice.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint]
+        _splice.restype = ctypes.c_ssize_t
+    except (ImportError, OSError, AttributeError):
+        _splice = None
+
+
+def has_splice():
+    return _splice is not None
+
+
+
+class SpliceNotSupported(Exception):
+    pass
+
+
+
+class Relay(object):
+    """ Copy data from one socket to another. Use one Relay object per
+        connection and call close() when done.
+
+        Attributes
+            spliced - number of bytes moved using splice()
+            copied  - number of bytes copied through Python strings
+    """
+
+    def __init__(self, use_splice=True):
+        self.use_splice = use_splice and has_splice()
+        self.pipe = None
+        self.bufsize = MIN_BUFSIZE
+        self.spliced = 0
+        self.copied = 0
+
+
+    def close(self):
+        if self.pipe:
+            os.close(self.pipe[0])
+            os.close(self.pipe[1])
+            self.pipe = None
+
+
+    def transfer(self, src, dst, size):
+        """ Move up to size bytes of data available from src to dst.
+            Block until some data is read. Return the number of bytes
+            moved, 0 means src is closed.
+        """
+        if self.use_splice:
+            try:
+                n = self._splice(src, dst, size)
+                self.spliced += n
+                return n
+            except SpliceNotSupported:
+                log.debug('splice not supported, fallback to copying')
+                self.use_splice = False
+
+        data = src.recv(min(size, self.bufsize))
+        if len(data) == self.bufsize and self.bufsize < MAX_BUFSIZE:
+            self.bufsize *= 2
+        dst.sendall(data)
+        self.copied += len(data)
+        return len(data)
+
+
+    def _splice(self, src, dst, size):
+        if not self.pipe:
+            self.pipe = os.pipe()
+        rfd, wfd = self.pipe
+
+        n = self._call_splice(src.fileno(), wfd, min(size, PIPE_SIZE), self.spliced == 0)
+        remain = n
+        while remain > 0:
+            remain -= self._call_splice(rfd, dst.fileno(), remain, False)
+        return n
+
+
+    def _call_splice(self, fd_in, fd_out, size, first):
+        while True:
+            n = _splice(fd_in, None, fd_out, None, size, SPLICE_F_MOVE|SPLICE_F_MORE)
+            if n >= 0:
+                return n
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            if err == errno.EAGAIN:
+                # socket with timeout is non-blocking underneath
+                select.select([fd_in], [fd_out], [], 1)
+                continue
+            if first and err in (errno.EINVAL, errno.ENOSYS):
+                raise SpliceNotSupported()
+            raise socket.error(err, os.strerror(err))
+
+
+    def copy(self, src, dst, size=-1, timeout=3, max_idling=20):
+        """ Relay from src to dst until size bytes is moved, src is
+            closed or no data arrive for timeout*max_idling seconds.
+            size=-1 means until closed. Return number of bytes moved.
+        """
+        total = 0
+        count = 0
+        while size < 0 or total < size:
+            if count >= max_idling:
+                break
+            count += 1
+            (ins, _, exs) = select.select([src], [], [src], timeout)
+            if exs: break
+            if not ins: continue
+            if size < 0:
+                n = self.transfer(src, dst, MAX_BUFSIZE)
+            else:
+                n = self.transfer(src, dst, size-total)
+            if not n:
+                break
+            total += n
+            count = 0
+        return total
+
+
+    def tunnel(self, soc1, soc2, timeout=3, max_idling=20):
+        """ Relay both ways until one side is closed or the connection
+            is idle for timeout*max_idling seconds.
+            Return bytes moved in (soc1 to soc2, soc2 to soc1).
+        """
+        sent = {soc1: 0, soc2: 0}
+        peer = {soc1: soc2, soc2: soc1}
+        iw = [soc1, soc2]
+        count = 0
+        while count < max_idling:
+            count += 1
+            (ins, _, exs) = select.select(iw, [], iw, timeout)
+            if exs: break
+            if not ins: continue
+            closed = False
+            for s in ins:
+                n = self.transfer(s, peer[s], MAX_BUFSIZE)
+                if not n:
+                    closed = True
+                    break
+                sent[s] += n
+            if closed:
+                break
+            count = 0
+        return sent[soc1], sent[soc2]
+
+
+    def __str__(self):
+        return 'spliced=%s copied=%s' % (self.spliced, self.copied)
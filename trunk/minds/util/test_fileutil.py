@@ -3,7 +3,7 @@ import unittest
 
 from minds.safe_config import cfg as testcfg
 from minds.util import fileutil
-from minds.util.fileutil import BoundedFile, RecordFile
+from minds.util.fileutil import BoundedFile, PrefixedFile, RecordFile
 
 testpath = testcfg.getpath('data')
 assert 'test' in testpath
@@ -66,6 +66,26 @@ class TestFileUtil(unittest.TestCase):
     self.assertEqual(f1.getvalue(), rec.getvalue())
 
 
+  def test_PrefixedFile(self):
+    data = "line1\nline2\nline3\n"
+    for n in range(len(data)+1):
+        fp = PrefixedFile(StringIO.StringIO(data[n:]), data[:n])
+        self.assertEqual(list(fp), data.splitlines(True))
+
+        fp = PrefixedFile(StringIO.StringIO(data[n:]), data[:n])
+        chunks = []
+        while True:
+            s = fp.read(4)
+            if not s: break
+            chunks.append(s)
+        self.assertEqual(''.join(chunks), data)
+
+        fp = PrefixedFile(StringIO.StringIO(data[n:]), data[:n])
+        self.assertEqual(fp.readline(3), 'lin')
+        self.assertEqual(fp.readline(9), 'e1\n')
+        self.assertEqual(fp.read(), data[6:])
+
+
   def test_shift_files(self):
     A = testpath / 'a'
     B = testpath / 'b'
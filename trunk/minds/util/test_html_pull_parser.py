@@ -50,9 +50,11 @@ class BaseTest(unittest.TestCase):
 
     DEBUG = 0
 
+    tokenizer = hpp
+
     def _test_generator(self, doc, expect, **args):
         fp = StringIO.StringIO(doc)
-        tokens = hpp.generate_tokens(fp, **args)
+        tokens = self.tokenizer.generate_tokens(fp, **args)
         self._test_generator1(tokens, expect)
 
 
@@ -71,7 +73,7 @@ class BaseTest(unittest.TestCase):
 class TestParser(BaseTest):
 
     def test_0(self):
-        tlist = list(hpp.generate_tokens(StringIO.StringIO("&#XE5;")))
+        tlist = list(self.tokenizer.generate_tokens(StringIO.StringIO("&#XE5;")))
         self.assertEqual(tlist, [(DATA, u'\u00e5')])
 
 
@@ -196,7 +198,7 @@ class TestSGMLPatch(BaseTest):
             chunks = [doc[:i], doc[i:]]
             #print chunks
             fp = ChunkedStringIO(chunks)
-            tokens = hpp.generate_tokens(fp)
+            tokens = self.tokenizer.generate_tokens(fp)
 
             self._test_generator1(
                 tokens,
@@ -0,0 +1,114 @@
+import StringIO
+import unittest
+
+from minds.util import html_pull_parser as hpp
+from minds.util import html_tokenizer
+from minds.util import rspreader
+from minds.util import test_html_pull_parser
+from toollib.path import path
+
+testdir = 'lib/testdocs/'
+
+
+def merge_data(tokens):
+    """ Join adjacent DATA. The two tokenizers may split DATA differently. """
+    result = []
+    for t in tokens:
+        if t[0] == hpp.DATA and result and result[-1][0] == hpp.DATA:
+            result[-1] = (hpp.DATA, result[-1][1] + t[1])
+        else:
+            result.append(t)
+    return result
+
+
+def parse_whole(data, **args):
+    """ Tokens from HtmlPullParser fed with the whole document """
+    parser = hpp.HtmlPullParser(**args)
+    parser.feed(data)
+    parser.close()
+    return parser.stream
+
+
+
+class TestParser(test_html_pull_parser.TestParser):
+    tokenizer = html_tokenizer
+
+
+class TestSGMLPatch(test_html_pull_parser.TestSGMLPatch):
+    tokenizer = html_tokenizer
+
+
+
+class TestEquivalence(unittest.TestCase):
+
+    def _test_doc(self, data):
+        for args in [
+            dict(keep_entity_ref={'gt':1, 'lt':1, 'amp':1}),
+            dict(keep_entity_ref={}, comment=True),
+            ]:
+            expect = merge_data(parse_whole(data, **args))
+            result = merge_data(html_tokenizer.tokenize(data, **args))
+            self.assertEqual(expect, result)
+
+
+    def test_malformed(self):
+        self._test_doc('<p a=1 b="2" c=\'3\' d>x</p><a b="<>">y</a>< b>&amp &#65; &#bad; &nbsp;z')
+        self._test_doc('<div>a<<>b<?pi x>c</div <!-- comment -- >d<!DOCTYPE html>e</x')
+        self._test_doc('<a href="unterminated>text')
+        self._test_doc('<p>text<!-- unterminated')
+
+
+    def test_testdocs(self):
+        files = [p for p in path(testdir).files() if p.ext in ('.html', '.qlog', '.mlog')]
+        self.assert_(files)
+        for p in sorted(files):
+            fp = p.open('rb')
+            try:
+                if p.ext == '.html':
+                    data = fp.read()
+                else:
+                    try:
+                        data = rspreader.ContentReader(fp, p).read()
+                    except Exception:
+                        continue    # not all test logs are readable
+            finally:
+                fp.close()
+            self._test_doc(data)
+
+
+
+class TestGenerateTokens(unittest.TestCase):
+    """ Compare generate_tokens() of the two tokenizers on broken input """
+
+    def _generate(self, tokenizer, data):
+        return merge_data(tokenizer.generate_tokens(StringIO.StringIO(data)))
+
+
+    def test_truncated(self):
+        for data in [
+            '<p>text<!-- unterminated',
+            '<a href="unterminated>text',
+            '<p>a</p><b',
+            '<p>a</',
+            'x&amp',
+            'x&#6',
+            '<p>\xff\x00<<>>&&;</p>',
+            ]:
+            self.assertEqual(self._generate(hpp, data), self._generate(html_tokenizer, data))
+
+
+    def test_early_stop(self):
+        # html_pull_parser stops if a feed yields no token. html_tokenizer
+        # does not replicate this and tokenizes the whole document.
+        for data, expect in [
+            ('<a href="x',                              [(hpp.DATA, '<a href="x')]),
+            ('<!-- x',                                  [(hpp.DATA, '<!-- x')]),
+            ('<!--' + 'x' * hpp.BUFSIZE + '-->text',    [(hpp.DATA, 'text')]),
+            ]:
+            self.assertEqual(self._generate(hpp, data), [])
+            self.assertEqual(self._generate(html_tokenizer, data), expect)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
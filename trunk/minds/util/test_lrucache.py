@@ -0,0 +1,66 @@
+import unittest
+
+from minds.util.lrucache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get_put(self):
+        cache = LRUCache(3)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('a', 0), 0)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), 2)
+        cache.put('a', 3)
+        self.assertEqual(cache.get('a'), 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.hits, 3)
+        self.assertEqual(cache.misses, 2)
+
+
+    def test_evict(self):
+        cache = LRUCache(3)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.put('c', 3)
+        self.assertEqual(cache.keys(), ['c','b','a'])
+
+        cache.get('a')                      # a is now most recently used
+        self.assertEqual(cache.keys(), ['a','c','b'])
+
+        cache.put('d', 4)                   # b is dropped
+        self.assertEqual(cache.keys(), ['d','a','c'])
+        self.assert_('b' not in cache)
+        self.assertEqual(len(cache), 3)
+
+
+    def test_onEvict(self):
+        evicted = []
+        cache = LRUCache(2, onEvict=lambda k,v: evicted.append((k,v)))
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.put('b', 3)                   # replace is not evict
+        self.assertEqual(evicted, [])
+        cache.put('c', 4)
+        self.assertEqual(evicted, [('a',1)])
+        cache.remove('b')                   # neither is remove
+        self.assertEqual(evicted, [('a',1)])
+
+
+    def test_remove_clear(self):
+        cache = LRUCache(3)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.remove('a'), 1)
+        self.assertEqual(cache.remove('a'), None)
+        self.assertEqual(cache.keys(), ['b'])
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.keys(), [])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+"""
+
+import socket
+import threading
+import unittest
+
+import relay
+
+
+def _socketpair():
+    """ Make a pair of connected TCP sockets """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    client.connect(listener.getsockname())
+    server, address = listener.accept()
+    listener.close()
+    return client, server
+
+
+def _recvall(soc):
+    data = []
+    while True:
+        d = soc.recv(65536)
+        if not d: break
+        data.append(d)
+    return ''.join(data)
+
+
+
+class TestRelay(unittest.TestCase):
+
+    DATA = ''.join([chr(i % 256) for i in xrange(300000)])
+
+    use_splice = False
+
+    def setUp(self):
+        # src_peer -> src ==relay==> dst -> dst_peer
+        self.src_peer, self.src = _socketpair()
+        self.dst, self.dst_peer = _socketpair()
+        self.relay = relay.Relay(self.use_splice)
+        self.sockets = [self.src_peer, self.src, self.dst, self.dst_peer]
+
+
+    def tearDown(self):
+        self.relay.close()
+        for s in self.sockets:
+            s.close()
+
+
+    def _send(self, soc, data, close=True):
+        def run():
+            soc.sendall(data)
+            if close:
+                soc.shutdown(socket.SHUT_WR)
+        t = threading.Thread(target=run)
+        t.setDaemon(True)
+        t.start()
+        return t
+
+
+    def _receive(self):
+        result = []
+        t = threading.Thread(target=lambda: result.append(_recvall(self.dst_peer)))
+        t.setDaemon(True)
+        t.start()
+        return t, result
+
+
+    def test_copy_until_close(self):
+        self._send(self.src_peer, self.DATA)
+        t, result = self._receive()
+        n = self.relay.copy(self.src, self.dst, -1, 1, 5)
+        self.dst.shutdown(socket.SHUT_WR)
+        t.join()
+        self.assertEqual(n, len(self.DATA))
+        self.assertEqual(result[0], self.DATA)
+        self.assertEqual(self.relay.spliced + self.relay.copied, len(self.DATA))
+
+
+    def test_copy_size(self):
+        # data beyond size is not consumed
+        self._send(self.src_peer, self.DATA, close=False)
+        t, result = self._receive()
+        n = self.relay.copy(self.src, self.dst, 100000, 1, 5)
+        self.dst.shutdown(socket.SHUT_WR)
+        t.join()
+        self.assertEqual(n, 100000)
+        self.assertEqual(result[0], self.DATA[:100000])
+        self.assertEqual(self.src.recv(10), self.DATA[100000:100010])
+
+
+    def test_tunnel(self):
+        # use dst as the second endpoint of the tunnel
+        self.dst_peer.sendall('pong' * 1000)
+        self._send(self.src_peer, self.DATA)
+        sent, received = self.relay.tunnel(self.src, self.dst, 1, 5)
+        self.assertEqual(sent, len(self.DATA))
+        self.assertEqual(received, 4000)
+        self.dst.close()
+        self.assertEqual(_recvall(self.dst_peer), self.DATA)
+
+
+
+class TestSpliceRelay(TestRelay):
+
+    use_splice = True
+
+    def test_splice_used(self):
+        if not relay.has_splice():
+            return
+        self._send(self.src_peer, 'hello')
+        t, result = self._receive()
+        self.relay.copy(self.src, self.dst, -1, 1, 5)
+        self.dst.shutdown(socket.SHUT_WR)
+        t.join()
+        self.assertEqual(result[0], 'hello')
+        self.assertEqual(self.relay.spliced, 5)
+        self.assertEqual(self.relay.copied, 0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import threading
+import unittest
+import zipfile
+
+from minds.safe_config import cfg as testcfg
+from minds.util import zipcache
+
+
+class TestZipCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = testcfg.getpath('data')/'zipcache'
+        if self.dir.exists():
+            self.dir.rmtree()
+        self.dir.makedirs()
+        self.cache = zipcache.ZipCache(2)
+
+
+    def tearDown(self):
+        self.cache.closeAll()
+        self.dir.rmtree()
+
+
+    def _makeZip(self, name, members, mode='w', compression=zipfile.ZIP_DEFLATED):
+        path = self.dir/name
+        zfile = zipfile.ZipFile(path, mode, compression)
+        for filename, data in members:
+            zfile.writestr(filename, data)
+        zfile.close()
+        return path
+
+
+    def test_read(self):
+        members = [('%03d' % i, 'content %s ' % i * i) for i in range(20)]
+        path = self._makeZip('a.zip', members)
+        for filename, data in members:
+            self.assertEqual(self.cache.read(path, filename), data)
+        self.assertEqual(self.cache.numOpened, 1)
+        self.assertEqual(sorted(self.cache.namelist(path)), [f for f,d in members])
+        self.assertRaises(KeyError, self.cache.read, path, '999')
+
+
+    def test_stored_and_comment(self):
+        path = self._makeZip('a.zip', [('001', 'stored data')], compression=zipfile.ZIP_STORED)
+        zfile = zipfile.ZipFile(path, 'a')
+        zfile.comment = 'a comment'
+        zfile.close()
+        self.assertEqual(self.cache.read(path, '001'), 'stored data')
+
+
+    def test_not_zip(self):
+        path = self.dir/'a.zip'
+        path.write_bytes('not a zip file')
+        self.assertRaises(zipcache.BadZipfile, self.cache.read, path, '001')
+        self.assertRaises(IOError, self.cache.read, self.dir/'none.zip', '001')
+
+
+    def test_max_open(self):
+        paths = [self._makeZip('%s.zip' % i, [('001', str(i))]) for i in range(3)]
+        for i, path in enumerate(paths):
+            self.assertEqual(self.cache.read(path, '001'), str(i))
+        self.assertEqual(len(self.cache.handles), 2)       # first one closed
+        self.assertEqual(self.cache.handles.keys(), [str(paths[2]), str(paths[1])])
+
+        self.assertEqual(self.cache.read(paths[0], '001'), '0')
+        self.assertEqual(self.cache.numOpened, 4)
+
+
+    def test_appended(self):
+        path = self._makeZip('a.zip', [('001', 'one')])
+        self.assertEqual(self.cache.read(path, '001'), 'one')
+        self._makeZip('a.zip', [('002', 'two')], mode='a')
+        self.assertEqual(self.cache.read(path, '002'), 'two')  # reopened
+        self.assertEqual(self.cache.numOpened, 2)
+
+        self.cache.invalidate(path)
+        self.assertEqual(len(self.cache.handles), 0)
+
+
+    def test_threads(self):
+        paths = [self._makeZip('%s.zip' % i, [('%03d' % j, '%s-%s' % (i,j)) for j in range(10)])
+                    for i in range(4)]
+        errors = []
+        def reader(n):
+            try:
+                for k in range(200):
+                    i, j = (n + k) % 4, k % 10
+                    data = self.cache.read(paths[i], '%03d' % j)
+                    if data != '%s-%s' % (i,j):
+                        errors.append(data)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=reader, args=(n,)) for n in range(5)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertEqual(errors, [])
+        self.assert_(len(self.cache.handles) <= 2)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,259 @@
+"""A cache of opened zip files for random access to their members.
+
+Opening a zip with zipfile.ZipFile parses the whole central directory and
+creates a ZipInfo for every member. toollib.zipfile_single avoids that
+but it scans the central directory again on every read. ZipCache keeps a
+bounded number of zip files open. The central directory of each is parsed
+once into a compact dictionary. A member is read by seeking to its local
+header.
+
+Only stored and deflated members are supported, which is what
+docarchive and the documentation zips use.
+"""
+
+import os
+import struct
+import threading
+import zlib
+
+from minds.util.lrucache import LRUCache
+
+
+class BadZipfile(Exception):
+    pass
+
+
+# end of central directory record, 22 bytes
+_structEndArchive = '<4s4H2LH'
+_stringEndArchive = 'PK\005\006'
+_sizeEndArchive = struct.calcsize(_structEndArchive)
+
+# central directory file header, 46 bytes
+_structCentralDir = '<4s4B4H3L5H2L'
+_stringCentralDir = 'PK\001\002'
+_sizeCentralDir = struct.calcsize(_structCentralDir)
+
+# local file header, 30 bytes
+_structFileHeader = '<4s2B4H3L2H'
+_stringFileHeader = 'PK\003\004'
+_sizeFileHeader = struct.calcsize(_structFileHeader)
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+
+def _findEndRecord(fp):
+    """ Return (offset of end record, central dir size, central dir offset) """
+    fp.seek(0, 2)
+    filesize = fp.tell()
+    # without archive comment, the end record is the last 22 bytes
+    start = max(filesize - _sizeEndArchive, 0)
+    fp.seek(start)
+    data = fp.read()
+    pos = -1
+    if data[:4] == _stringEndArchive:
+        pos = 0
+    else:
+        # search the comment of up to 64k
+        start = max(filesize - _sizeEndArchive - 65535, 0)
+        fp.seek(start)
+        data = fp.read()
+        pos = data.rfind(_stringEndArchive)
+    if pos < 0 or len(data) - pos < _sizeEndArchive:
+        raise BadZipfile('File is not a zip file')
+    endrec = struct.unpack(_structEndArchive, data[pos:pos+_sizeEndArchive])
+    return start + pos, endrec[5], endrec[6]
+
+
+def readDirectory(fp):
+    """ Parse the central directory. Return dictionary of
+        name -> (header offset, compress type, compress size, file size, CRC)
+    """
+    endpos, size_cd, offset_cd = _findEndRecord(fp)
+    # "concat" is non-zero if zip was concatenated to another file
+    concat = endpos - size_cd - offset_cd
+    fp.seek(offset_cd + concat)
+    data = fp.read(size_cd)
+    if len(data) != size_cd:
+        raise BadZipfile('Truncated central directory')
+
+    members = {}
+    pos = 0
+    while pos < size_cd:
+        centdir = struct.unpack(_structCentralDir, data[pos:pos+_sizeCentralDir])
+        if centdir[0] != _stringCentralDir:
+            raise BadZipfile('Bad magic number for central directory')
+        pos += _sizeCentralDir
+        name = data[pos:pos+centdir[12]]
+        pos += centdir[12] + centdir[13] + centdir[14]  # filename, extra, comment
+        members[name] = (centdir[18] + concat, centdir[6], centdir[10], centdir[11], centdir[9])
+    return members
+
+
+
+class ZipHandle(object):
+    """ An opened zip file with its parsed central directory """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.users = 0              # number of readers, maintained by ZipCache
+        self.dropped = False        # removed from ZipCache, close when users is 0
+        self.fp = file(path, 'rb')
+        try:
+            st = os.fstat(self.fp.fileno())
+            self.stamp = (st.st_size, st.st_mtime)
+            self.members = readDirectory(self.fp)
+        except:
+            self.fp.close()
+            raise
+
+
+    def isCurrent(self):
+        """ Return False if the file has been changed since it is opened """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        return (st.st_size, st.st_mtime) == self.stamp
+
+
+    def namelist(self):
+        return self.members.keys()
+
+
+    def read(self, name):
+        """ Return the data of member name. KeyError if not found.
+            ValueError if the handle is closed.
+        """
+        header_offset, compress_type, compress_size, file_size, crc = self.members[name]
+        self.lock.acquire()
+        try:
+            if not self.fp:
+                raise ValueError('ZipHandle closed: %s' % self.path)
+            self.fp.seek(header_offset)
+            fheader = self.fp.read(_sizeFileHeader)
+            if fheader[:4] != _stringFileHeader:
+                raise BadZipfile('Bad magic number for file header %s' % name)
+            fheader = struct.unpack(_structFileHeader, fheader)
+            # the extra field may differ from that of the central directory
+            self.fp.seek(header_offset + _sizeFileHeader + fheader[10] + fheader[11])
+            data = self.fp.read(compress_size)
+        finally:
+            self.lock.release()
+
+        if compress_type == ZIP_DEFLATED:
+            dc = zlib.decompressobj(-15)
+            data = dc.decompress(data) + dc.flush()
+        elif compress_type != ZIP_STORED:
+            raise BadZipfile('Unsupported compression method %s for %s' % (compress_type, name))
+        if len(data) != file_size or (zlib.crc32(data) & 0xffffffffL) != crc:
+            raise BadZipfile('Bad CRC-32 for file %s' % name)
+        return data
+
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            if self.fp:
+                self.fp.close()
+            self.fp = None
+        finally:
+            self.lock.release()
+
+
+
+class ZipCache(object):
+    """ Keep at most maxsize zip files open. The least recently used one
+        is closed to open another. A zip file that has been modified, e.g.
+        appended by docarchive.ArchiveHandler, is reopened. Thread safe.
+        A handle dropped while it is being read is closed after the read.
+
+        handleClass - the class to open a path with. It must have the
+            interface of ZipHandle.
+    """
+
+    def __init__(self, maxsize=16, handleClass=ZipHandle):
+        self.handleClass = handleClass
+        self.lock = threading.Lock()
+        self.handles = LRUCache(maxsize, onEvict=self._onEvict)
+        self.numOpened = 0
+
+
+    def _drop(self, handle):
+        # must hold self.lock
+        handle.dropped = True
+        if handle.users <= 0:
+            handle.close()
+
+
+    def _onEvict(self, path, handle):
+        # called from handles.put() in _acquire()
+        self._drop(handle)
+
+
+    def _acquire(self, path):
+        self.lock.acquire()
+        try:
+            handle = self.handles.get(path)
+            if handle and not handle.isCurrent():
+                self.handles.remove(path)
+                self._drop(handle)
+                handle = None
+            if not handle:
+                handle = self.handleClass(path)
+                self.numOpened += 1
+                self.handles.put(path, handle)
+            handle.users += 1
+            return handle
+        finally:
+            self.lock.release()
+
+
+    def _release(self, handle):
+        self.lock.acquire()
+        try:
+            handle.users -= 1
+            if handle.dropped:
+                self._drop(handle)
+        finally:
+            self.lock.release()
+
+
+    def read(self, path, name):
+        """ Return the data of member name in the zip file path.
+            KeyError if name is not found.
+        """
+        handle = self._acquire(str(path))
+        try:
+            return handle.read(name)
+        finally:
+            self._release(handle)
+
+
+    def namelist(self, path):
+        handle = self._acquire(str(path))
+        try:
+            return handle.namelist()
+        finally:
+            self._release(handle)
+
+
+    def invalidate(self, path):
+        """ Close path if it is open, e.g. after it has been written """
+        self.lock.acquire()
+        try:
+            handle = self.handles.remove(str(path))
+            if handle:
+                self._drop(handle)
+        finally:
+            self.lock.release()
+
+
+    def closeAll(self):
+        for path in self.handles.keys():
+            self.invalidate(path)
+
+
+    def __str__(self):
+        return 'open=%s opened=%s %s' % (len(self.handles), self.numOpened, self.handles)
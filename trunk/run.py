@@ -83,4 +83,9 @@ def main(argv):
 
 
 if __name__ == '__main__':
+    try:
+        import multiprocessing
+        multiprocessing.freeze_support()    # transform workers of the py2exe build
+    except ImportError:
+        pass
     main(sys.argv)
\ No newline at end of file